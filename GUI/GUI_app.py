@@ -1,25 +1,14 @@
 import tkinter as tk
 from tkinter import filedialog as fd
-from PIL import Image, ImageTk, ImageEnhance
+from PIL import ImageTk
 import pandas as pd
 import datetime as dt
 import face_recognition as fr
 import subprocess
-import pickle
-import concurrent.futures
 import os
-import numpy as np
-
-
-def preprocess_image(image):
-    pil_img = Image.fromarray(image)
-    enhancer = ImageEnhance.Brightness(pil_img)
-    pil_img = enhancer.enhance(1.2)
-    enhancer = ImageEnhance.Contrast(pil_img)
-    pil_img = enhancer.enhance(1.2)
-    enhancer = ImageEnhance.Sharpness(pil_img)
-    pil_img = enhancer.enhance(1.1)
-    return np.array(pil_img)
+from face_recognition_module import preprocess_image, precompute_student_encodings, read_student_csv, load_gallery
+from encoding_store import EncodingStoreError, migrate_pickle
+from my_config import ENCODING_STORE
 
 
 class SmartAttendanceApp:
@@ -131,30 +120,9 @@ class SmartAttendanceApp:
 
         recognized_reg_nos = set()
 
-        for unknown_encoding in unknown_encodings:
-            if not isinstance(unknown_encoding, np.ndarray):
-                unknown_encoding = np.array(unknown_encoding)
-            if unknown_encoding.ndim != 1:
-                unknown_encoding = unknown_encoding.flatten()
-
-            best_match = None
-            best_distance = 1.0
-
-            for reg_no, known_encodings in self.student_encodings.items():
-                distances = []
-                for known_encoding in known_encodings:
-                    if not isinstance(known_encoding, np.ndarray):
-                        known_encoding = np.array(known_encoding)
-                    if known_encoding.ndim != 1:
-                        known_encoding = known_encoding.flatten()
-                    d = fr.face_distance([known_encoding], unknown_encoding)[0]
-                    distances.append(d)
-                if distances:
-                    student_min_distance = min(distances)
-                    if student_min_distance < best_distance:
-                        best_distance = student_min_distance
-                        best_match = reg_no
+        matches = self.student_encodings.best_matches(unknown_encodings)
 
+        for best_match, best_distance in matches:
             if best_distance < 0.5:
                 recognized_reg_nos.add(best_match)
             else:
@@ -183,39 +151,29 @@ class SmartAttendanceApp:
         self.abs_df = pd.DataFrame(absentees, columns=['Reg No', 'Name'])
 
     def load_student_encodings(self):
-        df = pd.read_csv('Student.csv')
-        self.reg_no_to_name = dict(zip(df['Reg No'], df['Name']))
-        if os.path.exists("student_encodings.pkl"):
-            with open("student_encodings.pkl", "rb") as f:
-                return pickle.load(f)
+        df, self.reg_no_to_name = read_student_csv('Student.csv')
+        if os.path.exists(ENCODING_STORE['path']):
+            try:
+                return load_gallery(ENCODING_STORE['path'])
+            except EncodingStoreError as e:
+                self.update_log(f"[Warning] {e}. Creating encodings again...")
+        elif os.path.exists(ENCODING_STORE['legacy_pickle']):
+            return migrate_pickle(ENCODING_STORE['legacy_pickle'], ENCODING_STORE['path'])
         else:
             self.update_log("[Warning] No precomputed encodings found. Creating them now...")
-            return self.precompute_student_encodings(df)
+        return self.precompute_student_encodings(df)
 
     def precompute_student_encodings(self, df):
-        encodings_dict = {}
+        def progress(done, total, image_path):
+            self.update_log(f"[Log] Encoded {done}/{total}: {os.path.basename(image_path)}")
+            self.master.update_idletasks()
 
-        def encode_face(image_path):
-            try:
-                image = fr.load_image_file(image_path)
-                image = preprocess_image(image)
-                encodings = fr.face_encodings(image, model="cnn")
-                return encodings if encodings else []
-            except Exception as e:
-                self.update_log(f"[Warning] Error processing {image_path}: {e}")
-                return []
-
-        for _, row in df.iterrows():
-            stud_paths = row['File Paths'].split(',')
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                results = list(executor.map(encode_face, stud_paths))
-            encodings_dict[row['Reg No']] = [enc for sublist in results for enc in sublist]
-
-        with open("student_encodings.pkl", "wb") as f:
-            pickle.dump(encodings_dict, f)
-
-        self.update_log("[Log] Student encodings precomputed and saved.")
-        return encodings_dict
+        gallery, report = precompute_student_encodings(df, progress=progress)
+        for image_path, error in report.failures:
+            self.update_log(f"[Warning] Error processing {image_path}: {error}")
+
+        self.update_log(f"[Log] Student encodings precomputed and saved: {report}.")
+        return gallery
 
     def download_file(self):
         if self.pr_df.empty and self.abs_df.empty:
@@ -0,0 +1,193 @@
+import argparse
+import csv
+import datetime
+import os
+import sqlite3
+from my_config import DATABASE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    reg_no TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    source TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS marks (
+    session_id INTEGER NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    reg_no TEXT NOT NULL REFERENCES students(reg_no),
+    date TEXT NOT NULL,
+    present INTEGER NOT NULL,
+    PRIMARY KEY (session_id, reg_no)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS marks_reg_no_date ON marks (reg_no, date, present);
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date);
+"""
+
+
+def _today():
+    return datetime.date.today().isoformat()
+
+
+class AttendanceStore:
+
+    # marks carries the session date as well, so per-student history over a
+    # date range is answered from the (reg_no, date) index without a join.
+    def __init__(self, db_file=DATABASE['db_file']):
+
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        self._synced_roster = None
+
+
+    def close(self):
+
+        self.conn.close()
+
+
+    def sync_students(self, reg_no_to_name):
+
+        with self.conn:
+            self._upsert_students(reg_no_to_name)
+
+
+    def _upsert_students(self, reg_no_to_name):
+
+        if reg_no_to_name == self._synced_roster:
+            return
+        self._synced_roster = dict(reg_no_to_name)
+        self.conn.executemany("INSERT INTO students (reg_no, name) VALUES (?, ?) "
+                              "ON CONFLICT(reg_no) DO UPDATE SET name = excluded.name",
+                              reg_no_to_name.items())
+
+
+    def record_session(self, recognized_reg_nos, reg_no_to_name, name=None, date=None, source=None):
+        # One transaction: roster upsert, the session row and a mark for every
+        # student on the roster.
+        date = date or _today()
+        try:
+            with self.conn:
+                self._upsert_students(reg_no_to_name)
+                cursor = self.conn.execute("INSERT INTO sessions (name, date, source, created_at) "
+                                           "VALUES (?, ?, ?, ?)",
+                                           (name or date, date, source,
+                                            datetime.datetime.now().isoformat(timespec='seconds')))
+                session_id = cursor.lastrowid
+                self.conn.executemany("INSERT INTO marks (session_id, reg_no, date, present) VALUES (?, ?, ?, ?)",
+                                      ((session_id, reg_no, date, int(reg_no in recognized_reg_nos))
+                                       for reg_no in reg_no_to_name))
+        except sqlite3.Error:
+            self._synced_roster = None
+            raise
+        return session_id
+
+
+    def session_counts(self, session_id):
+
+        row = self.conn.execute("SELECT COALESCE(SUM(present), 0), COUNT(*) FROM marks WHERE session_id = ?",
+                                (session_id,)).fetchone()
+        return row[0], row[1] - row[0]
+
+
+    def session_marks(self, session_id, present):
+
+        return self.conn.execute("SELECT m.reg_no, s.name FROM marks m JOIN students s ON s.reg_no = m.reg_no "
+                                 "WHERE m.session_id = ? AND m.present = ? ORDER BY m.reg_no",
+                                 (session_id, int(present)))
+
+
+    def export_session(self, session_id, presentees_file=None, absentees_file=None):
+
+        for path, present in ((presentees_file, True), (absentees_file, False)):
+            if not path:
+                continue
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["Reg No", "Name"])
+                writer.writerows(self.session_marks(session_id, present))
+
+
+    def absence_counts(self, min_absences=1, start=None, end=None):
+        # Students absent at least min_absences times in [start, end]. The
+        # aggregate runs over the covering (reg_no, date, present) index
+        # before names are joined in.
+        clauses, params = [], []
+        if start:
+            clauses.append("date >= ?")
+            params.append(start)
+        if end:
+            clauses.append("date <= ?")
+            params.append(end)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        params.append(min_absences)
+        return self.conn.execute(
+            "SELECT a.reg_no, s.name, a.absences, a.sessions FROM "
+            "(SELECT reg_no, COUNT(*) - SUM(present) AS absences, COUNT(*) AS sessions "
+            f"FROM marks {where} GROUP BY reg_no) a "
+            "JOIN students s ON s.reg_no = a.reg_no WHERE a.absences >= ? "
+            "ORDER BY a.absences DESC, a.reg_no",
+            params).fetchall()
+
+
+    def sessions(self, start=None, end=None):
+
+        return self.conn.execute("SELECT session_id, name, date, source FROM sessions "
+                                 "WHERE date >= ? AND date <= ? ORDER BY date, session_id",
+                                 (start or "0000-00-00", end or "9999-99-99")).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the attendance database.")
+    parser.add_argument("--db", default=DATABASE['db_file'], help="Attendance database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sessions_parser = commands.add_parser("sessions", help="List recorded sessions")
+    sessions_parser.add_argument("--since", default=None, help="First date (YYYY-MM-DD)")
+    sessions_parser.add_argument("--until", default=None, help="Last date (YYYY-MM-DD)")
+
+    absentees_parser = commands.add_parser("absentees", help="Students absent more than N times")
+    absentees_parser.add_argument("--more-than", type=int, default=0, help="Absence count to exceed")
+    absentees_parser.add_argument("--since", default=DATABASE.get('term_start'), help="First date (YYYY-MM-DD)")
+    absentees_parser.add_argument("--until", default=None, help="Last date (YYYY-MM-DD)")
+    absentees_parser.add_argument("--output", default=None, help="Write the list to this CSV file")
+
+    export_parser = commands.add_parser("export", help="Export one session as presentee/absentee CSVs")
+    export_parser.add_argument("session_id", type=int)
+    export_parser.add_argument("--output", default=".", help="Directory for the CSV files")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"no attendance database at {args.db}")
+    store = AttendanceStore(args.db)
+    if args.command == "sessions":
+        for session_id, name, date, source in store.sessions(args.since, args.until):
+            print(f"{session_id}\t{date}\t{name}\t{source or ''}")
+    elif args.command == "absentees":
+        rows = store.absence_counts(args.more_than + 1, args.since, args.until)
+        if args.output:
+            with open(args.output, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["Reg No", "Name", "Absences", "Sessions"])
+                writer.writerows(rows)
+            print(f"[Log] {len(rows)} students written to {args.output}")
+        else:
+            for reg_no, name, absences, sessions in rows:
+                print(f"{reg_no}\t{name}\t{absences}/{sessions}")
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        prefix = os.path.join(args.output, f"session_{args.session_id}")
+        store.export_session(args.session_id, prefix + "_presentees.csv", prefix + "_absentees.csv")
+        print(f"[Log] Session {args.session_id} exported to {prefix}_*.csv")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
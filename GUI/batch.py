@@ -0,0 +1,174 @@
+import argparse
+import glob
+import os
+import pandas as pd
+from PIL import Image
+from face_recognition_module import load_student_encodings, detect_images_parallel, match_faces, build_attendance
+from video_attendance import VIDEO_EXTENSIONS, is_video, recognize_faces_in_video
+from attendance_db import AttendanceStore
+from rejections import RejectionMemory
+from session import recognize_session
+from sections import read_sections, scope_roster
+from my_config import DATABASE, REJECTIONS
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+REVIEW_COLUMNS = ["Photo", "Reg No", "Name", "Distance", "Top", "Right", "Bottom", "Left", "Crop"]
+
+
+def collect_photos(inputs):
+    photos = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = [os.path.join(item, name) for name in sorted(os.listdir(item))]
+        else:
+            matches = sorted(glob.glob(item)) or [item]
+        photos.extend(p for p in matches if p.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS))
+    return list(dict.fromkeys(photos))
+
+
+def save_review_crops(image_path, candidates, reg_no_to_name, review_dir, image=None):
+    rows = []
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    if image is None:
+        image = Image.open(image_path).convert("RGB")
+    for i, (_, reg_no, distance, face_location) in enumerate(candidates):
+        top, right, bottom, left = face_location
+        crop_path = os.path.join(review_dir, f"{stem}_{i}_{reg_no}.jpg")
+        image.crop((left, top, right, bottom)).save(crop_path)
+        rows.append([image_path, reg_no, reg_no_to_name.get(reg_no, "Unknown"), round(distance, 4),
+                     top, right, bottom, left, crop_path])
+    return rows
+
+
+def write_attendance(output_dir, prefix, recognized_reg_nos, reg_no_to_name):
+    pr_df, abs_df = build_attendance(recognized_reg_nos, reg_no_to_name)
+    pr_df.to_csv(os.path.join(output_dir, f"{prefix}_presentees.csv"), sep=",", index=False, encoding="utf-8")
+    abs_df.to_csv(os.path.join(output_dir, f"{prefix}_absentees.csv"), sep=",", index=False, encoding="utf-8")
+    return pr_df, abs_df
+
+
+def run_batch(photos, output_dir, per_session=False, session=None, workers=None, student_csv='Student.csv',
+              expected_faces=None, db_file=DATABASE['db_file'], date=None, section=None):
+    review_dir = os.path.join(output_dir, "review")
+    os.makedirs(review_dir, exist_ok=True)
+
+    gallery, reg_no_to_name = load_student_encodings(student_csv)
+    if section:
+        # Matching, the absentee lists and the recorded sessions all cover
+        # the section's students only.
+        gallery, reg_no_to_name = scope_roster(gallery, reg_no_to_name, read_sections(student_csv), section)
+        print(f"[Log] Section {section}: {len(reg_no_to_name)} students, {len(gallery)} encodings.")
+    store = AttendanceStore(db_file) if db_file else None
+    rejections = RejectionMemory(REJECTIONS['path'])
+
+    session_reg_nos = set()
+    review_rows = []
+
+    def progress(done, total, image_path):
+        print(f"[Log] Processed {done}/{total}: {image_path}")
+
+    def record(image_path, recognized_reg_nos, candidates, image=None):
+        nonlocal session_reg_nos
+        # Faces an operator already rejected for that student are not listed
+        # for review again.
+        candidates = [c for c, rejected in zip(candidates, rejections.rejected(candidates))
+                      if c[3] is not None and not rejected]
+        if candidates:
+            review_rows.extend(save_review_crops(image_path, candidates, reg_no_to_name, review_dir, image))
+
+        session_reg_nos |= recognized_reg_nos
+        if not per_session:
+            prefix = os.path.splitext(os.path.basename(image_path))[0]
+            pr_df, abs_df = write_attendance(output_dir, prefix, recognized_reg_nos, reg_no_to_name)
+            print(f"[Log] {image_path}: Total Present: {len(pr_df)} | Total Absent: {len(abs_df)}")
+            if store:
+                store.record_session(recognized_reg_nos, reg_no_to_name, name=prefix, date=date, source=image_path)
+
+    videos = [p for p in photos if is_video(p)]
+    stills = [p for p in photos if not is_video(p)]
+
+    if per_session and len(stills) > 1:
+        # Faces seen in more than one photo are matched once, and each close
+        # match is listed for review once per student.
+        recognized_reg_nos, logs, candidates, strip = recognize_session(
+            stills, gallery, reg_no_to_name, expected_faces, progress=lambda stage: print(f"[Log] {stage}"),
+            workers=workers)
+        for log in logs:
+            print(log)
+        record(session or "session", recognized_reg_nos, candidates,
+               Image.fromarray(strip) if strip is not None else None)
+        stills = []
+
+    results = detect_images_parallel(stills, progress, workers, expected_faces)
+    for image_path, face_locations, unknown_encodings, error in results:
+        if error:
+            print(f"[Error] Failed to process {image_path}: {error}")
+            continue
+        if not unknown_encodings:
+            print(f"[Error] No faces detected in {image_path}.")
+            recognized_reg_nos, candidates = set(), []
+        else:
+            recognized_reg_nos, logs, candidates = match_faces(unknown_encodings, face_locations, gallery)
+            for log in logs:
+                print(f"{image_path}: {log}")
+        record(image_path, recognized_reg_nos, candidates)
+
+    # Videos run in-process one after another; the review crops come back
+    # laid out in a strip image instead of being cut from the source file.
+    for done, video_path in enumerate(videos, 1):
+        try:
+            recognized_reg_nos, logs, candidates, strip = recognize_faces_in_video(video_path, gallery,
+                                                                                   reg_no_to_name)
+        except Exception as e:
+            print(f"[Error] Failed to process {video_path}: {e}")
+            continue
+        progress(done, len(videos), video_path)
+        for log in logs:
+            print(f"{video_path}: {log}")
+        record(video_path, recognized_reg_nos, candidates, Image.fromarray(strip) if strip is not None else None)
+
+    if per_session:
+        pr_df, abs_df = write_attendance(output_dir, session or "session", session_reg_nos, reg_no_to_name)
+        print(f"[Log] Session: Total Present: {len(pr_df)} | Total Absent: {len(abs_df)}")
+        if store:
+            store.record_session(session_reg_nos, reg_no_to_name, name=session or "session", date=date,
+                                 source=f"{len(photos)} files")
+    if store:
+        print(f"[Log] Attendance recorded in {db_file}.")
+        store.close()
+
+    review_path = os.path.join(output_dir, "review.csv")
+    pd.DataFrame(review_rows, columns=REVIEW_COLUMNS).to_csv(review_path, index=False, encoding="utf-8")
+    print(f"[Log] {len(review_rows)} close matches written to {review_path} for review.")
+    return session_reg_nos, review_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Take attendance from class photos without the GUI.")
+    parser.add_argument("photos", nargs="+", help="Photo or video files, directories or glob patterns")
+    parser.add_argument("--output", default="attendance_output", help="Directory for CSV files and review crops")
+    parser.add_argument("--per-session", action="store_true",
+                        help="Merge all photos into one attendance record instead of one per photo")
+    parser.add_argument("--session", default=None, help="File prefix for the per-session records")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--csv", default="Student.csv", help="Student roster CSV")
+    parser.add_argument("--section", default=None,
+                        help="Only match and mark absent the students of this section of the roster")
+    parser.add_argument("--expected-faces", type=int, default=None,
+                        help="Retry detection at full resolution when fewer faces are found")
+    parser.add_argument("--db", default=DATABASE['db_file'], help="Attendance database to record sessions in")
+    parser.add_argument("--no-db", action="store_true", help="Only write CSV files")
+    parser.add_argument("--date", default=None, help="Session date (YYYY-MM-DD, default: today)")
+    args = parser.parse_args()
+
+    photos = collect_photos(args.photos)
+    if not photos:
+        parser.error("no photos found")
+    if args.section and args.section not in read_sections(args.csv):
+        parser.error(f"section {args.section} not found in {args.csv}")
+    run_batch(photos, args.output, args.per_session, args.session, args.workers, args.csv, args.expected_faces,
+              None if args.no_db else args.db, args.date, args.section)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,728 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from PIL import Image, ImageEnhance
+from my_config import IMAGE_ENHANCEMENT, FACE_RECOGNITION, ENCODING_STORE
+from enhancement import enhance_image, enhance_regions
+from gallery import Gallery, ENCODING_DIM
+from face_index import ExactIndex, IVFIndex, measure_recall
+from encoding_store import write_store, load_store
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def synthetic_encodings(num_students, per_student=3, seed=0):
+    # Identity centres roughly 0.9 apart with ~0.4 spread per identity,
+    # which is close to what dlib's 128-d encodings look like.
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0.0, 0.055, (num_students, ENCODING_DIM)).astype(np.float32)
+    encodings_dict = {}
+    for i, centre in enumerate(centres):
+        noise = rng.normal(0.0, 0.025, (per_student, ENCODING_DIM)).astype(np.float32)
+        encodings_dict[f"S{i:06d}"] = list(centre + noise)
+    return encodings_dict, centres
+
+
+def synthetic_probes(centres, count, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(centres), count, replace=count > len(centres))
+    noise = rng.normal(0.0, 0.025, (count, ENCODING_DIM)).astype(np.float32)
+    return centres[picks] + noise
+
+
+def run_recall(args):
+    encodings_dict, centres = synthetic_encodings(args.students, args.per_student)
+    gallery = Gallery.from_encodings(encodings_dict, index=ExactIndex())
+    probes = synthetic_probes(centres, args.probes)
+
+    start = time.perf_counter()
+    gallery.best_matches(probes)
+    exact_time = time.perf_counter() - start
+    print(f"Gallery: {args.students} students, {len(gallery)} encodings, {args.probes} probes")
+    print(f"exact        time {exact_time * 1000:8.1f} ms  recall 1.000")
+
+    for nprobe in args.nprobe:
+        index = IVFIndex(nlist=args.nlist, nprobe=nprobe)
+        # measure_recall also trains the index, keeping it out of the timing.
+        recall = measure_recall(gallery, probes, index)
+        gallery.index = index
+        start = time.perf_counter()
+        gallery.best_matches(probes)
+        ivf_time = time.perf_counter() - start
+        gallery.index = ExactIndex()
+        print(f"ivf nprobe={nprobe:<3} time {ivf_time * 1000:8.1f} ms  recall {recall:.3f}")
+        # Smaller nprobe values are only shown for comparison; the floor
+        # applies from the configured nprobe up.
+        if nprobe >= FACE_RECOGNITION['ann_nprobe'] and recall < args.min_recall:
+            raise SystemExit(f"[Error] Recall {recall:.3f} below {args.min_recall} at nprobe={nprobe}")
+
+
+def legacy_enhance_image(image, settings=IMAGE_ENHANCEMENT):
+    # The three-pass ImageEnhance pipeline that preprocess_image used to run.
+    pil_img = Image.fromarray(image)
+    pil_img = ImageEnhance.Brightness(pil_img).enhance(settings['brightness'])
+    pil_img = ImageEnhance.Contrast(pil_img).enhance(settings['contrast'])
+    pil_img = ImageEnhance.Sharpness(pil_img).enhance(settings['sharpness'])
+    return np.array(pil_img)
+
+
+def best_of(func, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run_enhance(args):
+    paths = sorted(p for pattern in args.images for p in glob.glob(pattern))
+    if not paths:
+        raise SystemExit("[Error] No images found.")
+    images = [(p, np.array(Image.open(p).convert("RGB"))) for p in paths]
+    if args.megapixels:
+        # Upscale the largest bundled photo to a phone-camera sized frame.
+        name, largest = max(images, key=lambda item: item[1].size)
+        height, width = largest.shape[:2]
+        factor = np.sqrt(args.megapixels * 1e6 / (height * width))
+        size = (int(width * factor), int(height * factor))
+        images.append((f"{name} @ {args.megapixels} MP", np.array(Image.fromarray(largest).resize(size))))
+
+    worst = 0
+    print(f"{'image':50} {'legacy ms':>10} {'fused ms':>10} {'faces ms':>10} {'max diff':>9} {'mean diff':>10}")
+    for name, image in images:
+        legacy_time, expected = best_of(legacy_enhance_image, image, repeat=args.repeat)
+        fused_time, actual = best_of(enhance_image, image, repeat=args.repeat)
+        height, width = image.shape[:2]
+        # Stand-in face boxes: a row of ten 5%-wide faces across the middle.
+        size = max(1, width // 20)
+        boxes = [(height // 2, x + size, height // 2 + size, x) for x in range(0, width - size, width // 10)]
+        faces_time, _ = best_of(enhance_regions, image, boxes, repeat=args.repeat)
+
+        diff = np.abs(expected.astype(np.int16) - actual.astype(np.int16))
+        worst = max(worst, int(diff.max()))
+        print(f"{name[-50:]:50} {legacy_time * 1000:10.1f} {fused_time * 1000:10.1f} {faces_time * 1000:10.1f} "
+              f"{int(diff.max()):9d} {diff.mean():10.4f}")
+    if worst > args.tolerance:
+        raise SystemExit(f"[Error] Fused enhancement differs by {worst} levels (tolerance {args.tolerance}).")
+
+
+def peak_rss_mb():
+    # Process-wide high-water mark; ru_maxrss is KiB on Linux, bytes on macOS.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+class StageTimer:
+
+    # Collects wall times per stage along with the peak traced allocation
+    # and the process peak RSS seen after the stage ran. tracemalloc slows
+    # Python-heavy stages down a lot, so the timed runs are untraced and
+    # the peak comes from one extra traced run.
+    def __init__(self):
+
+        self.results = {}
+
+
+    def run(self, stage, func, *args, items=1, repeat=1, **kwargs):
+
+        timings = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            timings.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, traced_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        entry = self.results.setdefault(stage, {'timings': [], 'items': 0, 'peak_traced_mb': 0.0})
+        entry['timings'].extend(timings)
+        entry['items'] += items * repeat
+        entry['peak_traced_mb'] = max(entry['peak_traced_mb'], traced_peak / (1 << 20))
+        entry['peak_rss_mb'] = peak_rss_mb()
+        return result
+
+
+    def summary(self):
+
+        summary = {}
+        for stage, entry in self.results.items():
+            timings = np.asarray(entry['timings'])
+            summary[stage] = {
+                'runs': len(timings),
+                'p50_ms': float(np.percentile(timings, 50) * 1000),
+                'p95_ms': float(np.percentile(timings, 95) * 1000),
+                'throughput_per_s': float(entry['items'] / timings.sum()) if timings.sum() else None,
+                'peak_traced_mb': round(entry['peak_traced_mb'], 2),
+                'peak_rss_mb': None if entry['peak_rss_mb'] is None else round(entry['peak_rss_mb'], 1),
+            }
+        return summary
+
+
+def print_summary(summary):
+    print(f"{'stage':40} {'runs':>5} {'p50 ms':>10} {'p95 ms':>10} {'items/s':>10} {'traced MB':>10} {'RSS MB':>8}")
+    for stage, row in summary.items():
+        throughput = f"{row['throughput_per_s']:10.1f}" if row['throughput_per_s'] else f"{'-':>10}"
+        rss = f"{row['peak_rss_mb']:8.1f}" if row['peak_rss_mb'] is not None else f"{'-':>8}"
+        print(f"{stage:40} {row['runs']:5d} {row['p50_ms']:10.2f} {row['p95_ms']:10.2f} {throughput} "
+              f"{row['peak_traced_mb']:10.2f} {rss}")
+
+
+def run_scale(args, timer):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_students in args.students:
+            prefix = f"scale/{num_students}"
+            encodings_dict, centres = synthetic_encodings(num_students, args.per_student)
+            gallery = timer.run(f"{prefix}/build", Gallery.from_encodings, encodings_dict,
+                                items=num_students * args.per_student)
+            store_path = os.path.join(tmp_dir, f"gallery_{num_students}.bin")
+            timer.run(f"{prefix}/write", write_store, gallery, store_path)
+            loaded = timer.run(f"{prefix}/load", load_store, store_path, repeat=args.repeat)
+            # A class photo's worth of probes per call, against the loaded store.
+            probes = synthetic_probes(centres, args.faces)
+            loaded.best_matches(probes)
+            timer.run(f"{prefix}/match", loaded.best_matches, probes, items=args.faces, repeat=args.repeat)
+            del encodings_dict, gallery, loaded
+
+
+def run_pipeline(args, timer):
+    try:
+        import face_recognition as fr
+        from face_recognition_module import (load_student_encodings, precompute_student_encodings, preprocess_image,
+                                             read_student_csv, recognize_faces_in_image)
+    except ImportError as e:
+        raise SystemExit(f"[Error] The pipeline benchmark needs the face_recognition package: {e}")
+
+    photos = sorted(p for pattern in args.images for p in glob.glob(pattern))
+    if not photos:
+        raise SystemExit("[Error] No images found.")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Keep the benchmark's store, caches and journal out of the working tree.
+        saved = dict(ENCODING_STORE)
+        for key in ('path', 'image_cache', 'journal'):
+            ENCODING_STORE[key] = os.path.join(tmp_dir, os.path.basename(saved[key]))
+        ENCODING_STORE['legacy_pickle'] = os.path.join(tmp_dir, "missing.pkl")
+        try:
+            df, reg_no_to_name = read_student_csv(args.csv)
+            images = sum(len([p for p in paths.split(',') if p.strip()]) for paths in df['File Paths'])
+            timer.run("pipeline/precompute_cold", precompute_student_encodings, df, True, items=images)
+            timer.run("pipeline/precompute_cached", precompute_student_encodings, df, items=images)
+            gallery, _ = timer.run("pipeline/load_student_encodings", load_student_encodings, args.csv,
+                                   repeat=args.repeat)
+
+            for photo in photos:
+                image = fr.load_image_file(photo)
+                timer.run("pipeline/preprocess_image", preprocess_image, image, repeat=args.repeat)
+                timer.run("pipeline/recognize_faces_in_image", recognize_faces_in_image, photo, gallery,
+                          reg_no_to_name, use_cache=False)
+        finally:
+            ENCODING_STORE.update(saved)
+
+
+def compare_with_baseline(summary, baseline_path, max_regression, min_delta_ms):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    print(f"\n{'stage':40} {'baseline p50':>13} {'p50':>10} {'change':>8}")
+    for stage, row in summary.items():
+        base = baseline.get(stage)
+        if not base:
+            continue
+        change = row['p50_ms'] / base['p50_ms'] - 1 if base['p50_ms'] else 0.0
+        flag = ""
+        if change > max_regression and row['p50_ms'] - base['p50_ms'] > min_delta_ms:
+            regressions.append(stage)
+            flag = "  REGRESSION"
+        print(f"{stage:40} {base['p50_ms']:13.2f} {row['p50_ms']:10.2f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def run_suite(args):
+    timer = StageTimer()
+    if args.suite in ("scale", "all"):
+        run_scale(args, timer)
+    if args.suite in ("pipeline", "all"):
+        run_pipeline(args, timer)
+    summary = timer.summary()
+    print_summary(summary)
+
+    if args.output:
+        report = {
+            'meta': {
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'results': summary,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[Log] Results written to {args.output}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(summary, args.baseline, args.max_regression, args.min_delta_ms)
+        if regressions:
+            raise SystemExit(f"[Error] {len(regressions)} stages regressed more than {args.max_regression:.0%}: "
+                             + ", ".join(regressions))
+
+
+def run_prototypes(args):
+    from prototypes import compress_gallery, compress_student, max_prototypes_per_student
+    k = args.prototypes or max_prototypes_per_student()
+    if not k:
+        raise SystemExit("[Error] No prototype cap: pass --prototypes or set max_encodings_per_student.")
+    threshold = FACE_RECOGNITION['threshold']
+
+    encodings_dict, centres = synthetic_encodings(args.students, args.per_student)
+    rng = np.random.default_rng(1)
+    truth = rng.choice(args.students, args.probes)
+    probes = centres[truth] + rng.normal(0.0, 0.025, (args.probes, ENCODING_DIM)).astype(np.float32)
+    truth = [f"S{i:06d}" for i in truth]
+    full = Gallery.from_encodings(encodings_dict, index=ExactIndex())
+    del encodings_dict
+    start = time.perf_counter()
+    compressed, dropped = compress_gallery(full, k)
+    compress_time = time.perf_counter() - start
+    compressed.index = ExactIndex()
+
+    print(f"Gallery: {args.students} students x {args.per_student} encodings, cap {k} prototypes, "
+          f"compressed in {compress_time:.2f} s ({dropped} rows dropped)")
+    print(f"{'gallery':12} {'rows':>9} {'MB':>8} {'match ms':>9} {'accuracy':>9}")
+    results = {}
+    for name, gallery in (('full', full), ('prototypes', compressed)):
+        match_time, _ = best_of(gallery.best_matches, probes[:args.faces], repeat=args.repeat)
+        matches = gallery.best_matches(probes)
+        hits = [reg_no if distance < threshold else None for reg_no, distance in matches]
+        accuracy = float(np.mean([hit == expected for hit, expected in zip(hits, truth)]))
+        megabytes = len(gallery) * (ENCODING_DIM + 2) * 4 / (1 << 20)
+        results[name] = (megabytes, match_time, hits)
+        print(f"{name:12} {len(gallery):9d} {megabytes:8.1f} {match_time * 1000:9.2f} {accuracy:9.3f}")
+    agreement = np.mean([a == b for a, b in zip(results['full'][2], results['prototypes'][2])])
+    print(f"[Log] Saved {results['full'][0] - results['prototypes'][0]:.1f} MB and "
+          f"{(results['full'][1] - results['prototypes'][1]) * 1000:.2f} ms per {args.faces}-face match; "
+          f"{agreement:.1%} of probes get the same answer.")
+    if agreement < args.min_recall:
+        raise SystemExit(f"[Error] Only {agreement:.3f} of probes agree with the full gallery, below "
+                         f"{args.min_recall}.")
+
+    # The incremental path: one more confirmed encoding for a student at the cap.
+    reg_no = compressed.reg_nos[0]
+    start = time.perf_counter()
+    compressed.add(reg_no, probes[0])
+    compress_student(compressed, reg_no, k)
+    print(f"[Log] Incremental add + compress for one student: {(time.perf_counter() - start) * 1000:.2f} ms")
+    run_prototypes_bundled(args, k, threshold)
+
+
+def run_prototypes_bundled(args, k, threshold):
+    # Recognised students per bundled photo, with and without the cap.
+    try:
+        from face_recognition_module import detect_and_encode, precompute_student_encodings, read_student_csv
+    except ImportError as e:
+        print(f"[Warning] Skipping the bundled images, face_recognition is unavailable: {e}")
+        return
+    photos = sorted(p for pattern in args.images for p in glob.glob(pattern))
+    if not photos or not os.path.exists(args.csv):
+        print("[Warning] Skipping the bundled images, none found.")
+        return
+    from prototypes import compress_gallery
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        saved = dict(ENCODING_STORE)
+        saved_cap = FACE_RECOGNITION.get('max_encodings_per_student')
+        for key in ('path', 'image_cache', 'journal'):
+            ENCODING_STORE[key] = os.path.join(tmp_dir, os.path.basename(saved[key]))
+        FACE_RECOGNITION['max_encodings_per_student'] = None
+        try:
+            df, _ = read_student_csv(args.csv)
+            full, _ = precompute_student_encodings(df)
+        finally:
+            ENCODING_STORE.update(saved)
+            FACE_RECOGNITION['max_encodings_per_student'] = saved_cap
+    compressed, dropped = compress_gallery(full, k)
+
+    kept = found = 0
+    for photo in photos:
+        _, encodings, _ = detect_and_encode(photo)
+        if not encodings:
+            continue
+        before = {r for r, d in full.best_matches(encodings) if r is not None and d < threshold}
+        after = {r for r, d in compressed.best_matches(encodings) if r is not None and d < threshold}
+        found += len(before)
+        kept += len(before & after)
+    recall = kept / found if found else 1.0
+    print(f"[Log] Bundled images: {len(full)} -> {len(compressed)} encodings, recall {recall:.3f} "
+          f"({kept}/{found} recognitions kept)")
+    if recall < args.min_recall:
+        raise SystemExit(f"[Error] Recall {recall:.3f} on the bundled images is below {args.min_recall}.")
+
+
+# Runs one detection mode on one image in a fresh interpreter and prints its
+# wall time, face count and the interpreter's own peak RSS.
+DETECTION_SNIPPET = """
+import json, sys, time
+import face_recognition as fr
+import face_recognition_module as m
+from benchmark import peak_rss_mb
+image = fr.load_image_file(sys.argv[1])
+before = peak_rss_mb()
+started = time.perf_counter()
+if sys.argv[2] == 'tiled':
+    boxes = m.detect_faces_tiled(image, workers=1)
+else:
+    boxes = fr.face_locations(m.preprocess_image(image))
+print(json.dumps({'seconds': time.perf_counter() - started, 'faces': len(boxes), 'rss_before': before,
+                  'rss_peak': peak_rss_mb()}))
+"""
+
+
+def run_tiles(args):
+    # Full-resolution detection against tiled detection on a bundled photo
+    # upscaled to an auditorium-sized frame. Tiles run serially here so the
+    # peak RSS of one process covers all of them.
+    paths = sorted(p for pattern in args.images for p in glob.glob(pattern))
+    if not paths:
+        raise SystemExit("[Error] No images found.")
+    gui_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in (gui_dir, os.environ.get('PYTHONPATH')) if p))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image = Image.open(max(paths, key=os.path.getsize)).convert("RGB")
+        factor = np.sqrt(args.megapixels * 1e6 / (image.width * image.height))
+        image_path = os.path.join(tmp_dir, "large.jpg")
+        image.resize((int(image.width * factor), int(image.height * factor))).save(image_path, quality=92)
+        print(f"Image: {args.megapixels} MP")
+        print(f"{'mode':8} {'seconds':>9} {'faces':>6} {'RSS MB':>8} {'added MB':>9}")
+        for mode in ("full", "tiled"):
+            result = subprocess.run([sys.executable, "-c", DETECTION_SNIPPET, image_path, mode], env=env,
+                                    capture_output=True, text=True)
+            if result.returncode:
+                error = (result.stderr.strip().splitlines() or ["unknown error"])[-1]
+                print(f"{mode:8} [Error] {error}")
+                continue
+            row = json.loads(result.stdout.strip().splitlines()[-1])
+            added = row['rss_peak'] - row['rss_before'] if row['rss_peak'] is not None else float('nan')
+            print(f"{mode:8} {row['seconds']:9.2f} {row['faces']:6d} {row['rss_peak'] or float('nan'):8.1f} "
+                  f"{added:9.1f}")
+
+
+# Each snippet runs in a fresh interpreter so nothing is imported yet.
+# "window" is what main.py does before the window can be drawn; "roster" adds
+# the recognition stack and gallery load, which used to happen before it.
+STARTUP_SNIPPETS = [
+    ('window', "import main"),
+    ('recognition imports', "import face_recognition_module"),
+    ('roster', "import main; main.load_roster()"),
+]
+
+
+def run_startup(args):
+    gui_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in (gui_dir, os.environ.get('PYTHONPATH')) if p))
+    medians = {}
+    print(f"{'stage':22} {'median ms':>10} {'best ms':>10}")
+    for name, snippet in STARTUP_SNIPPETS:
+        code = f"import time\nstarted = time.perf_counter()\n{snippet}\nprint(time.perf_counter() - started)"
+        timings = []
+        for _ in range(args.repeat):
+            result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+            if result.returncode:
+                error = (result.stderr.strip().splitlines() or ["unknown error"])[-1]
+                print(f"{name:22} [Error] {error}")
+                break
+            timings.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+        if timings:
+            medians[name] = float(np.median(timings))
+            print(f"{name:22} {medians[name]:10.1f} {min(timings):10.1f}")
+    if 'window' in medians and 'roster' in medians:
+        print(f"[Log] Window ready after {medians['window']:.0f} ms instead of {medians['roster']:.0f} ms; "
+              f"the roster finishes loading in the background.")
+
+
+def private_mb():
+    # Memory only this process maps (clean + dirty private pages), i.e. what
+    # each extra worker costs. Pages inherited by fork or mapped from shared
+    # memory are not counted until written to. Linux only.
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = [line.split() for line in f]
+        return sum(int(field[1]) for field in fields if field[0] in ("Private_Clean:", "Private_Dirty:")) / 1024
+    except OSError:
+        return None
+
+
+def _match_pickled(payload, probes):
+    import pickle
+    started = time.perf_counter()
+    gallery = Gallery.from_arrays(*pickle.loads(payload))
+    setup = time.perf_counter() - started
+    return setup, [match[0] for match in gallery.best_matches(probes)], None, private_mb()
+
+
+def _match_shared(probes):
+    from shared_gallery import shared_gallery
+    started = time.perf_counter()
+    gallery, generation = shared_gallery()
+    setup = time.perf_counter() - started
+    return setup, [match[0] for match in gallery.best_matches(probes)], generation, private_mb()
+
+
+def run_shared(args):
+    # Handing a gallery to each pool worker by pickling it against
+    # publishing it once in shared memory and attaching it read-only.
+    import pickle
+    from concurrent.futures import ProcessPoolExecutor
+    from shared_gallery import SharedGallery, attach_shared_gallery
+    encodings_dict, centres = synthetic_encodings(args.students, args.per_student)
+    gallery = Gallery.from_encodings(encodings_dict)
+    probes = synthetic_probes(centres, args.faces)
+    expected = [match[0] for match in gallery.best_matches(probes)]
+    print(f"Gallery: {args.students} students, {len(gallery)} rows, {gallery.matrix.nbytes / (1 << 20):.1f} MB; "
+          f"{args.workers} workers")
+    print(f"{'mode':8} {'publish ms':>11} {'setup ms/worker':>16} {'copied MB/worker':>17} {'private MB/worker':>18} "
+          f"{'matches':>8}")
+
+    started = time.perf_counter()
+    payload = pickle.dumps(gallery.arrays(), protocol=pickle.HIGHEST_PROTOCOL)
+    publish = time.perf_counter() - started
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(_match_pickled, [payload] * args.workers, [probes] * args.workers))
+    agree = print_shared_row("pickled", publish, len(payload) / (1 << 20), results, expected)
+
+    shared = SharedGallery()
+    try:
+        started = time.perf_counter()
+        shared.publish(gallery)
+        publish = time.perf_counter() - started
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=attach_shared_gallery,
+                                 initargs=(shared.name,)) as executor:
+            results = list(executor.map(_match_shared, [probes] * args.workers))
+            agree = print_shared_row("shared", publish, 0.0, results, expected) and agree
+            # An enrollment publishes a new generation; workers switch on their next call.
+            gallery.add("S_new", probes[0])
+            generation = shared.publish(gallery)
+            results = list(executor.map(_match_shared, [probes[:1]] * args.workers))
+        seen = sorted({result[2] for result in results})
+        matched = all(result[1] == ["S_new"] for result in results)
+        print(f"[Log] After publishing generation {generation}, workers matched against generation(s) {seen}; "
+              f"new student found by every worker: {matched}.")
+    finally:
+        shared.close()
+    if not agree:
+        raise SystemExit("[Error] Workers' matches differ from matching in this process.")
+    if seen != [generation] or not matched:
+        raise SystemExit(f"[Error] Workers did not all switch to generation {generation}.")
+
+
+def print_shared_row(mode, publish, copied_mb, results, expected):
+    setup = np.median([result[0] for result in results]) * 1000
+    private = [result[3] for result in results if result[3] is not None]
+    private = f"{np.median(private):18.1f}" if private else f"{'-':>18}"
+    same = all(result[1] == expected for result in results)
+    print(f"{mode:8} {publish * 1000:11.1f} {setup:16.1f} {copied_mb:17.1f} {private} "
+          f"{'same' if same else 'DIFFER':>8}")
+    return same
+
+
+def run_sections(args):
+    # Matching a class photo against one section's view of the gallery
+    # against the whole gallery, for a section whose students are adjacent
+    # in the roster and one scattered across it. Probes are faces of the
+    # section's students plus outsiders who cannot be in the room.
+    encodings_dict, centres = synthetic_encodings(args.students, args.per_student)
+    gallery = Gallery.from_encodings(encodings_dict)
+    reg_nos = list(encodings_dict)
+    rng = np.random.default_rng(2)
+    print(f"Gallery: {args.students} students, {len(gallery)} rows; sections of {args.section_size}, "
+          f"{args.faces} faces per photo of which {args.outsiders} outsiders")
+    print(f"{'section':10} {'slices':>7} {'gathered':>9} {'build ms':>9} {'full ms':>8} {'view ms':>8} "
+          f"{'speedup':>8} {'same':>5} {'outsiders full/view':>20}")
+    layouts = (('adjacent', np.arange(args.section_size)),
+               ('scattered', np.sort(rng.choice(args.students, args.section_size, replace=False))))
+    for label, picks in layouts:
+        members = [reg_nos[i] for i in picks]
+        started = time.perf_counter()
+        view = gallery.view(members)
+        build = time.perf_counter() - started
+        inside = synthetic_probes(centres[picks], args.faces - args.outsiders, seed=3)
+        outside = np.setdiff1d(np.arange(args.students), picks)
+        outsiders = synthetic_probes(centres[rng.choice(outside, args.outsiders, replace=False)], args.outsiders,
+                                     seed=4)
+        probes = np.concatenate([inside, outsiders])
+        full, full_matches = best_of(gallery.best_matches, probes, repeat=args.repeat)
+        scoped, matches = best_of(view.best_matches, probes, repeat=args.repeat)
+        # The view must give the answers of an exact search over a gallery
+        # built from the section's encodings alone.
+        reference = Gallery.from_encodings({reg_no: encodings_dict[reg_no] for reg_no in members})
+        same = [m[0] for m in matches] == [m[0] for m in reference.best_matches(probes)]
+        # Outsiders recognised as someone (below the recognition threshold)
+        # are marked present in a class they are not in.
+        threshold = FACE_RECOGNITION['threshold']
+        outsiders_full = sum(1 for _, distance in full_matches[len(inside):] if distance < threshold)
+        outsiders_view = sum(1 for _, distance in matches[len(inside):] if distance < threshold)
+        _, _, slices, gathered, _, _ = view._sync()
+        print(f"{label:10} {len(slices):7d} {len(gathered):9d} {build * 1000:9.2f} {full * 1000:8.2f} "
+              f"{scoped * 1000:8.2f} {full / scoped:7.1f}x {'yes' if same else 'NO':>5} "
+              f"{f'{outsiders_full}/{outsiders_view}':>20}")
+
+
+def run_service(args):
+    # Starts the recognition service on an ephemeral localhost port and
+    # fires concurrent uploads at it through the thin client: latency per
+    # photo, throughput, and how many uploads were told to retry.
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from recognition_client import RecognitionClient
+    from recognition_service import RecognitionService, make_server
+    paths = sorted(p for pattern in args.images for p in glob.glob(pattern))
+    if not paths:
+        raise SystemExit("[Error] No images found.")
+    started = time.perf_counter()
+    service = RecognitionService(args.workers, args.max_queue, args.csv)
+    server = make_server(service, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    print(f"[Log] Service with {service.workers} warm workers ready on {url} after "
+          f"{time.perf_counter() - started:.1f} s.")
+
+    def upload(client, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        begin = time.perf_counter()
+        try:
+            reply = client.recognize_upload(data, os.path.basename(path))
+        except Exception as e:
+            return time.perf_counter() - begin, str(e)
+        return time.perf_counter() - begin, reply
+
+    print(f"{'clients':>8} {'uploads':>8} {'p50 ms':>10} {'p95 ms':>10} {'photos/s':>9} {'busy':>6} {'failed':>7}")
+    try:
+        for clients in args.clients:
+            client = RecognitionClient(url, retries=args.retries)
+            uploads = [paths[i % len(paths)] for i in range(args.uploads)]
+            begin = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                results = list(pool.map(lambda path: upload(client, path), uploads))
+            elapsed = time.perf_counter() - begin
+            timings = np.asarray([seconds for seconds, reply in results if isinstance(reply, dict)])
+            failed = sum(1 for _, reply in results if not isinstance(reply, dict))
+            p50, p95 = (np.percentile(timings, [50, 95]) * 1000) if len(timings) else (float('nan'),) * 2
+            print(f"{clients:8d} {len(uploads):8d} {p50:10.1f} {p95:10.1f} {len(timings) / elapsed:9.2f} "
+                  f"{client.busy_replies:6d} {failed:7d}")
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Smart Attendance benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    recall = subparsers.add_parser("recall", help="Approximate index recall against exact search")
+    recall.add_argument("--students", type=int, default=20000)
+    recall.add_argument("--per-student", type=int, default=3)
+    recall.add_argument("--probes", type=int, default=500)
+    recall.add_argument("--nlist", type=int, default=None)
+    recall.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16])
+    recall.add_argument("--min-recall", type=float, default=0.95,
+                        help="Required top-1 agreement with exact search from the configured ann_nprobe up")
+    recall.set_defaults(func=run_recall)
+
+    enhance = subparsers.add_parser("enhance", help="Fused enhancement against the three-pass ImageEnhance version")
+    enhance.add_argument("--images", nargs="+", default=["Images/*", "Reference_Images/*"])
+    enhance.add_argument("--megapixels", type=float, default=12.0)
+    enhance.add_argument("--repeat", type=int, default=3)
+    enhance.add_argument("--tolerance", type=int, default=1)
+    enhance.set_defaults(func=run_enhance)
+
+    suite = subparsers.add_parser("suite", help="Latency, throughput and memory per stage, with baseline comparison")
+    suite.add_argument("suite", nargs="?", choices=["scale", "pipeline", "all"], default="all")
+    suite.add_argument("--students", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    suite.add_argument("--per-student", type=int, default=3)
+    suite.add_argument("--faces", type=int, default=40, help="Probes per match call (faces in one photo)")
+    suite.add_argument("--repeat", type=int, default=5)
+    suite.add_argument("--images", nargs="+", default=["Images/*", "Reference_Images/*"])
+    suite.add_argument("--csv", default="Student.csv")
+    suite.add_argument("--output", default=None, help="Write results as JSON")
+    suite.add_argument("--baseline", default=None, help="JSON results to compare against")
+    suite.add_argument("--max-regression", type=float, default=0.2,
+                       help="Allowed p50 slowdown as a fraction of the baseline")
+    suite.add_argument("--min-delta-ms", type=float, default=1.0,
+                       help="Ignore slowdowns smaller than this many milliseconds")
+    suite.set_defaults(func=run_suite)
+
+    prototypes = subparsers.add_parser("prototypes", help="Bytes, match time and recall with capped prototypes")
+    prototypes.add_argument("--students", type=int, default=1000)
+    prototypes.add_argument("--per-student", type=int, default=100)
+    prototypes.add_argument("--prototypes", type=int, default=None, help="Defaults to max_encodings_per_student")
+    prototypes.add_argument("--probes", type=int, default=2000)
+    prototypes.add_argument("--faces", type=int, default=40, help="Probes per timed match call")
+    prototypes.add_argument("--repeat", type=int, default=5)
+    prototypes.add_argument("--images", nargs="+", default=["Images/*"])
+    prototypes.add_argument("--csv", default="Student.csv")
+    prototypes.add_argument("--min-recall", type=float, default=0.95,
+                            help="Required agreement with the full gallery, synthetic and on the bundled images")
+    prototypes.set_defaults(func=run_prototypes)
+
+    tiles = subparsers.add_parser("tiles", help="Full-resolution against tiled detection on a very large photo")
+    tiles.add_argument("--images", nargs="+", default=["Images/*"])
+    tiles.add_argument("--megapixels", type=float, default=24.0)
+    tiles.set_defaults(func=run_tiles)
+
+    startup = subparsers.add_parser("startup", help="Time until the window can be drawn against the eager startup")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.set_defaults(func=run_startup)
+
+    shared = subparsers.add_parser("shared", help="Pickled against shared-memory galleries in pool workers")
+    shared.add_argument("--students", type=int, default=20000)
+    shared.add_argument("--per-student", type=int, default=3)
+    shared.add_argument("--faces", type=int, default=40, help="Probes matched by each worker")
+    shared.add_argument("--workers", type=int, default=4)
+    shared.set_defaults(func=run_shared)
+
+    sections = subparsers.add_parser("sections", help="Matching against one section's view against the whole gallery")
+    sections.add_argument("--students", type=int, default=20000)
+    sections.add_argument("--per-student", type=int, default=3)
+    sections.add_argument("--section-size", type=int, default=60)
+    sections.add_argument("--faces", type=int, default=40, help="Faces per photo")
+    sections.add_argument("--outsiders", type=int, default=5, help="Faces of students outside the section")
+    sections.add_argument("--repeat", type=int, default=5)
+    sections.set_defaults(func=run_sections)
+
+    service = subparsers.add_parser("service", help="Concurrent uploads to the recognition service on localhost")
+    service.add_argument("--images", nargs="+", default=["Images/*"])
+    service.add_argument("--csv", default="Student.csv")
+    service.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    service.add_argument("--uploads", type=int, default=32, help="Uploads per client count")
+    service.add_argument("--workers", type=int, default=None, help="Defaults to SERVICE['workers']")
+    service.add_argument("--max-queue", type=int, default=None, help="Defaults to SERVICE['max_queue']")
+    service.add_argument("--retries", type=int, default=None,
+                         help="Retries after a 503; 0 shows how many uploads backpressure turns away")
+    service.set_defaults(func=run_service)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from my_config import BULK_IMPORT, ENCODING_STORE, DATABASE, SECTIONS
+from gallery import ENCODING_DIM
+from encoding_cache import ImageEncodingCache
+from encoding_store import write_store
+from face_recognition_module import encode_images_parallel, load_student_encodings, read_student_csv
+from prototypes import compress_gallery
+from sections import merge_sections, split_sections
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class ImportPlan:
+
+    # Everything prepare_import found out, before anything is written:
+    # rows that passed validation with their encodings, per-row errors and
+    # the pairs of Reg Nos that look like the same face.
+    def __init__(self):
+
+        self.rows = []
+        self.errors = []
+        self.duplicates = []
+        self.encodings = {}
+        self.reused = 0
+        self.encoded = 0
+
+
+    def __str__(self):
+
+        new = sum(1 for row in self.rows if not row['existing'])
+        text = (f"{len(self.rows)} valid rows ({new} new students, {len(self.rows) - new} updated), "
+                f"{self.encoded} images encoded, {self.reused} reused")
+        if self.errors:
+            text += f", {len(self.errors)} errors"
+        if self.duplicates:
+            text += f", {len(self.duplicates)} possible duplicate identities"
+        return text
+
+
+def read_import_rows(csv_path, images_dir=None):
+    # Accepts the roster layout (Reg No, Name, File Paths, optionally
+    # Sections) or an image folder
+    # with one <Reg No>.jpg/.jpeg/.png per student when File Paths is absent
+    # or empty. Relative paths are resolved against images_dir, or the CSV's
+    # own folder when no images_dir is given.
+    df = pd.read_csv(csv_path, dtype=str).fillna("")
+    base = images_dir if images_dir is not None else os.path.dirname(csv_path)
+    rows = []
+    for line, record in enumerate(df.to_dict('records'), 2):
+        reg_no = record.get("Reg No", "").strip()
+        paths = [p.strip() for p in record.get("File Paths", "").split(",") if p.strip()]
+        if not paths and images_dir and reg_no:
+            paths = [os.path.join(images_dir, reg_no + ext) for ext in IMAGE_EXTENSIONS
+                     if os.path.exists(os.path.join(images_dir, reg_no + ext))]
+        paths = [p if os.path.isabs(p) or os.path.exists(p) else os.path.join(base, p) for p in paths]
+        rows.append({'line': line, 'reg_no': reg_no, 'name': record.get("Name", "").strip(), 'paths': paths,
+                     'sections': split_sections(record.get(SECTIONS['column'], ""))})
+    return rows
+
+
+def validate_rows(rows, reg_no_to_name):
+    # Returns (valid rows, [(line, reg_no, message)]). A Reg No already on
+    # the roster is only accepted under the same name; its images are added.
+    valid = []
+    errors = []
+    seen = {}
+    for row in rows:
+        reg_no, name, line = row['reg_no'], row['name'], row['line']
+        problems = []
+        if not reg_no:
+            problems.append("missing Reg No")
+        if not name:
+            problems.append("missing Name")
+        if reg_no in seen:
+            problems.append(f"Reg No repeated from line {seen[reg_no]}")
+        existing = reg_no_to_name.get(reg_no)
+        if existing is not None and existing.strip() != name:
+            problems.append(f"Reg No already enrolled as {existing}")
+        if not row['paths']:
+            problems.append("no image")
+        for path in row['paths']:
+            if not path.lower().endswith(IMAGE_EXTENSIONS):
+                problems.append(f"not an image: {path}")
+            elif not os.path.exists(path):
+                problems.append(f"image not found: {path}")
+        seen.setdefault(reg_no, line)
+        if problems:
+            errors.extend((line, reg_no, problem) for problem in problems)
+        else:
+            valid.append(dict(row, existing=existing is not None))
+    return valid, errors
+
+
+def prepare_import(csv_path, images_dir=None, student_csv='Student.csv', gallery=None, progress=None,
+                   workers=None):
+    # Validates every row, encodes the images in the process pool (reusing
+    # the image encoding cache) and checks the new faces against each other
+    # and the gallery. Nothing but the image cache is written.
+    plan = ImportPlan()
+    _, reg_no_to_name = read_student_csv(student_csv)
+    rows, plan.errors = validate_rows(read_import_rows(csv_path, images_dir), reg_no_to_name)
+
+    cache = ImageEncodingCache(ENCODING_STORE['image_cache'])
+    keys = {}
+    pending = []
+    for row in rows:
+        for path in row['paths']:
+            keys[path] = cache.key_for(path)
+            if cache.get(keys[path]) is None:
+                pending.append(path)
+            else:
+                plan.reused += 1
+    for path, encodings, error in encode_images_parallel(list(dict.fromkeys(pending)), progress, workers):
+        if error:
+            cache.discard(keys[path])
+        else:
+            cache.put(keys[path], encodings)
+            plan.encoded += 1
+    cache.save()
+
+    # Enrollment photos must show exactly one face.
+    for row in rows:
+        encodings = []
+        problems = []
+        for path in row['paths']:
+            found = cache.get(keys[path])
+            if found is None:
+                problems.append(f"could not encode {path}")
+            elif len(found) != 1:
+                problems.append(f"expected one face in {path}, found {len(found)}")
+            else:
+                encodings.append(found[0])
+        if problems:
+            plan.errors.extend((row['line'], row['reg_no'], problem) for problem in problems)
+        else:
+            plan.rows.append(row)
+            plan.encodings[row['reg_no']] = encodings
+
+    plan.duplicates = find_duplicate_identities(plan.encodings, gallery)
+    return plan
+
+
+def find_duplicate_identities(encodings_by_reg_no, gallery=None, max_distance=None, block_rows=None):
+    # All pairs of faces closer than max_distance that belong to different
+    # Reg Nos, among the new encodings and against the gallery rows. The
+    # distances are computed block by block (the upper triangle only for
+    # new against new), so memory stays at block_rows x rows. Returns sorted
+    # (distance, reg_no, other_reg_no) with the closest pair per Reg No pair.
+    max_distance = max_distance or BULK_IMPORT['duplicate_distance']
+    block_rows = block_rows or BULK_IMPORT['block_rows']
+    reg_nos = list(encodings_by_reg_no)
+    owners = np.asarray([i for i, reg_no in enumerate(reg_nos) for _ in encodings_by_reg_no[reg_no]],
+                        dtype=np.int64)
+    if not len(owners):
+        return []
+    matrix = np.asarray([e for reg_no in reg_nos for e in encodings_by_reg_no[reg_no]],
+                        dtype=np.float32).reshape(-1, ENCODING_DIM)
+    best = {}
+
+    def note(pair_reg_nos, rows, cols, d2):
+        for a, b, distance in zip(pair_reg_nos[0][rows], pair_reg_nos[1][cols], np.sqrt(np.maximum(d2, 0.0))):
+            if a != b:
+                pair = (a, b) if a < b else (b, a)
+                if distance < best.get(pair, np.inf):
+                    best[pair] = distance
+
+    new_reg_nos = np.asarray(reg_nos, dtype=object)[owners]
+    for rows, cols, d2 in _close_pairs(matrix, matrix, max_distance, block_rows, upper=True):
+        note((new_reg_nos, new_reg_nos), rows, cols, d2)
+    if gallery is not None and len(gallery):
+        gallery_matrix, _, row_student, gallery_reg_nos = gallery.arrays()
+        row_reg_nos = np.asarray(gallery_reg_nos, dtype=object)[row_student]
+        for rows, cols, d2 in _close_pairs(matrix, gallery_matrix, max_distance, block_rows):
+            note((new_reg_nos, row_reg_nos), rows, cols, d2)
+    return sorted((float(distance), a, b) for (a, b), distance in best.items())
+
+
+def _close_pairs(left, right, max_distance, block_rows, upper=False):
+    # Yields (left rows, right rows, squared distances) per block of left
+    # rows for the pairs closer than max_distance; with upper=True left and
+    # right are the same matrix and only pairs with col > row are kept.
+    left_sq = np.einsum('ij,ij->i', left, left)
+    right_sq = np.einsum('ij,ij->i', right, right)
+    for start in range(0, len(left), block_rows):
+        stop = min(start + block_rows, len(left))
+        offset = start if upper else 0
+        d2 = left[start:stop] @ right[offset:].T
+        d2 *= -2.0
+        d2 += left_sq[start:stop, None]
+        d2 += right_sq[None, offset:]
+        rows, cols = np.nonzero(d2 < max_distance ** 2)
+        if upper:
+            keep = cols > rows
+            rows, cols = rows[keep], cols[keep]
+        yield rows + start, cols + offset, d2[rows, cols]
+
+
+def commit_import(plan, gallery=None, student_csv='Student.csv'):
+    # Writes the roster and the gallery together. The image cache already
+    # holds every encoding, and the CSV is replaced before the store. A
+    # crash in between leaves a CSV newer than the store, so the next start
+    # rebuilds from the CSV out of the cache; there is no state in which
+    # the two disagree. Returns (gallery, reg_no_to_name).
+    if gallery is None:
+        gallery, _ = load_student_encodings(student_csv)
+    df, _ = read_student_csv(student_csv)
+    df = df.copy()
+    column = SECTIONS['column']
+    if column not in df.columns and any(row['sections'] for row in plan.rows):
+        df[column] = ""
+    index = {reg_no: i for i, reg_no in enumerate(df["Reg No"])}
+    new_rows = []
+    for row in plan.rows:
+        if row['reg_no'] in index:
+            i = index[row['reg_no']]
+            paths = [p.strip() for p in df.at[i, "File Paths"].split(",") if p.strip()]
+            df.at[i, "File Paths"] = ",".join(paths + [p for p in row['paths'] if p not in paths])
+            if row['sections']:
+                df.at[i, column] = merge_sections(df.at[i, column], row['sections'])
+        else:
+            new_rows.append({"Reg No": row['reg_no'], "Name": row['name'], "File Paths": ",".join(row['paths']),
+                             column: merge_sections("", row['sections'])})
+    if new_rows:
+        df = pd.concat([df, pd.DataFrame(new_rows, columns=df.columns)], ignore_index=True)
+    tmp_path = student_csv + ".tmp"
+    df.to_csv(tmp_path, index=False, encoding="utf-8")
+    os.replace(tmp_path, student_csv)
+
+    for row in plan.rows:
+        gallery.extend(row['reg_no'], plan.encodings[row['reg_no']])
+    gallery, _ = compress_gallery(gallery)
+    write_store(gallery, ENCODING_STORE['path'])
+    return gallery, dict(zip(df["Reg No"], df["Name"]))
+
+
+def plan_report(plan):
+    lines = [f"[Error] Line {line} ({reg_no or 'no Reg No'}): {message}" for line, reg_no, message in plan.errors]
+    lines += [f"[Warning] {reg_no} and {other} look like the same face (distance {distance:.3f})."
+              for distance, reg_no, other in plan.duplicates]
+    return lines + [f"[Log] {plan}."]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enroll many students at once from a CSV and an image folder. "
+                                                 "Run it while the app is closed, or use Bulk Import in the app.")
+    parser.add_argument("csv", help="CSV with Reg No and Name columns, and optionally File Paths")
+    parser.add_argument("--images", default=None,
+                        help="Folder with the photos, or <Reg No>.jpg per student when File Paths is empty")
+    parser.add_argument("--roster", default="Student.csv", help="Roster CSV to add the students to")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--skip-invalid", action="store_true", help="Import the valid rows despite errors")
+    parser.add_argument("--allow-duplicates", action="store_true",
+                        help="Import even when two Reg Nos look like the same face")
+    parser.add_argument("--dry-run", action="store_true", help="Validate and encode only")
+    parser.add_argument("--db", default=DATABASE['db_file'], help="Attendance database to add the students to")
+    parser.add_argument("--no-db", action="store_true", help="Leave the attendance database alone")
+    args = parser.parse_args()
+
+    gallery, _ = load_student_encodings(args.roster)
+
+    def progress(done, total, image_path):
+        if done == total or done % 50 == 0:
+            print(f"[Log] Encoded {done}/{total}: {image_path}")
+
+    plan = prepare_import(args.csv, args.images, args.roster, gallery, progress, args.workers)
+    for line in plan_report(plan):
+        print(line)
+    if args.dry_run:
+        return
+    if plan.errors and not args.skip_invalid:
+        raise SystemExit("[Error] Nothing imported; fix the rows above or pass --skip-invalid.")
+    if plan.duplicates and not args.allow_duplicates:
+        raise SystemExit("[Error] Nothing imported; check the possible duplicates or pass --allow-duplicates.")
+    if not plan.rows:
+        raise SystemExit("[Error] No valid rows to import.")
+    gallery, reg_no_to_name = commit_import(plan, gallery, args.roster)
+    if not args.no_db:
+        from attendance_db import AttendanceStore
+        store = AttendanceStore(args.db)
+        store.sync_students(reg_no_to_name)
+        store.close()
+    print(f"[Log] Imported {len(plan.rows)} students; the roster now has {len(reg_no_to_name)} students and "
+          f"{len(gallery)} encodings.")
+
+
+if __name__ == "__main__":
+    main()
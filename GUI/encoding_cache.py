@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+from encoding_store import store_parameters
+from gallery import ENCODING_DIM
+
+
+def settings_digest():
+    encoded = json.dumps(store_parameters(), sort_keys=True).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def file_digest(image_path):
+    sha = hashlib.sha1()
+    with open(image_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class RefreshReport:
+
+    def __init__(self):
+
+        self.reused = 0
+        self.recomputed = 0
+        self.removed = 0
+        self.compressed = 0
+        self.missing = []
+        self.failures = []
+
+
+    def __str__(self):
+
+        text = (f"{self.reused} images reused, {self.recomputed} recomputed, "
+                f"{self.removed} removed")
+        if self.compressed:
+            text += f", {self.compressed} encodings compressed away"
+        if self.missing:
+            text += f", {len(self.missing)} missing"
+        if self.failures:
+            text += f", {len(self.failures)} failed"
+        return text
+
+
+class ImageEncodingCache:
+
+    # Encodings are keyed by settings digest plus file content hash, so a
+    # changed image or a changed model/preprocessing setting is a miss. The
+    # per-path (size, mtime) stamp only saves re-hashing untouched files.
+    def __init__(self, path):
+
+        self.path = path
+        self.settings = settings_digest()
+        self.entries = {}
+        self.paths = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    data = pickle.load(f)
+                self.entries = data.get('entries', {})
+                self.paths = data.get('paths', {})
+            except Exception as e:
+                print(f"[Warning] Ignoring unreadable encoding cache {path}: {e}")
+
+
+    def key_for(self, image_path):
+
+        stat = os.stat(image_path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        cached = self.paths.get(image_path)
+        if cached and cached[0] == stamp and cached[1].startswith(self.settings + ":"):
+            return cached[1]
+        key = f"{self.settings}:{file_digest(image_path)}"
+        self.paths[image_path] = (stamp, key)
+        return key
+
+
+    def get(self, key, default=None):
+
+        return self.entries.get(key, default)
+
+
+    def put(self, key, encodings):
+
+        self.entries[key] = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+
+
+    def discard(self, key):
+
+        self.entries.pop(key, None)
+
+
+    def prune(self, live_paths):
+
+        removed = [p for p in self.paths if p not in live_paths]
+        for image_path in removed:
+            del self.paths[image_path]
+        live_keys = {key for _, key in self.paths.values()}
+        for key in [k for k in self.entries if k not in live_keys]:
+            del self.entries[key]
+        return len(removed)
+
+
+    def save(self):
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({'entries': self.entries, 'paths': self.paths}, f)
+        os.replace(tmp_path, self.path)
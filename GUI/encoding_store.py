@@ -0,0 +1,155 @@
+import json
+import os
+import pickle
+import struct
+import numpy as np
+from my_config import IMAGE_ENHANCEMENT, FACE_RECOGNITION
+from gallery import Gallery, ENCODING_DIM
+
+# File layout: MAGIC, uint32 header length, JSON header, then 64-byte aligned
+# sections for the (rows, dim) float32 matrix, per-row squared norms, per-row
+# student index, per-student row offsets and fixed-width UTF-8 Reg Nos. Rows
+# are grouped by student, so every section can be memory-mapped as is.
+MAGIC = b"SAGALLRY"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+class EncodingStoreError(Exception):
+    pass
+
+
+def store_parameters():
+    return {
+        'dim': ENCODING_DIM,
+        'model': FACE_RECOGNITION['model'],
+        'preprocessing': {key: IMAGE_ENHANCEMENT[key] for key in ('brightness', 'contrast', 'sharpness')},
+    }
+
+
+def write_store(gallery, path, generation=None):
+    # Every write gets a new generation number so a gallery journal written
+    # against an older store is recognised as stale.
+    if generation is None:
+        generation = store_generation(path) + 1
+    matrix, sq_norms, row_student, reg_nos = gallery.arrays()
+    reg_nos = [reg_no.encode('utf-8') for reg_no in reg_nos]
+    counts = np.bincount(row_student, minlength=len(reg_nos))
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    reg_no_width = max([len(r) for r in reg_nos] + [1])
+    reg_no_array = np.array(reg_nos, dtype=f"S{reg_no_width}")
+
+    sections = [
+        ('matrix', np.ascontiguousarray(matrix, dtype=np.float32)),
+        ('sq_norms', np.ascontiguousarray(sq_norms, dtype=np.float32)),
+        ('row_student', np.ascontiguousarray(row_student, dtype=np.int32)),
+        ('offsets', offsets),
+        ('reg_nos', reg_no_array),
+    ]
+
+    header = dict(store_parameters())
+    header.update({
+        'version': FORMAT_VERSION,
+        'rows': int(len(matrix)),
+        'students': len(reg_nos),
+        'max_rows_per_student': int(counts.max()) if len(counts) else 0,
+        'reg_no_width': reg_no_width,
+        'generation': generation,
+        'sections': {},
+    })
+    # Section offsets depend on the header length, so lay out until stable.
+    while True:
+        positions = {}
+        position = _align(len(MAGIC) + 4 + len(_encode_header(header)))
+        for name, array in sections:
+            positions[name] = position
+            position = _align(position + array.nbytes)
+        if positions == header['sections']:
+            break
+        header['sections'] = positions
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        encoded = _encode_header(header)
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(encoded)))
+        f.write(encoded)
+        for name, array in sections:
+            f.write(b"\0" * (header['sections'][name] - f.tell()))
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise EncodingStoreError(f"{path} is not an encoding store")
+        (length,) = struct.unpack("<I", f.read(4))
+        try:
+            return json.loads(f.read(length).decode('utf-8'))
+        except ValueError as e:
+            raise EncodingStoreError(f"Corrupt encoding store header in {path}: {e}")
+
+
+def store_generation(path):
+    try:
+        return read_header(path).get('generation', 0)
+    except (OSError, EncodingStoreError):
+        return 0
+
+
+def load_store(path, index=None):
+    header = read_header(path)
+    if header.get('version') != FORMAT_VERSION:
+        raise EncodingStoreError(f"Unsupported encoding store version {header.get('version')} in {path}")
+    expected = store_parameters()
+    for key, value in expected.items():
+        if header.get(key) != value:
+            raise EncodingStoreError(f"Encoding store {path} was built with {key}={header.get(key)!r}, "
+                                     f"current settings use {value!r}")
+
+    rows, students, dim = header['rows'], header['students'], header['dim']
+    sections = header['sections']
+    if not rows:
+        gallery = Gallery(dim, index)
+        for reg_no in _map(path, sections['reg_nos'], f"S{header['reg_no_width']}", (students,)):
+            gallery.add_student(reg_no.decode('utf-8'))
+        return gallery
+    matrix = _map(path, sections['matrix'], np.float32, (rows, dim))
+    sq_norms = _map(path, sections['sq_norms'], np.float32, (rows,))
+    row_student = _map(path, sections['row_student'], np.int32, (rows,))
+    reg_nos = _map(path, sections['reg_nos'], f"S{header['reg_no_width']}", (students,))
+    return Gallery.from_arrays(matrix, sq_norms, row_student, reg_nos, index)
+
+
+def student_offsets(path):
+    header = read_header(path)
+    offsets = _map(path, header['sections']['offsets'], np.int64, (header['students'] + 1,))
+    reg_nos = _map(path, header['sections']['reg_nos'], f"S{header['reg_no_width']}", (header['students'],))
+    return reg_nos, offsets
+
+
+def migrate_pickle(pickle_path, store_path):
+    with open(pickle_path, "rb") as f:
+        encodings_dict = pickle.load(f)
+    encodings_dict = {reg.strip(): enc for reg, enc in encodings_dict.items()}
+    gallery = Gallery.from_encodings(encodings_dict)
+    write_store(gallery, store_path)
+    return gallery
+
+
+def _map(path, offset, dtype, shape):
+    if not shape[0]:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+def _encode_header(header):
+    return json.dumps(header, sort_keys=True).encode('utf-8')
+
+
+def _align(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
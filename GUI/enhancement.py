@@ -0,0 +1,68 @@
+import numpy as np
+from PIL import Image, ImageFilter
+from my_config import IMAGE_ENHANCEMENT
+
+# Same weights as ImageFilter.SMOOTH, which ImageEnhance.Sharpness blends with.
+SMOOTH_WEIGHTS = np.array([1, 1, 1, 1, 5, 1, 1, 1, 1], dtype=np.float64) / 13.0
+IDENTITY_WEIGHTS = np.array([0, 0, 0, 0, 1, 0, 0, 0, 0], dtype=np.float64)
+
+
+def _blend(base, values, factor):
+    # Mirrors Image.blend: computed in float32 and truncated to uint8.
+    temp = np.float32(base) + np.float32(factor) * (values.astype(np.float32) - np.float32(base))
+    return np.clip(temp, 0, 255).astype(np.uint8)
+
+
+def tone_lut(histogram, settings=IMAGE_ENHANCEMENT):
+    # Brightness followed by contrast, folded into one per-channel lookup
+    # table. The contrast pivot is the mean grey level of the brightened
+    # image, derived from the per-band histogram instead of a converted copy.
+    levels = np.arange(256)
+    bright = _blend(0, levels, settings['brightness'])
+
+    hist = np.asarray(histogram, dtype=np.float64).reshape(-1, 256)
+    channel_means = (hist * bright).sum(axis=1) / np.maximum(hist.sum(axis=1), 1)
+    if len(channel_means) >= 3:
+        grey_mean = (19595 * channel_means[0] + 38470 * channel_means[1] + 7471 * channel_means[2]) / 65536
+    else:
+        grey_mean = channel_means[0]
+    mean = int(grey_mean + 0.5)
+
+    lut = _blend(mean, bright, settings['contrast'])
+    return list(lut) * len(hist)
+
+
+def sharpen_kernel(factor):
+    weights = (1.0 - factor) * SMOOTH_WEIGHTS + factor * IDENTITY_WEIGHTS
+    return ImageFilter.Kernel((3, 3), list(weights), scale=1)
+
+
+def enhance_image(image, settings=IMAGE_ENHANCEMENT, histogram=None):
+    pil_img = Image.fromarray(image)
+    if histogram is None:
+        histogram = pil_img.histogram()
+    pil_img = pil_img.point(tone_lut(histogram, settings))
+    pil_img = pil_img.filter(sharpen_kernel(settings['sharpness']))
+    return np.array(pil_img)
+
+
+def sample_histogram(image, step=4):
+    # Histogram of a strided view, enough to estimate the contrast pivot of a
+    # large frame without touching every pixel.
+    return Image.fromarray(np.ascontiguousarray(image[::step, ::step])).histogram()
+
+
+def enhance_regions(image, boxes, margin=0.5, settings=IMAGE_ENHANCEMENT):
+    # Enhances only padded crops around each face box. Returns the enhanced
+    # crops with the box translated into crop coordinates.
+    height, width = image.shape[:2]
+    histogram = sample_histogram(image)
+    regions = []
+    for top, right, bottom, left in boxes:
+        pad_y = int((bottom - top) * margin)
+        pad_x = int((right - left) * margin)
+        y0, y1 = max(0, top - pad_y), min(height, bottom + pad_y)
+        x0, x1 = max(0, left - pad_x), min(width, right + pad_x)
+        crop = enhance_image(np.ascontiguousarray(image[y0:y1, x0:x1]), settings, histogram)
+        regions.append((crop, (top - y0, right - x0, bottom - y0, left - x0)))
+    return regions
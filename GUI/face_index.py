@@ -0,0 +1,157 @@
+import numpy as np
+from my_config import FACE_RECOGNITION
+
+
+class ExactIndex:
+
+    name = 'exact'
+
+    def candidate_rows(self, probes, matrix, layout_version):
+
+        return None
+
+
+class IVFIndex:
+
+    name = 'ivf'
+
+    def __init__(self, nlist=None, nprobe=8, train_iterations=10, seed=0):
+
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.seed = seed
+        self.centroids = None
+        self._trained_rows = 0
+        self._layout_version = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._lists = []
+
+
+    def candidate_rows(self, probes, matrix, layout_version):
+
+        self._sync(matrix, layout_version)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe_distances = _squared_distances(probes, self.centroids)
+        nearest = np.argpartition(probe_distances, nprobe - 1, axis=1)[:, :nprobe]
+
+        rows = []
+        for lists in nearest:
+            probe_rows = np.concatenate([self._lists[i] for i in lists])
+            probe_rows.sort()
+            rows.append(probe_rows)
+        return rows
+
+
+    def _sync(self, matrix, layout_version):
+
+        # Retrain once the gallery has doubled since the last training,
+        # reassign everything when rows were permuted, and otherwise only
+        # assign rows appended since the last search.
+        size = len(matrix)
+        if self.centroids is None or size > 2 * self._trained_rows:
+            self._train(matrix)
+            self._assign(matrix, 0)
+        elif layout_version != self._layout_version or size < len(self._assignments):
+            self._assign(matrix, 0)
+        elif size > len(self._assignments):
+            self._assign(matrix, len(self._assignments))
+        self._layout_version = layout_version
+
+
+    def _train(self, matrix):
+
+        rng = np.random.default_rng(self.seed)
+        nlist = self.nlist or int(4 * np.sqrt(len(matrix)))
+        nlist = max(1, min(nlist, len(matrix)))
+
+        sample_size = min(len(matrix), 256 * nlist)
+        sample = matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            labels = _nearest_centroid(sample, centroids)
+            order = np.argsort(labels, kind='stable')
+            filled, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[filled] = sums / counts[:, None]
+
+        self.centroids = centroids
+        self._trained_rows = len(matrix)
+
+
+    def _assign(self, matrix, start):
+
+        labels = _nearest_centroid(matrix[start:], self.centroids)
+        self._assignments = np.concatenate((self._assignments[:start], labels))
+
+        order = np.argsort(self._assignments, kind='stable').astype(np.int64)
+        bounds = np.searchsorted(self._assignments[order], np.arange(len(self.centroids) + 1))
+        self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+
+class AutoIndex:
+
+    def __init__(self, min_rows, approximate):
+
+        self.min_rows = min_rows
+        self.approximate = approximate
+
+
+    @property
+    def name(self):
+
+        return f"auto({self.approximate.name} from {self.min_rows} rows)"
+
+
+    def candidate_rows(self, probes, matrix, layout_version):
+
+        if len(matrix) < self.min_rows:
+            return None
+        return self.approximate.candidate_rows(probes, matrix, layout_version)
+
+
+def make_index(config=FACE_RECOGNITION):
+
+    kind = config.get('index', 'auto')
+    if kind == 'exact':
+        return ExactIndex()
+    ivf = IVFIndex(nlist=config.get('ann_nlist'), nprobe=config.get('ann_nprobe', 8))
+    if kind == 'ivf':
+        return ivf
+    if kind == 'auto':
+        return AutoIndex(config.get('ann_min_rows', 20000), ivf)
+    raise ValueError(f"Unknown face index type: {kind}")
+
+
+def measure_recall(gallery, probes, index):
+
+    previous = gallery.index
+    try:
+        gallery.index = ExactIndex()
+        exact = [reg_no for reg_no, _ in gallery.best_matches(probes)]
+        gallery.index = index
+        approximate = [reg_no for reg_no, _ in gallery.best_matches(probes)]
+    finally:
+        gallery.index = previous
+    hits = sum(1 for a, b in zip(exact, approximate) if a == b)
+    return hits / len(exact) if exact else 1.0
+
+
+def _nearest_centroid(rows, centroids, chunk_rows=16384):
+
+    # Chunked so the (rows, nlist) distance block stays small even when a
+    # large gallery is trained on in one go.
+    labels = np.empty(len(rows), dtype=np.int32)
+    for start in range(0, len(rows), chunk_rows):
+        labels[start:start + chunk_rows] = _squared_distances(rows[start:start + chunk_rows], centroids).argmin(axis=1)
+    return labels
+
+
+def _squared_distances(a, b):
+
+    d2 = a @ b.T
+    d2 *= -2.0
+    d2 += np.einsum('ij,ij->i', a, a)[:, None]
+    d2 += np.einsum('ij,ij->i', b, b)[None, :]
+    return d2
@@ -1,129 +1,462 @@
+import multiprocessing
 import os
-import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from functools import partial
 import numpy as np
 import pandas as pd
 import face_recognition as fr
-from PIL import Image, ImageEnhance
-from my_config import IMAGE_ENHANCEMENT, FACE_RECOGNITION
+from PIL import Image
+from my_config import IMAGE_ENHANCEMENT, FACE_RECOGNITION, ENCODING_STORE, TILED_DETECTION
+from gallery import Gallery, GalleryView
+from enhancement import enhance_image, enhance_regions, sample_histogram
+from encoding_store import EncodingStoreError, load_store, migrate_pickle, read_header, store_generation, write_store
+from gallery_journal import GalleryJournal, journal_generation, replay_journal
+from encoding_cache import ImageEncodingCache, RefreshReport
+from probe_cache import default_probe_cache
+from prototypes import compress_gallery, max_prototypes_per_student
+from instrumentation import StageMetrics, record_event, record_metrics, run_profiled
+from recognition_worker import RecognitionCancelled
 
 
 def preprocess_image(image):
-    pil_img = Image.fromarray(image)
-    enhancer = ImageEnhance.Brightness(pil_img)
-    pil_img = enhancer.enhance(IMAGE_ENHANCEMENT['brightness'])
-    
-    enhancer = ImageEnhance.Contrast(pil_img)
-    pil_img = enhancer.enhance(IMAGE_ENHANCEMENT['contrast'])
-    
-    enhancer = ImageEnhance.Sharpness(pil_img)
-    pil_img = enhancer.enhance(IMAGE_ENHANCEMENT['sharpness'])
-    
-    return np.array(pil_img)
+    return enhance_image(image, IMAGE_ENHANCEMENT)
 
 
-def load_student_encodings(student_csv='Student.csv', force_refresh=False):
-    import os
-    need_refresh = force_refresh
-    
-    if not os.path.exists("student_encodings.pkl"):
-        need_refresh = True
-    else:
-        csv_mtime = os.path.getmtime(student_csv)
-        pickle_mtime = os.path.getmtime("student_encodings.pkl")
-        if csv_mtime > pickle_mtime:
-            need_refresh = True
-
+def read_student_csv(student_csv='Student.csv'):
     df = pd.read_csv(student_csv, dtype=str)
     df["Reg No"] = df["Reg No"].str.strip()
+    df["File Paths"] = df["File Paths"].fillna("")
     reg_no_to_name = dict(zip(df["Reg No"], df["Name"]))
-    
-    if need_refresh:
-        encodings_dict = precompute_student_encodings(df)
+    return df, reg_no_to_name
+
+
+def load_student_encodings(student_csv='Student.csv', force_refresh=False, full_rebuild=False):
+    store_path = ENCODING_STORE['path']
+    legacy_path = ENCODING_STORE['legacy_pickle']
+    csv_mtime = os.path.getmtime(student_csv)
+
+    started = time.perf_counter()
+    df, reg_no_to_name = read_student_csv(student_csv)
+
+    gallery = None
+    source = 'store'
+    if not force_refresh and not full_rebuild:
+        if (not os.path.exists(store_path) and os.path.exists(legacy_path)
+                and csv_mtime <= os.path.getmtime(legacy_path)):
+            migrate_pickle(legacy_path, store_path)
+            print(f"[Log] Migrated {legacy_path} to {store_path}.")
+        if os.path.exists(store_path) and csv_mtime <= _encodings_mtime(store_path):
+            try:
+                gallery = load_gallery(store_path)
+            except EncodingStoreError as e:
+                print(f"[Warning] {e}. Re-encoding students.")
+            else:
+                # Students who outgrew the cap (e.g. before it was set) are
+                # compressed once and the journal is folded into the new
+                # store; a store already within the cap is not scanned.
+                if store_needs_compression(store_path):
+                    gallery, dropped = compress_gallery(gallery)
+                    save_student_encodings(gallery)
+                    if dropped:
+                        print(f"[Log] Compressed the gallery by {dropped} encodings "
+                              f"(at most {max_prototypes_per_student()} per student).")
+
+    if gallery is None:
+        source = 'rebuild'
+        gallery, _ = precompute_student_encodings(df, full_rebuild=full_rebuild)
+
+    elapsed = time.perf_counter() - started
+    print(f"[Log] Loaded {len(gallery)} encodings for {len(reg_no_to_name)} students in {elapsed * 1000:.0f} ms "
+          f"({source}).")
+    record_event('gallery_load', source=source, seconds=round(elapsed, 4), rows=len(gallery),
+                 students=len(reg_no_to_name))
+    return gallery, reg_no_to_name
+
+
+def refresh_student_encodings(student_csv='Student.csv', full_rebuild=False, progress=None):
+    df, reg_no_to_name = read_student_csv(student_csv)
+    gallery, report = precompute_student_encodings(df, full_rebuild=full_rebuild, progress=progress)
+    return gallery, reg_no_to_name, report
+
+
+def _encodings_mtime(store_path):
+    # A journal written against this store counts as part of it, so roster
+    # edits saved together with journalled encodings don't force a rebuild.
+    mtime = os.path.getmtime(store_path)
+    journal_path = ENCODING_STORE['journal']
+    if journal_generation(journal_path) == store_generation(store_path):
+        mtime = max(mtime, os.path.getmtime(journal_path))
+    return mtime
+
+
+def load_gallery(store_path=None):
+    # The store snapshot plus any journal records written against it.
+    store_path = store_path or ENCODING_STORE['path']
+    gallery = load_store(store_path)
+    applied = replay_journal(gallery, ENCODING_STORE['journal'], store_generation(store_path))
+    if applied:
+        print(f"[Log] Replayed {applied} journal records onto {store_path}.")
+    return gallery
+
+
+def store_needs_compression(store_path):
+    # write_store records its largest student, so only stores written under
+    # a higher cap, or before the field existed, need compress_gallery.
+    cap = max_prototypes_per_student()
+    if not cap:
+        return False
+    largest = read_header(store_path).get('max_rows_per_student')
+    return largest is None or largest > cap
+
+
+def open_gallery_journal():
+    return GalleryJournal(ENCODING_STORE['journal'], store_generation(ENCODING_STORE['path']))
+
+
+def save_student_encodings(gallery):
+    write_store(gallery, ENCODING_STORE['path'])
+
+
+def encode_enrollment_image(image_path):
+    image = fr.load_image_file(image_path)
+    image = preprocess_image(image)
+    return fr.face_encodings(image, model=FACE_RECOGNITION['model'])
+
+
+def _encode_worker(image_path):
+    try:
+        return image_path, encode_enrollment_image(image_path), None
+    except Exception as e:
+        return image_path, [], str(e)
+
+
+def _detect_worker(image_path, expected_faces=None):
+    try:
+        face_locations, unknown_encodings, _ = detect_and_encode(image_path, expected_faces)
+        return image_path, face_locations, unknown_encodings, None
+    except Exception as e:
+        return image_path, [], [], str(e)
+
+
+def _run_parallel(worker, image_paths, progress=None, workers=None):
+    # dlib holds the GIL, so images are spread over processes. Each worker
+    # imports this module once, which loads the dlib models a single time
+    # per process; results are yielded as soon as each image finishes.
+    workers = workers or os.cpu_count() or 1
+    total = len(image_paths)
+    executor = None
+    if workers == 1 or total <= 1:
+        results = map(worker, image_paths)
     else:
-        with open("student_encodings.pkl", "rb") as f:
-            encodings_dict = pickle.load(f)
-        encodings_dict = {reg.strip(): enc for reg, enc in encodings_dict.items()}
-    
-    return encodings_dict, reg_no_to_name
+        executor = ProcessPoolExecutor(max_workers=min(workers, total))
+        futures = [executor.submit(worker, path) for path in image_paths]
+        results = (future.result() for future in as_completed(futures))
+    try:
+        for done, result in enumerate(results, 1):
+            if progress:
+                progress(done, total, result[0])
+            yield result
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
 
-def precompute_student_encodings(df):
-    encodings_dict = {}
-    
+def encode_images_parallel(image_paths, progress=None, workers=None):
+    return _run_parallel(_encode_worker, image_paths, progress, workers)
+
+
+def detect_images_parallel(image_paths, progress=None, workers=None, expected_faces=None):
+    worker = partial(_detect_worker, expected_faces=expected_faces)
+    return _run_parallel(worker, image_paths, progress, workers)
+
+
+def precompute_student_encodings(df, full_rebuild=False, progress=None):
+    cache = ImageEncodingCache(ENCODING_STORE['image_cache'])
+    report = RefreshReport()
+    student_keys = []
+    pending = {}
+    live_paths = set()
+
     for _, row in df.iterrows():
-        stud_paths = row['File Paths'].split(',')
-        all_encodings = []
-        
-        for image_path in stud_paths:
+        keys = []
+        for image_path in row['File Paths'].split(','):
             image_path = image_path.strip()
+            if not image_path:
+                continue
             if not os.path.exists(image_path):
-                print(f"[Warning] Image file not found: {image_path}")
+                report.missing.append(image_path)
                 continue
             try:
-                image = fr.load_image_file(image_path)
-                image = preprocess_image(image)
-                encodings = fr.face_encodings(image, model=FACE_RECOGNITION['model'])
-                if encodings:
-                    all_encodings.extend(encodings)
-            except Exception as e:
-                print(f"[Warning] Error processing {image_path}: {e}")
-        
-        encodings_dict[row['Reg No']] = all_encodings
-
-    with open("student_encodings.pkl", "wb") as f:
-        pickle.dump(encodings_dict, f)
-    
-    print("[Log] Student encodings precomputed and saved.")
-    return encodings_dict
+                key = cache.key_for(image_path)
+            except OSError as e:
+                report.failures.append((image_path, str(e)))
+                continue
+            keys.append(key)
+            live_paths.add(image_path)
+            if full_rebuild or cache.get(key) is None:
+                pending.setdefault(key, image_path)
+            else:
+                report.reused += 1
+        student_keys.append((row['Reg No'], keys))
 
+    key_for_path = {image_path: key for key, image_path in pending.items()}
+    for image_path, encodings, error in encode_images_parallel(list(pending.values()), progress):
+        if error:
+            report.failures.append((image_path, error))
+            cache.discard(key_for_path[image_path])
+        else:
+            cache.put(key_for_path[image_path], encodings)
+            report.recomputed += 1
 
-def recognize_faces_in_image(image_path, student_encodings, reg_no_to_name):
-    logs = []
-    
-    if not os.path.exists(image_path):
-        logs.append(f"[Error] Image file not found: {image_path}")
-        return set(), logs, [], None
-    
+    encodings_dict = {}
+    for reg_no, keys in student_keys:
+        encodings_dict[reg_no] = [e for key in keys for e in cache.get(key, ())]
+
+    report.removed = cache.prune(live_paths)
+    cache.save()
+
+    gallery, report.compressed = compress_gallery(Gallery.from_encodings(encodings_dict))
+    save_student_encodings(gallery)
+
+    print(f"[Log] Student encodings saved: {report}.")
+    return gallery, report
+
+
+# dlib's HOG detector, upsampled once (face_locations' default), finds
+# faces down to about 40 px.
+DETECTOR_MIN_FACE_PX = 40
+
+
+def detection_scale(height, width, settings=None):
+    # How far an image is shrunk before detection: resize_scale, but never
+    # so far that the long side drops below min_detection_side or that a
+    # face of min_face_px at full resolution becomes too small to detect.
+    # Images already that small are detected as they are.
+    settings = settings or FACE_RECOGNITION
+    scale = settings.get('resize_scale', 1.0)
+    if not scale or scale >= 1:
+        return 1.0
+    floor = settings.get('min_detection_side', 0) / max(height, width, 1)
+    if settings.get('min_face_px'):
+        floor = max(floor, DETECTOR_MIN_FACE_PX / settings['min_face_px'])
+    return min(1.0, max(scale, floor))
+
+
+def detect_faces(image, expected_faces=None, logs=None, settings=None):
+    # Detect on a downscaled copy and map the boxes back to full resolution;
+    # fall back to a full-resolution pass when too few faces are found.
+    # settings holds resize_scale, min_detection_side and min_face_px
+    # (FACE_RECOGNITION unless given).
+    height, width = image.shape[:2]
+    scale = detection_scale(height, width, settings)
+    if scale < 1:
+        small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        small = np.asarray(Image.fromarray(image).resize(small_size, Image.BILINEAR))
+        face_locations = [_scale_box(box, width / small_size[0], height / small_size[1], width, height)
+                          for box in fr.face_locations(small)]
+        if expected_faces is None:
+            expected_faces = FACE_RECOGNITION.get('min_detected_faces', 1)
+        if len(face_locations) >= expected_faces:
+            return face_locations
+        if logs is not None:
+            logs.append(f"[Log] Downscaled detection found {len(face_locations)} faces, "
+                        f"expected {expected_faces}; retrying at full resolution.")
+    return fr.face_locations(image)
+
+
+def _scale_box(box, x_factor, y_factor, width, height):
+    top, right, bottom, left = box
+    return (max(0, int(top * y_factor)), min(width, int(round(right * x_factor))),
+            min(height, int(round(bottom * y_factor))), max(0, int(left * x_factor)))
+
+
+def use_tiled_detection(image):
+    min_megapixels = TILED_DETECTION.get('min_megapixels')
+    return bool(min_megapixels) and image.shape[0] * image.shape[1] >= min_megapixels * 1e6
+
+
+def tile_grid(height, width, size, overlap):
+    # (top, left, bottom, right) of size x size tiles overlapping by
+    # `overlap` pixels; the last row and column are aligned to the edge.
+    step = max(1, size - overlap)
+
+    def starts(length):
+        if length <= size:
+            return [0]
+        return list(range(0, length - size, step)) + [length - size]
+    return [(y, x, min(height, y + size), min(width, x + size)) for y in starts(height) for x in starts(width)]
+
+
+def suppress_duplicate_boxes(boxes, max_overlap):
+    # Greedy non-maximum suppression with box area as the score. A face cut
+    # by a tile seam is a smaller box lying inside the whole one, so overlap
+    # is measured against the smaller of the two boxes rather than as IoU.
+    if not boxes:
+        return []
+    array = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    top, right, bottom, left = array.T
+    areas = (bottom - top) * (right - left)
+    kept = []
+    for i in np.argsort(-areas, kind='stable'):
+        if kept:
+            k = np.asarray(kept)
+            inter_h = np.clip(np.minimum(bottom[k], bottom[i]) - np.maximum(top[k], top[i]), 0, None)
+            inter_w = np.clip(np.minimum(right[k], right[i]) - np.maximum(left[k], left[i]), 0, None)
+            smaller = np.maximum(np.minimum(areas[k], areas[i]), 1)
+            if (inter_h * inter_w / smaller).max() >= max_overlap:
+                continue
+        kept.append(i)
+    return [tuple(int(v) for v in array[i]) for i in sorted(kept)]
+
+
+def _detect_tile(tile, histogram=None, upsample=1, small_face_px=0, back_row=False):
+    # One tile in a worker process, upsampled as often as face_locations'
+    # default so nothing the full-frame detector finds is lost. Back-row
+    # tiles, where the smallest faces are, are upsampled once more from the
+    # start; any other tile whose faces turn out small gets a second pass
+    # upsampled once more, which finds the smaller faces next to them.
+    # Returns (boxes, upsampled).
+    if histogram is not None:
+        tile = enhance_image(tile, IMAGE_ENHANCEMENT, histogram)
+    if back_row:
+        return fr.face_locations(tile, number_of_times_to_upsample=upsample + 1), True
+    boxes = fr.face_locations(tile, number_of_times_to_upsample=upsample)
+    if boxes and small_face_px and np.median([bottom - top for top, _, bottom, _ in boxes]) < small_face_px:
+        return fr.face_locations(tile, number_of_times_to_upsample=upsample + 1), True
+    return boxes, False
+
+
+def _map_tiles(image, tiles, histogram, workers):
+    # Yields (tile, boxes, upsampled). At most two tiles per worker are in
+    # flight, so memory follows the tile size rather than the image size.
+    # Inside a pool worker (batch mode) the tiles run serially instead.
+    options = dict(histogram=histogram, upsample=TILED_DETECTION.get('upsample', 1),
+                   small_face_px=TILED_DETECTION.get('small_face_px', 0))
+    back_rows = image.shape[0] * TILED_DETECTION.get('back_rows_fraction', 0)
+    workers = min(workers or os.cpu_count() or 1, len(tiles))
+    if workers == 1 or multiprocessing.parent_process() is not None:
+        for tile in tiles:
+            top, left, bottom, right = tile
+            yield (tile,) + _detect_tile(np.ascontiguousarray(image[top:bottom, left:right]),
+                                         back_row=top < back_rows, **options)
+        return
+    remaining = iter(tiles)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            while True:
+                while len(running) < 2 * workers:
+                    tile = next(remaining, None)
+                    if tile is None:
+                        break
+                    top, left, bottom, right = tile
+                    crop = np.ascontiguousarray(image[top:bottom, left:right])
+                    running[executor.submit(_detect_tile, crop, back_row=top < back_rows, **options)] = tile
+                if not running:
+                    return
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield (running.pop(future),) + future.result()
+        finally:
+            for future in running:
+                future.cancel()
+
+
+def detect_faces_tiled(image, logs=None, progress=None, cancel_event=None, workers=None):
+    # For very large photos. A downscaled pass over the whole image finds the
+    # large faces; overlapping full-resolution tiles find the small ones,
+    # and boxes found twice across tile seams or by both passes are merged.
+    # With the default resize_scale the downscaled pass finds faces from
+    # about 160 px up, which is why the tiles overlap by that much.
+    height, width = image.shape[:2]
+    histogram = sample_histogram(image) if IMAGE_ENHANCEMENT.get('mode', 'frame') == 'frame' else None
+    boxes = []
+    scale = FACE_RECOGNITION.get('resize_scale', 1.0)
+    if scale and 0 < scale < 1:
+        small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        small = np.asarray(Image.fromarray(image).resize(small_size, Image.BILINEAR))
+        if histogram is not None:
+            small = enhance_image(small, IMAGE_ENHANCEMENT, histogram)
+        boxes.extend(_scale_box(box, width / small_size[0], height / small_size[1], width, height)
+                     for box in fr.face_locations(small))
+        del small
+
+    tiles = tile_grid(height, width, TILED_DETECTION.get('tile_size', 1024), TILED_DETECTION.get('overlap', 160))
+    upsampled = 0
+    results = _map_tiles(image, tiles, histogram, workers or TILED_DETECTION.get('workers'))
     try:
-        unknown_image = fr.load_image_file(image_path)
-        unknown_image = preprocess_image(unknown_image)
-        face_locations = fr.face_locations(unknown_image)
-        unknown_encodings = fr.face_encodings(unknown_image,
-                                              known_face_locations=face_locations,
-                                              model=FACE_RECOGNITION['model'])
-    except Exception as e:
-        logs.append(f"[Error] Failed to process image: {e}")
-        return set(), logs, [], None
-    
-    if not unknown_encodings:
-        logs.append("[Error] No faces detected in the image.")
-        return set(), logs, [], unknown_image
+        for done, (tile, tile_boxes, tile_upsampled) in enumerate(results, 1):
+            _enter_stage(f"detecting tile {done}/{len(tiles)}", progress, cancel_event)
+            top, left = tile[0], tile[1]
+            boxes.extend((t + top, r + left, b + top, l + left) for t, r, b, l in tile_boxes)
+            upsampled += tile_upsampled
+    finally:
+        results.close()
+
+    face_locations = suppress_duplicate_boxes(boxes, TILED_DETECTION.get('nms_overlap', 0.5))
+    if logs is not None:
+        logs.append(f"[Log] Tiled detection: {len(tiles)} tiles ({upsampled} upsampled), {len(boxes)} boxes, "
+                    f"{len(face_locations)} faces after merging.")
+    return face_locations
+
+
+def _enter_stage(stage, progress=None, cancel_event=None):
+    if cancel_event is not None and cancel_event.is_set():
+        raise RecognitionCancelled(stage)
+    if progress:
+        progress(stage)
+
+
+def enhances_whole_photo(image):
+    # Large photos are detected tile by tile and, like 'faces' mode, only
+    # the crops around faces are enhanced and encoded; otherwise the whole
+    # photo is enhanced and that is the image detect_and_encode returns.
+    return not use_tiled_detection(image) and IMAGE_ENHANCEMENT.get('mode', 'frame') != 'faces'
+
+
+def detect_and_encode(image_path, expected_faces=None, logs=None, progress=None, cancel_event=None):
+    _enter_stage("loading", progress, cancel_event)
+    unknown_image = fr.load_image_file(image_path)
+    if not enhances_whole_photo(unknown_image):
+        tiled = use_tiled_detection(unknown_image)
+        _enter_stage("detecting", progress, cancel_event)
+        if tiled:
+            face_locations = detect_faces_tiled(unknown_image, logs, progress, cancel_event)
+        else:
+            face_locations = detect_faces(unknown_image, expected_faces, logs)
+        _enter_stage("encoding", progress, cancel_event)
+        unknown_encodings = []
+        for crop, box in enhance_regions(unknown_image, face_locations):
+            unknown_encodings.extend(fr.face_encodings(crop, known_face_locations=[box],
+                                                       model=FACE_RECOGNITION['model']))
+        return face_locations, unknown_encodings, unknown_image
+
+    _enter_stage("enhancing", progress, cancel_event)
+    unknown_image = preprocess_image(unknown_image)
+    _enter_stage("detecting", progress, cancel_event)
+    face_locations = detect_faces(unknown_image, expected_faces, logs)
+    _enter_stage("encoding", progress, cancel_event)
+    unknown_encodings = fr.face_encodings(unknown_image,
+                                          known_face_locations=face_locations,
+                                          model=FACE_RECOGNITION['model'])
+    return face_locations, unknown_encodings, unknown_image
 
+
+def match_faces(unknown_encodings, face_locations, student_encodings):
+    if not isinstance(student_encodings, (Gallery, GalleryView)):
+        student_encodings = Gallery.from_encodings(student_encodings)
+
+    logs = []
     recognized_reg_nos = set()
     close_match_candidates = []
 
     confirmation_margin = FACE_RECOGNITION.get('confirmation_margin', 0.1)
     confirmation_threshold = FACE_RECOGNITION['threshold'] + confirmation_margin
 
-    for i, unknown_encoding in enumerate(unknown_encodings):
-        best_match = None
-        best_distance = 1.0
-
-        for reg_no, known_encodings in student_encodings.items():
-            distances = []
-            for known_encoding in known_encodings:
-                if not isinstance(known_encoding, np.ndarray):
-                    known_encoding = np.array(known_encoding)
-                if known_encoding.ndim != 1:
-                    known_encoding = known_encoding.flatten()
-                d = fr.face_distance([known_encoding], unknown_encoding)[0]
-                distances.append(d)
-            if distances:
-                student_min_distance = min(distances)
-                if student_min_distance < best_distance:
-                    best_distance = student_min_distance
-                    best_match = reg_no
+    matches = student_encodings.best_matches(unknown_encodings)
 
+    for i, (unknown_encoding, (best_match, best_distance)) in enumerate(zip(unknown_encodings, matches)):
         if best_distance < FACE_RECOGNITION['threshold']:
             recognized_reg_nos.add(best_match)
         elif best_distance < confirmation_threshold:
@@ -132,4 +465,112 @@ def recognize_faces_in_image(image_path, student_encodings, reg_no_to_name):
         else:
             logs.append(f"Unknown face with distance: {best_distance:.3f}")
 
+    return recognized_reg_nos, logs, close_match_candidates
+
+
+def candidate_strip(entries):
+    # entries are (encoding, reg_no, distance, crop) with crop a PIL image.
+    # The crops are pasted side by side so callers can crop each face out of
+    # one image by its location, as with a still photo.
+    if not entries:
+        return [], None
+    height = max(crop.height for *_, crop in entries)
+    width = sum(crop.width for *_, crop in entries)
+    strip = Image.new("RGB", (width, height))
+    candidates = []
+    x = 0
+    for encoding, reg_no, distance, crop in entries:
+        strip.paste(crop, (x, 0))
+        candidates.append((encoding, reg_no, distance, (0, x + crop.width, crop.height, x)))
+        x += crop.width
+    return candidates, np.array(strip)
+
+
+def build_attendance(recognized_reg_nos, reg_no_to_name):
+    presentees = []
+    for reg_no in recognized_reg_nos:
+        name = reg_no_to_name.get(reg_no, "Unknown")
+        presentees.append([reg_no, name])
+
+    absentees = []
+    for reg_no, name in reg_no_to_name.items():
+        if reg_no not in recognized_reg_nos:
+            absentees.append([reg_no, name])
+
+    return (pd.DataFrame(presentees, columns=["Reg No", "Name"]),
+            pd.DataFrame(absentees, columns=["Reg No", "Name"]))
+
+
+def recognize_faces_in_image(image_path, student_encodings, reg_no_to_name, expected_faces=None,
+                             progress=None, cancel_event=None, use_cache=True, return_metrics=False):
+    # With return_metrics=True a StageMetrics with per-stage wall times and
+    # counts is appended to the usual four-tuple.
+    metrics = StageMetrics('recognize', image_path)
+    result, profile_path = run_profiled(os.path.basename(image_path), _recognize_faces_in_image, image_path,
+                                        student_encodings, expected_faces, metrics.wrap(progress), cancel_event,
+                                        use_cache, metrics)
+    metrics.finish()
+    if profile_path:
+        result[1].append(f"[Log] Slow photo profiled to {profile_path}.")
+    record_metrics(metrics)
+    return result + (metrics,) if return_metrics else result
+
+
+def _recognize_faces_in_image(image_path, student_encodings, expected_faces, progress, cancel_event, use_cache,
+                              metrics):
+    logs = []
+    
+    if not os.path.exists(image_path):
+        logs.append(f"[Error] Image file not found: {image_path}")
+        return set(), logs, [], None
+    
+    cache = default_probe_cache() if use_cache else None
+    cached = None
+    try:
+        if cache is not None:
+            _enter_stage("cache lookup", progress, cancel_event)
+            cache_key = cache.key_for(image_path, expected_faces)
+            cached = cache.get(cache_key)
+        if cached is not None:
+            # Only detection and encoding are cached; matching always runs
+            # against the current gallery and thresholds.
+            face_locations, unknown_encodings = cached
+            unknown_image = None
+            logs.append(f"[Log] Reused cached faces for this photo (probe cache: {cache}).")
+        else:
+            face_locations, unknown_encodings, unknown_image = detect_and_encode(image_path, expected_faces, logs,
+                                                                                 progress, cancel_event)
+            if cache is not None:
+                cache.put(cache_key, face_locations, unknown_encodings)
+    except RecognitionCancelled:
+        raise
+    except Exception as e:
+        logs.append(f"[Error] Failed to process image: {e}")
+        return set(), logs, [], None
+
+    metrics.counts['cached'] = cached is not None
+    if unknown_image is not None:
+        metrics.counts['megapixels'] = round(unknown_image.shape[0] * unknown_image.shape[1] / 1e6, 2)
+    metrics.counts['faces'] = len(face_locations)
+    
+    if not unknown_encodings:
+        logs.append("[Error] No faces detected in the image.")
+        return set(), logs, [], unknown_image
+
+    _enter_stage("matching", progress, cancel_event)
+    recognized_reg_nos, match_logs, close_match_candidates = match_faces(unknown_encodings, face_locations,
+                                                                         student_encodings)
+    logs.extend(match_logs)
+    metrics.counts['gallery_rows'] = len(student_encodings)
+    metrics.counts['recognized'] = len(recognized_reg_nos)
+    metrics.counts['close_matches'] = len(close_match_candidates)
+
+    if unknown_image is None and close_match_candidates:
+        # Cache hit: decode the photo only when there are faces to show,
+        # enhanced the same way as on a miss.
+        _enter_stage("loading", progress, cancel_event)
+        unknown_image = fr.load_image_file(image_path)
+        if enhances_whole_photo(unknown_image):
+            unknown_image = preprocess_image(unknown_image)
+
     return recognized_reg_nos, logs, close_match_candidates, unknown_image
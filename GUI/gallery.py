@@ -0,0 +1,450 @@
+import threading
+import numpy as np
+from face_index import make_index
+
+ENCODING_DIM = 128
+MATCH_CHUNK_ROWS = 65536
+# Runs of a view's rows shorter than this are gathered and matched together
+# instead of one small product each.
+VIEW_SLICE_ROWS = 256
+
+
+class Gallery:
+
+    def __init__(self, dim=ENCODING_DIM, index=None):
+
+        self.dim = dim
+        self.index = index if index is not None else make_index()
+        self._reg_nos = []
+        self._student_index = {}
+        self._pending_reg_nos = None
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._row_student = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self._grouped = True
+        self._layout_version = 0
+        self._lock = threading.RLock()
+
+
+    @classmethod
+    def from_encodings(cls, encodings_dict, dim=ENCODING_DIM, index=None):
+
+        gallery = cls(dim, index)
+        rows = []
+        row_student = []
+        for reg_no, encodings in encodings_dict.items():
+            idx = gallery.add_student(reg_no)
+            for encoding in encodings:
+                rows.append(np.asarray(encoding, dtype=np.float32).reshape(-1))
+                row_student.append(idx)
+        if rows:
+            matrix = np.ascontiguousarray(np.vstack(rows), dtype=np.float32)
+            gallery._set_rows(matrix, np.asarray(row_student, dtype=np.int32))
+        return gallery
+
+
+    @classmethod
+    def from_arrays(cls, matrix, sq_norms, row_student, reg_nos, index=None):
+
+        # Wraps already grouped arrays (typically read-only memmaps) without
+        # copying them; the first mutation moves the rows into memory.
+        gallery = cls(matrix.shape[1], index)
+        gallery._matrix = matrix
+        gallery._sq_norms = sq_norms
+        gallery._row_student = row_student
+        gallery._size = len(matrix)
+        gallery._pending_reg_nos = reg_nos
+        gallery._layout_version += 1
+        return gallery
+
+
+    def __len__(self):
+
+        return self._size
+
+
+    def __contains__(self, reg_no):
+
+        return reg_no in self._materialize_reg_nos()
+
+
+    @property
+    def reg_nos(self):
+
+        self._materialize_reg_nos()
+        return self._reg_nos
+
+
+    @property
+    def num_students(self):
+
+        if self._pending_reg_nos is not None:
+            return len(self._pending_reg_nos)
+        return len(self._reg_nos)
+
+
+    @property
+    def matrix(self):
+
+        with self._lock:
+            self._ensure_grouped()
+            return self._matrix[:self._size]
+
+
+    @property
+    def row_reg_nos(self):
+
+        with self._lock:
+            self._ensure_grouped()
+            reg_nos = np.asarray(self.reg_nos, dtype=object)
+            return reg_nos[self._row_student[:self._size]]
+
+
+    def add_student(self, reg_no):
+
+        with self._lock:
+            student_index = self._materialize_reg_nos()
+            idx = student_index.get(reg_no)
+            if idx is None:
+                idx = len(self._reg_nos)
+                self._reg_nos.append(reg_no)
+                student_index[reg_no] = idx
+            return idx
+
+
+    def add(self, reg_no, encoding):
+
+        self.extend(reg_no, [encoding])
+
+
+    def extend(self, reg_no, encodings):
+
+        rows = [np.asarray(e, dtype=np.float32).reshape(-1) for e in encodings]
+        with self._lock:
+            idx = self.add_student(reg_no)
+            if not rows:
+                return
+            new_rows = np.vstack(rows)
+            count = len(new_rows)
+            self._reserve(self._size + count)
+            stop = self._size + count
+            self._matrix[self._size:stop] = new_rows
+            self._sq_norms[self._size:stop] = np.einsum('ij,ij->i', new_rows, new_rows)
+            self._row_student[self._size:stop] = idx
+            if self._size and self._row_student[self._size - 1] > idx:
+                self._grouped = False
+            self._size = stop
+
+
+    def remove(self, reg_no, encoding):
+
+        # Drops one row of reg_no equal to encoding; returns whether one was
+        # found.
+        row = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        with self._lock:
+            idx = self._materialize_reg_nos().get(reg_no)
+            if idx is None:
+                return False
+            candidates = np.flatnonzero(self._row_student[:self._size] == idx)
+            hits = candidates[np.all(self._matrix[candidates] == row, axis=1)]
+            if not len(hits):
+                return False
+            self._drop_rows(hits[:1])
+            return True
+
+
+    def retain(self, reg_no, keep):
+
+        # Keeps the rows of reg_no selected by the boolean mask keep, which
+        # follows encodings_for() order; returns how many rows were dropped.
+        with self._lock:
+            idx = self._materialize_reg_nos().get(reg_no)
+            if idx is None:
+                return 0
+            rows = np.flatnonzero(self._row_student[:self._size] == idx)
+            dropped = rows[~np.asarray(keep, dtype=bool)]
+            if len(dropped):
+                self._drop_rows(dropped)
+            return len(dropped)
+
+
+    def arrays(self):
+
+        with self._lock:
+            self._ensure_grouped()
+            return (self._matrix[:self._size], self._sq_norms[:self._size],
+                    self._row_student[:self._size], list(self.reg_nos))
+
+
+    def encodings_for(self, reg_no):
+
+        with self._lock:
+            idx = self._materialize_reg_nos().get(reg_no)
+            if idx is None:
+                return np.empty((0, self.dim), dtype=np.float32)
+            mask = self._row_student[:self._size] == idx
+            return self._matrix[:self._size][mask]
+
+
+    def to_dict(self):
+
+        with self._lock:
+            self._ensure_grouped()
+            reg_nos = self.reg_nos
+            encodings_dict = {reg_no: [] for reg_no in reg_nos}
+            for row, idx in zip(self._matrix[:self._size], self._row_student[:self._size]):
+                encodings_dict[reg_nos[idx]].append(row.astype(np.float64))
+            return encodings_dict
+
+
+    def student_distances(self, probes):
+
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            self._ensure_grouped()
+            matrix = self._matrix[:self._size]
+            sq_norms = self._sq_norms[:self._size]
+            row_student = self._row_student[:self._size]
+            num_students = self.num_students
+            candidates = None
+            if len(probes) and len(matrix):
+                candidates = self.index.candidate_rows(probes, matrix, self._layout_version)
+
+        out = np.full((len(probes), num_students), np.inf, dtype=np.float32)
+        if not len(probes) or not len(matrix):
+            return out
+
+        probe_sq = np.einsum('ij,ij->i', probes, probes)
+        if candidates is not None:
+            for i, rows in enumerate(candidates):
+                if not len(rows):
+                    continue
+                d2 = matrix[rows] @ probes[i]
+                d2 *= -2.0
+                d2 += probe_sq[i]
+                d2 += sq_norms[rows]
+                cols, seg_min = _segment_min(d2[None, :], row_student[rows])
+                out[i, cols] = seg_min[0]
+        else:
+            for start in range(0, len(matrix), MATCH_CHUNK_ROWS):
+                stop = min(start + MATCH_CHUNK_ROWS, len(matrix))
+                d2 = probes @ matrix[start:stop].T
+                d2 *= -2.0
+                d2 += probe_sq[:, None]
+                d2 += sq_norms[None, start:stop]
+                cols, seg_min = _segment_min(d2, row_student[start:stop])
+                out[:, cols] = np.minimum(out[:, cols], seg_min)
+
+        np.maximum(out, 0.0, out=out)
+        np.sqrt(out, out=out)
+        return out
+
+
+    def best_matches(self, probes):
+
+        return _best_matches(self.student_distances(probes), self.reg_nos)
+
+
+    def view(self, reg_nos):
+
+        return GalleryView(self, reg_nos)
+
+
+    def _materialize_reg_nos(self):
+
+        pending = self._pending_reg_nos
+        if pending is not None:
+            self._reg_nos = [r.decode('utf-8') if isinstance(r, bytes) else str(r) for r in pending]
+            self._student_index = {reg_no: i for i, reg_no in enumerate(self._reg_nos)}
+            self._pending_reg_nos = None
+        return self._student_index
+
+
+    def _reserve(self, capacity):
+
+        if capacity <= len(self._matrix):
+            return
+        new_capacity = max(capacity, 2 * len(self._matrix), 64)
+        matrix = np.empty((new_capacity, self.dim), dtype=np.float32)
+        sq_norms = np.empty(new_capacity, dtype=np.float32)
+        row_student = np.empty(new_capacity, dtype=np.int32)
+        matrix[:self._size] = self._matrix[:self._size]
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        row_student[:self._size] = self._row_student[:self._size]
+        self._matrix, self._sq_norms, self._row_student = matrix, sq_norms, row_student
+
+
+    def _drop_rows(self, positions):
+
+        # Rebuilds the arrays so views handed out earlier stay valid.
+        keep = np.ones(self._size, dtype=bool)
+        keep[positions] = False
+        self._matrix = self._matrix[:self._size][keep]
+        self._sq_norms = self._sq_norms[:self._size][keep]
+        self._row_student = self._row_student[:self._size][keep]
+        self._size = int(keep.sum())
+        self._layout_version += 1
+
+
+    def _set_rows(self, matrix, row_student):
+
+        self._matrix = matrix
+        self._sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+        self._row_student = row_student
+        self._size = len(matrix)
+        self._grouped = bool(np.all(row_student[1:] >= row_student[:-1]))
+        self._layout_version += 1
+
+
+    def _ensure_grouped(self):
+
+        # Rows are kept sorted by student so the per-student minimum is a
+        # single reduceat over contiguous segments. Regrouping builds new
+        # arrays rather than permuting in place, so views handed out earlier
+        # stay valid.
+        if self._grouped:
+            return
+        order = np.argsort(self._row_student[:self._size], kind='stable')
+        self._matrix = self._matrix[order]
+        self._sq_norms = self._sq_norms[order]
+        self._row_student = self._row_student[order]
+        self._grouped = True
+        self._layout_version += 1
+
+
+class GalleryView:
+
+    # The students of one section, matched in place: rows are kept grouped
+    # by student, so the section's rows are slices of the gallery matrix
+    # (adjacent students merge into one slice) and the view only holds
+    # indices. Long slices are matched where they lie; scattered students
+    # are gathered a chunk at a time. The slices follow the gallery as it
+    # changes. Matching is exact; the approximate index only pays off on the
+    # whole gallery.
+    def __init__(self, gallery, reg_nos):
+
+        self.gallery = gallery
+        self.dim = gallery.dim
+        self.members = list(dict.fromkeys(reg_nos))
+        self._state = None
+        self._sync()
+
+
+    def __len__(self):
+
+        return self._sync()[4]
+
+
+    def __contains__(self, reg_no):
+
+        return reg_no in self._sync()[5]
+
+
+    @property
+    def reg_nos(self):
+
+        return self._sync()[1]
+
+
+    @property
+    def num_students(self):
+
+        return len(self.reg_nos)
+
+
+    def encodings_for(self, reg_no):
+
+        if reg_no not in self:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return self.gallery.encodings_for(reg_no)
+
+
+    def _sync(self):
+
+        # (gallery arrays with the column per gallery student, reg_nos, long
+        # slices, gathered rows, row count, Reg No set) for the current
+        # gallery layout; recomputed only when it changed.
+        gallery = self.gallery
+        with gallery._lock:
+            gallery._ensure_grouped()
+            key = (gallery._layout_version, gallery._size, gallery.num_students, id(gallery._matrix))
+            state = self._state
+            if state is not None and state[0] == key:
+                return state[1:]
+            matrix, sq_norms, row_student, gallery_reg_nos = gallery.arrays()
+            student_index = gallery._materialize_reg_nos()
+        students = np.sort(np.asarray([student_index[r] for r in self.members if r in student_index],
+                                      dtype=np.int64))
+        reg_nos = [gallery_reg_nos[i] for i in students]
+        columns = np.full(len(gallery_reg_nos), -1, dtype=np.int64)
+        columns[students] = np.arange(len(students))
+        starts = np.searchsorted(row_student, students, side='left')
+        stops = np.searchsorted(row_student, students, side='right')
+        slices = []
+        for start, stop in zip(starts, stops):
+            if start == stop:
+                continue
+            if slices and slices[-1][1] == start:
+                slices[-1][1] = stop
+            else:
+                slices.append([start, stop])
+        rows = int((stops - starts).sum())
+        short = [np.arange(start, stop) for start, stop in slices if stop - start < VIEW_SLICE_ROWS]
+        gathered = np.concatenate(short) if short else np.empty(0, dtype=np.int64)
+        slices = [(start, stop) for start, stop in slices if stop - start >= VIEW_SLICE_ROWS]
+        self._state = (key, (matrix, sq_norms, row_student, columns), reg_nos, slices, gathered, rows,
+                       set(reg_nos))
+        return self._state[1:]
+
+
+    def student_distances(self, probes):
+
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        (matrix, sq_norms, row_student, columns), reg_nos, slices, gathered, rows, _ = self._sync()
+        out = np.full((len(probes), len(reg_nos)), np.inf, dtype=np.float32)
+        if not len(probes) or not rows:
+            return out
+        probe_sq = np.einsum('ij,ij->i', probes, probes)
+        chunks = [slice(start, min(start + MATCH_CHUNK_ROWS, stop))
+                  for slice_start, stop in slices for start in range(slice_start, stop, MATCH_CHUNK_ROWS)]
+        chunks += [gathered[start:start + MATCH_CHUNK_ROWS] for start in range(0, len(gathered), MATCH_CHUNK_ROWS)]
+        for chunk in chunks:
+            d2 = probes @ matrix[chunk].T
+            d2 *= -2.0
+            d2 += probe_sq[:, None]
+            d2 += sq_norms[chunk][None, :]
+            students, seg_min = _segment_min(d2, row_student[chunk])
+            cols = columns[students]
+            out[:, cols] = np.minimum(out[:, cols], seg_min)
+        np.maximum(out, 0.0, out=out)
+        np.sqrt(out, out=out)
+        return out
+
+
+    def best_matches(self, probes):
+
+        return _best_matches(self.student_distances(probes), self.reg_nos)
+
+
+def _best_matches(distances, reg_nos):
+
+    matches = []
+    if not distances.shape[1]:
+        return [(None, 1.0)] * len(distances)
+    best = distances.argmin(axis=1)
+    best_distances = distances[np.arange(len(distances)), best]
+    for idx, distance in zip(best, best_distances):
+        if distance < 1.0:
+            matches.append((reg_nos[idx], float(distance)))
+        else:
+            matches.append((None, 1.0))
+    return matches
+
+
+def _segment_min(d2, students):
+
+    # students is non-decreasing, so each student's columns form one segment.
+    boundaries = np.flatnonzero(students[1:] != students[:-1]) + 1
+    seg_starts = np.concatenate(([0], boundaries))
+    return students[seg_starts], np.minimum.reduceat(d2, seg_starts, axis=1)
@@ -0,0 +1,290 @@
+import os
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+import numpy as np
+from my_config import ENCODING_STORE
+from gallery import ENCODING_DIM
+from encoding_store import write_store
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# File layout: MAGIC, uint32 version, uint64 generation, then records of
+# uint32 payload length, uint32 CRC-32 of the payload and the payload itself:
+# uint8 kind, uint16 Reg No length, the UTF-8 Reg No, uint32 row count and
+# that many float32 rows. The journal only applies on top of the store with
+# the same generation; a store written later makes it stale.
+MAGIC = b"SAJOURNL"
+JOURNAL_VERSION = 1
+HEADER = struct.Struct("<IQ")
+RECORD = struct.Struct("<II")
+ENTRY = struct.Struct("<BH")
+
+ADD_ENCODING = 1
+ADD_STUDENT = 2
+REMOVE_ENCODING = 3
+
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        return None
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        return None
+    version, generation = HEADER.unpack(data)
+    return generation if version == JOURNAL_VERSION else None
+
+
+def _iter_records(f):
+    # Yields (end_offset, kind, reg_no, rows) and stops at the first torn or
+    # corrupt record, which is what a crash mid-append leaves behind.
+    while True:
+        head = f.read(RECORD.size)
+        if len(head) < RECORD.size:
+            return
+        length, crc = RECORD.unpack(head)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        kind, reg_no_length = ENTRY.unpack_from(payload)
+        position = ENTRY.size
+        reg_no = payload[position:position + reg_no_length].decode('utf-8')
+        position += reg_no_length
+        (count,) = struct.unpack_from("<I", payload, position)
+        rows = np.frombuffer(payload, dtype=np.float32, count=count * ENCODING_DIM,
+                             offset=position + 4).reshape(count, ENCODING_DIM)
+        yield f.tell(), kind, reg_no, rows
+
+
+@contextmanager
+def exclusive_lock(lock_path):
+    # Held around every change to the journal file: the app and the
+    # recognition service may both append to it, and either may compact it.
+    with open(lock_path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def apply_record(gallery, kind, reg_no, rows):
+    if kind in (ADD_STUDENT, ADD_ENCODING):
+        gallery.extend(reg_no, rows)
+    elif kind == REMOVE_ENCODING:
+        for row in rows:
+            gallery.remove(reg_no, row)
+
+
+def journal_generation(path):
+    try:
+        with open(path, "rb") as f:
+            return _read_header(f)
+    except OSError:
+        return None
+
+
+def replay_journal(gallery, path, generation):
+    if not os.path.exists(path):
+        return 0
+    applied = 0
+    with open(path, "rb") as f:
+        journal_generation = _read_header(f)
+        if journal_generation != generation:
+            if journal_generation is not None and journal_generation > generation:
+                print(f"[Warning] Journal {path} is newer than the encoding store; ignoring it.")
+            return 0
+        for _, kind, reg_no, rows in _iter_records(f):
+            apply_record(gallery, kind, reg_no, rows)
+            applied += 1
+    return applied
+
+
+class GalleryJournal:
+
+    # Appends are flushed immediately but only fsynced every sync_records
+    # records or sync_seconds, or when sync() is called at the end of a unit
+    # of work. Compaction folds everything into a new store generation.
+    # Other processes may share the file: every append and compaction runs
+    # under exclusive_lock and first catches up with their appends, so a
+    # compaction keeps their records and an append after their compaction
+    # goes to the new journal.
+    def __init__(self, path, generation, sync_records=None, sync_seconds=None):
+
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.generation = generation
+        self.sync_records = sync_records or ENCODING_STORE.get('journal_sync_records', 32)
+        self.sync_seconds = sync_seconds or ENCODING_STORE.get('journal_sync_seconds', 5.0)
+        self.records = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._file = None
+        self._foreign = []
+        with exclusive_lock(self.lock_path):
+            self._open(generation)
+
+
+    def _open(self, generation):
+
+        path = self.path
+        self.records = 0
+        valid_end = None
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                if _read_header(f) == generation:
+                    valid_end = f.tell()
+                    for valid_end, *_ in _iter_records(f):
+                        self.records += 1
+        if valid_end is None:
+            self._reset(generation)
+        else:
+            self.generation = generation
+            self._file = open(path, "r+b")
+            if valid_end < os.path.getsize(path):
+                print(f"[Warning] Dropping a torn record at the end of {path}.")
+                self._file.truncate(valid_end)
+            self._file.seek(valid_end)
+
+
+    def _follow(self):
+
+        # Under the lock: collects the records other processes appended since
+        # our last write, for the next compaction. Returns False when one of
+        # them compacted the journal into a new store meanwhile; its store
+        # holds those records, and the new journal is opened instead.
+        try:
+            replaced = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self._file.close()
+            self._file = None
+            self._foreign = []
+            generation = journal_generation(self.path)
+            self._open(self.generation if generation is None else generation)
+            return False
+        valid_end = self._file.tell()
+        for valid_end, kind, reg_no, rows in _iter_records(self._file):
+            self._foreign.append((kind, reg_no, rows.copy()))
+            self.records += 1
+        if valid_end < os.fstat(self._file.fileno()).st_size:
+            print(f"[Warning] Dropping a torn record at the end of {self.path}.")
+            self._file.truncate(valid_end)
+        self._file.seek(valid_end)
+        return True
+
+
+    def _reset(self, generation):
+
+        if self._file is not None:
+            self._file.close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(HEADER.pack(JOURNAL_VERSION, generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.generation = generation
+        self.records = 0
+        self._unsynced = 0
+        self._file = open(self.path, "r+b")
+        self._file.seek(0, os.SEEK_END)
+
+
+    def _append(self, kind, reg_no, rows):
+
+        encoded = reg_no.encode('utf-8')
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        payload = (ENTRY.pack(kind, len(encoded)) + encoded + struct.pack("<I", len(rows))
+                   + rows.tobytes())
+        with exclusive_lock(self.lock_path):
+            self._follow()
+            self._file.write(RECORD.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._file.flush()
+        self.records += 1
+        self._unsynced += 1
+        if self._unsynced >= self.sync_records or time.monotonic() - self._last_sync >= self.sync_seconds:
+            self.sync()
+
+
+    def add_encoding(self, reg_no, encoding):
+
+        self._append(ADD_ENCODING, reg_no, [encoding])
+
+
+    def add_student(self, reg_no, encodings=()):
+
+        self._append(ADD_STUDENT, reg_no, list(encodings))
+
+
+    def remove_encoding(self, reg_no, encoding):
+
+        self._append(REMOVE_ENCODING, reg_no, [encoding])
+
+
+    def remove_encodings(self, reg_no, encodings):
+
+        self._append(REMOVE_ENCODING, reg_no, list(encodings))
+
+
+    def sync(self):
+
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+
+    def size(self):
+
+        return self._file.tell()
+
+
+    def needs_compaction(self):
+
+        return (self.records >= ENCODING_STORE.get('journal_compact_records', 500)
+                or self.size() >= ENCODING_STORE.get('journal_compact_bytes', 4 << 20))
+
+
+    def compact(self, gallery, store_path):
+
+        # The new store is renamed into place before the journal is reset. A
+        # crash in between leaves a store one generation ahead of the
+        # journal, whose records it already contains, so they are skipped.
+        # Records other processes appended are applied to gallery first, so
+        # the store keeps them. Returns False when another process compacted
+        # first; its store already holds our records.
+        self.sync()
+        with exclusive_lock(self.lock_path):
+            if not self._follow():
+                return False
+            for kind, reg_no, rows in self._foreign:
+                apply_record(gallery, kind, reg_no, rows)
+            self._foreign = []
+            generation = self.generation + 1
+            write_store(gallery, store_path, generation)
+            self._reset(generation)
+        return True
+
+
+    def close(self):
+
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
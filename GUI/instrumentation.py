@@ -0,0 +1,124 @@
+import cProfile
+import datetime
+import json
+import os
+import threading
+import time
+from my_config import INSTRUMENTATION
+
+_write_lock = threading.Lock()
+_profile_lock = threading.Lock()
+_profiles_captured = 0
+
+
+class StageMetrics:
+
+    # Wall time per pipeline stage plus counts (faces, pixels, ...) for one
+    # call. Stages are entered through the same progress hook the GUI uses;
+    # a stage name's first word is its key, so "frame 30/900" and
+    # "frame 45/900" add up under "frame".
+    def __init__(self, kind, source=None):
+
+        self.kind = kind
+        self.source = source
+        self.timestamp = datetime.datetime.now().isoformat(timespec='seconds')
+        self.stages = {}
+        self.counts = {}
+        self.total = None
+        self._started = time.perf_counter()
+        self._stage = None
+        self._stage_started = None
+
+
+    def enter(self, stage):
+
+        now = time.perf_counter()
+        self._close(now)
+        self._stage = stage.split(' ', 1)[0]
+        self._stage_started = now
+
+
+    def _close(self, now):
+
+        if self._stage is not None:
+            self.stages[self._stage] = self.stages.get(self._stage, 0.0) + now - self._stage_started
+            self._stage = None
+
+
+    def wrap(self, progress=None):
+
+        def progress_with_metrics(stage):
+            self.enter(stage)
+            if progress:
+                progress(stage)
+        return progress_with_metrics
+
+
+    def finish(self):
+
+        now = time.perf_counter()
+        self._close(now)
+        self.total = now - self._started
+        return self
+
+
+    def to_dict(self):
+
+        return {'kind': self.kind, 'source': self.source, 'timestamp': self.timestamp,
+                'total_s': None if self.total is None else round(self.total, 4),
+                'stages_s': {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+                'counts': self.counts}
+
+
+    def summary(self):
+
+        parts = [f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in self.stages.items()]
+        counts = ", ".join(f"{key} {value}" for key, value in self.counts.items())
+        total = f"{self.total * 1000:.0f} ms" if self.total is not None else "?"
+        return f"{total} total: " + " | ".join(parts) + (f" ({counts})" if counts else "")
+
+
+def record_metrics(entry):
+    # Appends one JSON line to INSTRUMENTATION['metrics_file'] when set.
+    path = INSTRUMENTATION.get('metrics_file')
+    if not path:
+        return
+    if isinstance(entry, StageMetrics):
+        entry = entry.to_dict()
+    line = json.dumps(entry, default=str) + "\n"
+    with _write_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def record_event(kind, **fields):
+    record_metrics(dict({'kind': kind, 'timestamp': datetime.datetime.now().isoformat(timespec='seconds')},
+                        **fields))
+
+
+def run_profiled(label, func, *args, **kwargs):
+    # Runs func under cProfile while INSTRUMENTATION['profile_dir'] is set
+    # and fewer than max_profiles slow calls have been captured. The profile
+    # is kept only when the call took profile_slower_than seconds or more.
+    # Returns (result, profile path or None).
+    global _profiles_captured
+    profile_dir = INSTRUMENTATION.get('profile_dir')
+    if not profile_dir or _profiles_captured >= INSTRUMENTATION.get('max_profiles', 1):
+        return func(*args, **kwargs), None
+    if not _profile_lock.acquire(blocking=False):
+        return func(*args, **kwargs), None
+    try:
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        result = profiler.runcall(func, *args, **kwargs)
+        elapsed = time.perf_counter() - started
+        if elapsed < INSTRUMENTATION.get('profile_slower_than', 10.0):
+            return result, None
+        os.makedirs(profile_dir, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(profile_dir, f"{os.path.splitext(label)[0]}_{stamp}.prof")
+        profiler.dump_stats(path)
+        _profiles_captured += 1
+        return result, path
+    finally:
+        _profile_lock.release()
@@ -1,13 +1,45 @@
+import time
+LAUNCHED = time.perf_counter()
+
 import tkinter as tk
-from tkinter import filedialog as fd, messagebox
+from tkinter import filedialog as fd, messagebox, simpledialog
 from tkinter import Toplevel, Label, Button, Frame
-from PIL import Image, ImageTk
-import pandas as pd
-import os, subprocess, sys, pickle, numpy as np, face_recognition as fr
+import os, queue, subprocess, sys, threading
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from face_recognition_module import load_student_encodings, recognize_faces_in_image, preprocess_image
-from my_config import FACE_RECOGNITION
+from my_config import FACE_RECOGNITION, DATABASE, ENCODING_STORE, REJECTIONS, ROSTER_WATCH, SECTIONS, SERVICE, VIDEO
+
+# face_recognition (dlib), pandas, PIL and the gallery stack take seconds to
+# import, so they are only imported on the roster loader thread or inside the
+# methods that need them; the window is drawn first.
+VIDEO_PATTERNS = " ".join("*" + ext for ext in VIDEO['extensions'])
+ALL_STUDENTS = "All students"
+
+
+def load_roster():
+    # Runs on the roster loader thread. With SERVICE['url'] set the app is a
+    # thin client: the gallery stays in the recognition service and only the
+    # roster is fetched, so dlib is never imported here.
+    from rejections import RejectionMemory
+    started = time.perf_counter()
+    if SERVICE.get('url'):
+        from recognition_client import RecognitionClient
+        client = RecognitionClient(SERVICE['url'])
+        reg_no_to_name, _, sections = client.roster()
+        rejections = RejectionMemory(REJECTIONS['path'])
+        return client, reg_no_to_name, sections, None, rejections, None, time.perf_counter() - started
+    from face_recognition_module import load_student_encodings, open_gallery_journal
+    from sections import read_sections
+    student_encodings, reg_no_to_name = load_student_encodings()
+    sections = read_sections()
+    journal = open_gallery_journal()
+    rejections = RejectionMemory(REJECTIONS['path'])
+    watcher = None
+    if ROSTER_WATCH.get('enabled'):
+        from roster_watcher import RosterWatcher
+        watcher = RosterWatcher()
+    return (student_encodings, reg_no_to_name, sections, journal, rejections, watcher,
+            time.perf_counter() - started)
 
 
 class SmartAttendanceApp:
@@ -41,6 +73,14 @@ class SmartAttendanceApp:
                                       command=self.refresh_encodings)
         self.refresh_icon.grid(row=0, column=1, sticky="ne", padx=10)
 
+        self.rebuild_icon = tk.Button(self.header_frame,
+                                      text="⟳ Full",
+                                      font=("Helvetica", 10),
+                                      bg="#121212", fg="#00FF00",
+                                      bd=0, activebackground="#121212",
+                                      command=lambda: self.refresh_encodings(full_rebuild=True))
+        self.rebuild_icon.grid(row=0, column=2, sticky="ne")
+
 
         self.log_frame = tk.Frame(master, bg="#121212")
         self.log_frame.grid(row=1, column=0, sticky="nsew", padx=20, pady=10)
@@ -63,6 +103,8 @@ class SmartAttendanceApp:
         self.button_frame.grid_columnconfigure(0, weight=1)
         self.button_frame.grid_columnconfigure(1, weight=1)
         self.button_frame.grid_columnconfigure(2, weight=1)
+        self.button_frame.grid_columnconfigure(3, weight=1)
+        self.button_frame.grid_columnconfigure(4, weight=1)
 
         self.choose_button = tk.Button(self.button_frame,
                                        text="Choose Image!",
@@ -88,12 +130,218 @@ class SmartAttendanceApp:
                                          width=25)
         self.download_button.grid(row=0, column=2, padx=10, pady=10)
 
+        self.cancel_button = tk.Button(self.button_frame,
+                                       text="Cancel",
+                                       font=("Helvetica", 16, "bold"),
+                                       bg="black", fg="#00FF00",
+                                       command=self.cancel_recognition,
+                                       state=tk.DISABLED,
+                                       width=10)
+        self.cancel_button.grid(row=0, column=3, padx=10, pady=10)
+
+        self.report_button = tk.Button(self.button_frame,
+                                       text="Absence Report",
+                                       font=("Helvetica", 16, "bold"),
+                                       bg="black", fg="#00FF00",
+                                       command=self.absence_report,
+                                       width=15)
+        self.report_button.grid(row=0, column=4, padx=10, pady=10)
+
+        self.import_button = tk.Button(self.button_frame,
+                                       text="Bulk Import",
+                                       font=("Helvetica", 16, "bold"),
+                                       bg="black", fg="#00FF00",
+                                       command=self.bulk_import,
+                                       width=20)
+        self.import_button.grid(row=1, column=1, padx=10, pady=10)
+
+        # The section a photo is taken for: faces are matched against, and
+        # absentees taken from, that section's students only.
+        self.section_var = tk.StringVar(value=ALL_STUDENTS)
+        self.section_menu = tk.OptionMenu(self.button_frame, self.section_var, ALL_STUDENTS)
+        self.section_menu.config(font=("Helvetica", 14, "bold"), bg="black", fg="#00FF00",
+                                 activebackground="black", highlightthickness=0, width=20)
+        self.section_menu.grid(row=1, column=2, padx=10, pady=10)
+
+
+        from attendance_db import AttendanceStore
+        self.attendance = AttendanceStore()
+        self.session_id = None
+
+        # The roster is loaded on a background thread; buttons that need the
+        # gallery stay disabled until it arrives through roster_events.
+        self.student_encodings = None
+        self.reg_no_to_name = {}
+        self.sections = {}
+        self.scopes = {}
+        self.journal = None
+        self.client = None
+        self.watcher = None
+        self.reload_events = None
+        self.rejections = None
+        self.worker = None
+        self.handling_result = False
+        self.roster_events = queue.Queue()
+        self.set_roster_ready(False)
+        self.update_log("[Log] Loading roster...")
+        threading.Thread(target=self.load_roster_in_background, name="roster-loader", daemon=True).start()
+        self.master.after(0, self.log_window_ready)
+        self.master.after(100, self.poll_worker)
+
+
+    def set_roster_ready(self, ready):
+
+        state = tk.NORMAL if ready else tk.DISABLED
+        self.choose_button.config(state=state, text="Choose Image!" if ready else "Loading roster...")
+        self.section_menu.config(state=state)
+        # Enrollment and refreshes change the gallery, which a thin client
+        # does not hold; they are done on the machine running the service.
+        gallery_state = tk.DISABLED if self.client is not None else state
+        for button in (self.add_button, self.import_button, self.refresh_icon, self.rebuild_icon):
+            button.config(state=gallery_state)
+
+
+    def log_window_ready(self):
+
+        self.update_log(f"[Log] Window ready {(time.perf_counter() - LAUNCHED) * 1000:.0f} ms after launch.")
+
+
+    def load_roster_in_background(self):
+
+        # Never touches Tk; the result is picked up by poll_worker.
+        try:
+            self.roster_events.put(('ready', load_roster()))
+        except Exception as e:
+            self.roster_events.put(('error', e))
+
+
+    def poll_roster(self):
+
+        try:
+            kind, payload = self.roster_events.get_nowait()
+        except queue.Empty:
+            return
+        if kind == 'error':
+            self.choose_button.config(text="Roster unavailable")
+            self.update_log(f"[Error] Failed to load the roster: {payload}")
+            return
+        from recognition_worker import RecognitionWorker
+        (gallery, self.reg_no_to_name, self.sections, self.journal, self.rejections, self.watcher,
+         elapsed) = payload
+        if SERVICE.get('url'):
+            self.client = gallery
+            loaded = f"Connected to the recognition service at {self.client.url} for"
+        else:
+            self.student_encodings = gallery
+            loaded = f"Loaded {len(self.student_encodings)} encodings for"
+        self.worker = RecognitionWorker(self.recognize)
+        self.update_section_menu()
+        self.set_roster_ready(True)
+        self.update_log(f"[Log] {loaded} {len(self.reg_no_to_name)} students in {elapsed * 1000:.0f} ms; "
+                        f"roster ready {(time.perf_counter() - LAUNCHED) * 1000:.0f} ms after launch.")
+        if self.watcher is not None:
+            self.master.after(int(self.watcher.interval * 1000), self.watch_roster)
+
+
+    def watch_roster(self):
+
+        # Two stat calls every few seconds; when Student.csv or the store
+        # changed (e.g. edited on a shared drive), only the difference is
+        # loaded on a background thread and swapped in by poll_roster_reload.
+        if self.reload_events is None and self.watcher.poll():
+            events = queue.Queue()
+            watcher = self.watcher
+
+            def load():
+                try:
+                    events.put(('ready', watcher.load_changes()))
+                except Exception as e:
+                    events.put(('error', e))
+
+            self.reload_events = events
+            self.update_log("[Log] Roster changed on disk; loading the changes...")
+            threading.Thread(target=load, name="roster-reload", daemon=True).start()
+            self.master.after(100, self.poll_roster_reload)
+        self.master.after(int(self.watcher.interval * 1000), self.watch_roster)
+
+
+    def poll_roster_reload(self):
+
+        # The gallery is not swapped while a photo's confirmations are being
+        # handled; encodings confirmed there must land in the gallery kept.
+        if self.handling_result or self.reload_events.empty():
+            self.master.after(100, self.poll_roster_reload)
+            return
+        kind, payload = self.reload_events.get_nowait()
+        self.reload_events = None
+        if kind == 'error':
+            self.update_log(f"[Error] Failed to reload the roster: {payload}")
+            return
+        self.apply_roster_update(payload)
+
+
+    def apply_roster_update(self, update):
+
+        # Recognitions already running keep the gallery and roster they
+        # captured; the next photo uses the new ones.
+        from face_recognition_module import open_gallery_journal
+        gallery = self.watcher.apply(update, self.student_encodings, self.journal)
+        if gallery is None:
+            # This app wrote the store meanwhile; the next poll loads again.
+            return
+        if update.gallery is not None:
+            # Another process wrote a new store generation; journal against it.
+            self.journal.close()
+            self.journal = open_gallery_journal()
+        self.student_encodings, self.reg_no_to_name = gallery, update.reg_no_to_name
+        self.sections = update.sections
+        self.update_section_menu()
+        if not update:
+            self.update_log("[Log] Roster unchanged.")
+            return
+        self.update_log(f"[Log] Roster reloaded: {update}; {len(self.reg_no_to_name)} students, "
+                        f"{len(self.student_encodings)} encodings.")
+        for image_path in update.missing:
+            self.update_log(f"[Warning] Image file not found: {image_path}")
+        for image_path, error in update.failures:
+            self.update_log(f"[Warning] Error processing {image_path}: {error}")
+        try:
+            self.attendance.sync_students(self.reg_no_to_name)
+        except Exception as e:
+            self.update_log(f"[Error] Failed to update the attendance database: {e}")
+
+
+    def update_section_menu(self):
+
+        # Offers the roster's sections; a section that left the roster falls
+        # back to everyone.
+        menu = self.section_menu["menu"]
+        menu.delete(0, tk.END)
+        for label in [ALL_STUDENTS] + sorted(self.sections):
+            menu.add_command(label=label, command=tk._setit(self.section_var, label))
+        if self.section_var.get() not in self.sections:
+            self.section_var.set(ALL_STUDENTS)
+
+
+    def selected_section(self):
 
-        self.pr_df = pd.DataFrame(columns=["Reg No", "Name"])
-        self.abs_df = pd.DataFrame(columns=["Reg No", "Name"])
+        section = self.section_var.get()
+        return None if section == ALL_STUDENTS else section
 
-        self.student_encodings, self.reg_no_to_name = load_student_encodings()
-        self.rejections = {}
+
+    def scoped(self, section):
+
+        # (gallery view, Reg No -> Name) of a section, built once per section
+        # and roster and rebuilt after a refresh, import or reload swapped
+        # either. Called from the worker thread as well, so the current
+        # roster is captured first.
+        from sections import scope_roster
+        gallery, reg_no_to_name, sections = self.student_encodings, self.reg_no_to_name, self.sections
+        cached = self.scopes.get(section)
+        if cached is None or cached[0] is not gallery or cached[1] is not reg_no_to_name or cached[2] is not sections:
+            cached = (gallery, reg_no_to_name, sections) + scope_roster(gallery, reg_no_to_name, sections, section)
+            self.scopes[section] = cached
+        return cached[3], cached[4]
 
 
     def update_log(self, text):
@@ -103,27 +351,32 @@ class SmartAttendanceApp:
         print(text)
 
 
-    def get_image_path(self):
+    def get_image_paths(self):
 
+        # Several photos may be selected at once; they are taken as one session.
         if os.name == "nt":
-            return fd.askopenfilename(title="Select an image",
-                                      filetypes=[("JPEG files", "*.jpg *.jpeg"),
-                                                 ("PNG files", "*.png")])
+            return list(fd.askopenfilenames(title="Select images",
+                                            filetypes=[("JPEG files", "*.jpg *.jpeg"),
+                                                       ("PNG files", "*.png"),
+                                                       ("Video files", VIDEO_PATTERNS)]))
         else:
             try:
-                result = subprocess.run(["zenity", "--file-selection", "--file-filter=*.jpg *.jpeg *.png"],
+                result = subprocess.run(["zenity", "--file-selection", "--multiple", "--separator=|",
+                                         f"--file-filter=*.jpg *.jpeg *.png {VIDEO_PATTERNS}"],
                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
                 if result.returncode == 0:
-                    return result.stdout.strip()
+                    return [p for p in result.stdout.strip().split("|") if p]
             except Exception as e:
                 self.update_log(f"[Error] Zenity failed: {e}")
-            return fd.askopenfilename(title="Select an image",
-                                      filetypes=[("JPEG files", "*.jpg *.jpeg"),
-                                                 ("PNG files", "*.png")])
+            return list(fd.askopenfilenames(title="Select images",
+                                            filetypes=[("JPEG files", "*.jpg *.jpeg"),
+                                                       ("PNG files", "*.png"),
+                                                       ("Video files", VIDEO_PATTERNS)]))
 
 
     def ask_user_confirmation(self, cropped_face, prompt):
 
+        from PIL import ImageTk
         dialog = Toplevel(self.master)
         dialog.title("Confirm Identity")
         dialog.configure(bg="#121212")
@@ -172,36 +425,121 @@ class SmartAttendanceApp:
 
     def process_image(self):
 
-        image_path = self.get_image_path()
-        if not image_path:
+        image_paths = self.get_image_paths()
+        if not image_paths:
             self.update_log("[Log] No input file selected.")
             return
 
-        self.update_log(f"Selected file: {image_path}")
+        # Videos are always their own job; two or more photos make a session.
+        # The recognition service takes single photos only, so a thin client
+        # sends each photo as its own job and leaves videos out.
+        videos = [p for p in image_paths if p.lower().endswith(VIDEO['extensions'])]
+        photos = [p for p in image_paths if p not in videos]
+        if self.client is not None:
+            for video in videos:
+                self.update_log(f"[Warning] Skipping {video}: videos are not supported through the "
+                                f"recognition service.")
+            targets = photos
+        else:
+            targets = videos + ([tuple(photos)] if len(photos) > 1 else photos)
+        if not targets:
+            return
+        section = self.selected_section()
+        jobs = []
+        for target in targets:
+            job = self.worker.submit(target, section)
+            label = target if isinstance(target, str) else ", ".join(target)
+            if section is not None:
+                label += f" (section {section})"
+            if self.worker.current is not None or self.worker.pending() > 1:
+                self.update_log(f"Queued file: {label} ({self.worker.pending()} waiting)")
+            else:
+                self.update_log(f"Selected file: {label}")
+            jobs.append(job)
+        self.cancel_button.config(state=tk.NORMAL)
+        return jobs
+
+
+    def recognize(self, image_path, scope=None, progress=None, cancel_event=None):
+
+        # Runs on the worker thread; everything it needs is captured up front
+        # so a concurrent refresh cannot swap the gallery mid-photo.
+        if self.client is not None:
+            return self.client.recognize(image_path, section=scope, progress=progress, cancel_event=cancel_event,
+                                         return_metrics=True)
+        from face_recognition_module import recognize_faces_in_image
+        from session import recognize_session
+        from video_attendance import is_video, recognize_faces_in_video
+        student_encodings, reg_no_to_name = self.scoped(scope)
+        if not isinstance(image_path, str):
+            recognize = recognize_session
+        else:
+            recognize = recognize_faces_in_video if is_video(image_path) else recognize_faces_in_image
+        return recognize(image_path, student_encodings, reg_no_to_name,
+                         progress=progress, cancel_event=cancel_event, return_metrics=True)
+
 
-        recognized_reg_nos, logs, close_match_candidates, unknown_image = recognize_faces_in_image(
-            image_path, self.student_encodings, self.reg_no_to_name)
+    def cancel_recognition(self):
+
+        job = self.worker.cancel_current() if self.worker is not None else None
+        if job is not None:
+            self.update_log(f"[Log] Cancelling {job.name}...")
+        else:
+            self.update_log("[Log] No recognition in progress.")
+
+
+    def poll_worker(self):
+
+        # Until the roster has loaded there is no worker to poll. Confirmation
+        # dialogs run a nested event loop; leave further events queued until
+        # the current photo has been handled.
+        if self.worker is None:
+            self.poll_roster()
+        elif not self.handling_result:
+            while True:
+                try:
+                    kind, job, payload = self.worker.events.get_nowait()
+                except queue.Empty:
+                    break
+                name = job.name
+                if kind == 'progress':
+                    self.update_log(f"[{name}] {payload}...")
+                elif kind == 'cancelled':
+                    self.update_log(f"[Log] Recognition of {name} cancelled.")
+                elif kind == 'error':
+                    self.update_log(f"[Error] Failed to process {name}: {payload}")
+                elif kind == 'done':
+                    self.handling_result = True
+                    try:
+                        self.handle_recognition_result(job.image_path, payload, job.scope)
+                    finally:
+                        self.handling_result = False
+                    break
+            if self.worker.current is None and not self.worker.pending() and self.worker.events.empty():
+                self.cancel_button.config(state=tk.DISABLED)
+        self.master.after(100, self.poll_worker)
+
+
+    def handle_recognition_result(self, image_path, result, scope=None):
+
+        self.update_log(f"Results for: {image_path if isinstance(image_path, str) else ', '.join(image_path)}")
+        recognized_reg_nos, logs, close_match_candidates, unknown_image, metrics = result
 
         for log in logs:
             self.update_log(log)
+        self.update_log(f"[Log] Timing: {metrics.summary()}")
 
+        from PIL import Image
         pil_unknown_image = Image.fromarray(unknown_image) if unknown_image is not None else None
-        rejection_similarity_threshold = 0.05
+        rejected_flags = self.rejections.rejected(close_match_candidates)
+        confirmed_reg_nos = set()
 
-        for candidate in close_match_candidates:
+        for candidate, rejected in zip(close_match_candidates, rejected_flags):
             unknown_encoding, candidate_reg_no, best_distance, face_location = candidate
             student_name = self.reg_no_to_name.get(candidate_reg_no, "Unknown")
-            rejected = False
-
-            if candidate_reg_no in self.rejections:
-                for rejected_enc in self.rejections[candidate_reg_no]:
-                    dist = fr.face_distance([rejected_enc], unknown_encoding)[0]
-                    if dist < rejection_similarity_threshold:
-                        self.update_log(f"[Log] Candidate for {student_name} previously rejected; skipping confirmation.")
-                        rejected = True
-                        break
 
             if rejected:
+                self.update_log(f"[Log] Candidate for {student_name} previously rejected; skipping confirmation.")
                 continue
 
             if face_location and pil_unknown_image:
@@ -212,81 +550,256 @@ class SmartAttendanceApp:
                 answer = self.ask_user_confirmation(cropped_face, prompt)
 
                 if answer:
-                    self.student_encodings[candidate_reg_no].append(unknown_encoding)
                     recognized_reg_nos.add(candidate_reg_no)
-                    self.update_log(f"[Log] {student_name} confirmed and encoding updated.")
+                    confirmed_reg_nos.add(candidate_reg_no)
+                    if self.add_confirmed_encoding(candidate_reg_no, unknown_encoding):
+                        self.update_log(f"[Log] {student_name} confirmed and encoding updated.")
                 else:
-                    if candidate_reg_no not in self.rejections:
-                        self.rejections[candidate_reg_no] = []
-                    self.rejections[candidate_reg_no].append(unknown_encoding)
+                    self.rejections.add(candidate_reg_no, unknown_encoding)
                     self.update_log(f"[Log] {student_name} not confirmed; candidate rejected.")
             else:
                 self.update_log(f"[Log] Unable to retrieve face location for {student_name} candidate.")
 
         if not recognized_reg_nos:
             self.update_log("[Log] No recognized faces. Marking all as absent.")
-            self.create_absentees_from_all()
-            return
-
-        with open("student_encodings.pkl", "wb") as f:
-            pickle.dump(self.student_encodings, f)
-
-        presentees = []
-        for reg_no in recognized_reg_nos:
-            name = self.reg_no_to_name.get(reg_no, "Unknown")
-            presentees.append([reg_no, name])
-
-        absentees = []
-        for reg_no, name in self.reg_no_to_name.items():
-            if reg_no not in recognized_reg_nos:
-                absentees.append([reg_no, name])
-
-        self.pr_df = pd.DataFrame(presentees, columns=["Reg No", "Name"])
-        self.abs_df = pd.DataFrame(absentees, columns=["Reg No", "Name"])
 
-        self.update_log("[Log] Attendance updated successfully.")
-        self.update_log(f"Total Present: {len(presentees)} | Total Absent: {len(absentees)}")
-
-
-    def create_absentees_from_all(self):
-
-        absentees = []
-        for reg_no, name in self.reg_no_to_name.items():
-            absentees.append([reg_no, name])
-        self.abs_df = pd.DataFrame(absentees, columns=["Reg No", "Name"])
-        self.update_log("[Log] All students marked as absent.")
+        if self.client is None:
+            self.compress_encodings(confirmed_reg_nos)
+            self.commit_gallery_changes()
+        try:
+            self.rejections.save()
+        except Exception as e:
+            self.update_log(f"[Error] Failed to save rejections: {e}")
+        self.record_attendance(image_path, recognized_reg_nos, scope)
+
+
+    def add_confirmed_encoding(self, reg_no, encoding):
+
+        # A thin client hands the encoding to the service, which journals and
+        # compresses it in the shared gallery.
+        if self.client is None:
+            self.student_encodings.add(reg_no, encoding)
+            self.journal.add_encoding(reg_no, encoding)
+            return True
+        from recognition_client import ServiceError
+        try:
+            self.client.confirm(reg_no, encoding)
+        except ServiceError as e:
+            self.update_log(f"[Error] Failed to send the confirmed encoding for {reg_no}: {e}")
+            return False
+        return True
+
+
+    def compress_encodings(self, reg_nos):
+
+        # Keeps each student at no more than max_encodings_per_student
+        # prototypes as confirmed encodings accumulate.
+        from prototypes import compress_student
+        for reg_no in reg_nos:
+            try:
+                dropped = compress_student(self.student_encodings, reg_no, journal=self.journal)
+            except Exception as e:
+                self.update_log(f"[Error] Failed to compress encodings for {reg_no}: {e}")
+                continue
+            if dropped:
+                self.update_log(f"[Log] Compressed encodings for {self.reg_no_to_name.get(reg_no, reg_no)}: "
+                                f"{dropped} redundant ones dropped.")
+
+
+    def commit_gallery_changes(self):
+
+        # One fsync for everything journalled while handling a photo; the
+        # journal is folded into a new store once it has grown enough.
+        try:
+            self.journal.sync()
+            if self.journal.needs_compaction():
+                compacted = self.journal.compact(self.student_encodings, ENCODING_STORE['path'])
+                # When the recognition service compacted first, the watcher
+                # loads its store, which holds this app's records too.
+                if compacted and self.watcher is not None:
+                    self.watcher.acknowledge_store()
+                self.update_log("[Log] Encoding journal compacted into the store.")
+        except Exception as e:
+            self.update_log(f"[Error] Failed to save encodings: {e}")
+
+
+    def record_attendance(self, image_path, recognized_reg_nos, scope=None):
+
+        # A multi-photo session is one attendance session in the database;
+        # with a section selected only its students are marked absent.
+        from recognition_worker import session_name
+        source = image_path if isinstance(image_path, str) else ";".join(image_path)
+        name = session_name(image_path)
+        try:
+            _, reg_no_to_name = self.scoped(scope)
+            if scope is not None:
+                name = f"{scope}: {name}"
+            self.session_id = self.attendance.record_session(recognized_reg_nos, reg_no_to_name,
+                                                             name=name, source=source)
+        except Exception as e:
+            self.update_log(f"[Error] Failed to record attendance: {e}")
+            return
+        present, absent = self.attendance.session_counts(self.session_id)
+        scoped = f" for section {scope}" if scope is not None else ""
+        self.update_log(f"[Log] Attendance recorded as session {self.session_id}{scoped}.")
+        self.update_log(f"Total Present: {present} | Total Absent: {absent}")
 
 
     def download_file(self):
 
-        if self.pr_df.empty and self.abs_df.empty:
+        if self.session_id is None:
             self.update_log("[Error] No data to save. Process an image first.")
             return
 
         presentees_file = fd.asksaveasfilename(defaultextension=".csv",
                                                filetypes=[("CSV files", "*.csv")])
         if presentees_file:
-            self.pr_df.to_csv(presentees_file, sep=",", index=False, encoding="utf-8")
+            self.attendance.export_session(self.session_id, presentees_file=presentees_file)
             self.update_log(f"[Log] Presentees saved to: {presentees_file}")
 
         absentees_file = fd.asksaveasfilename(defaultextension=".csv",
                                               filetypes=[("CSV files", "*.csv")])
         if absentees_file:
-            self.abs_df.to_csv(absentees_file, sep=",", index=False, encoding="utf-8")
+            self.attendance.export_session(self.session_id, absentees_file=absentees_file)
             self.update_log(f"[Log] Absentees saved to: {absentees_file}")
 
 
-    def refresh_encodings(self):
+    def absence_report(self):
+
+        limit = simpledialog.askinteger("Absence Report", "List students absent more than how many times?",
+                                        parent=self.master, minvalue=0, initialvalue=3)
+        if limit is None:
+            return
+        term_start = DATABASE.get('term_start')
+        rows = self.attendance.absence_counts(limit + 1, start=term_start)
+        since = f" since {term_start}" if term_start else ""
+        self.update_log(f"[Log] {len(rows)} students absent more than {limit} times{since}:")
+        for reg_no, name, absences, sessions in rows:
+            self.update_log(f"{reg_no} {name}: absent {absences} of {sessions}")
+
+
+    def refresh_encodings(self, full_rebuild=False):
+
+        from face_recognition_module import refresh_student_encodings, open_gallery_journal
+
+        def progress(done, total, image_path):
+            self.update_log(f"[Log] Encoded {done}/{total}: {os.path.basename(image_path)}")
+            self.master.update_idletasks()
+
+        self.student_encodings, self.reg_no_to_name, report = refresh_student_encodings(full_rebuild=full_rebuild,
+                                                                                        progress=progress)
+        self.reload_sections()
+        # The refresh wrote a new store generation; start a journal for it.
+        self.journal.close()
+        self.journal = open_gallery_journal()
+        if self.watcher is not None:
+            self.watcher.acknowledge_store()
+        action = "rebuilt" if full_rebuild else "refreshed"
+        self.update_log(f"[Log] Student encodings {action} from CSV: {report}.")
+        for image_path in report.missing:
+            self.update_log(f"[Warning] Image file not found: {image_path}")
+        for image_path, error in report.failures:
+            self.update_log(f"[Warning] Error processing {image_path}: {error}")
+
+
+    def reload_sections(self):
+
+        from sections import read_sections
+        try:
+            self.sections = read_sections()
+        except Exception as e:
+            self.update_log(f"[Error] Failed to read the sections: {e}")
+        self.update_section_menu()
+
+
+    def bulk_import(self):
+
+        # Validation, encoding and the duplicate check run on a background
+        # thread; the roster and gallery are written on the Tk thread once
+        # the operator has seen the report.
+        csv_path = fd.askopenfilename(title="Select the students CSV", filetypes=[("CSV files", "*.csv")])
+        if not csv_path:
+            return
+        images_dir = fd.askdirectory(title="Select the image folder (Cancel: use the paths in the CSV)") or None
+        self.import_button.config(state=tk.DISABLED)
+        self.update_log(f"[Log] Preparing bulk import from {csv_path}...")
+        events = queue.Queue()
+        gallery = self.student_encodings
+
+        def prepare():
+            from bulk_import import prepare_import
+            try:
+                plan = prepare_import(csv_path, images_dir, gallery=gallery,
+                                      progress=lambda done, total, path: events.put(('progress', (done, total))))
+                events.put(('ready', plan))
+            except Exception as e:
+                events.put(('error', e))
+
+        threading.Thread(target=prepare, name="bulk-import", daemon=True).start()
+        self.master.after(100, self.poll_import, events)
+
+
+    def poll_import(self, events):
+
+        while True:
+            try:
+                kind, payload = events.get_nowait()
+            except queue.Empty:
+                self.master.after(100, self.poll_import, events)
+                return
+            if kind == 'progress':
+                done, total = payload
+                if done == total or done % 50 == 0:
+                    self.update_log(f"[Log] Encoded {done}/{total} import images.")
+                continue
+            self.import_button.config(state=tk.NORMAL)
+            if kind == 'error':
+                self.update_log(f"[Error] Bulk import failed: {payload}")
+            else:
+                self.finish_import(payload)
+            return
+
+
+    def finish_import(self, plan):
 
-        self.student_encodings, self.reg_no_to_name = load_student_encodings(force_refresh=True)
-        self.update_log("[Log] Student encodings refreshed from CSV.")
+        from bulk_import import commit_import, plan_report
+        from face_recognition_module import open_gallery_journal
+        for line in plan_report(plan):
+            self.update_log(line)
+        if not plan.rows:
+            self.update_log("[Log] Nothing to import.")
+            return
+        question = f"{plan}.\n\nImport the {len(plan.rows)} valid rows?"
+        if plan.duplicates:
+            question += "\n\nSome students look like the same face; see the log before continuing."
+        if not messagebox.askyesno("Bulk Import", question):
+            self.update_log("[Log] Bulk import cancelled.")
+            return
+        try:
+            self.journal.sync()
+            self.student_encodings, self.reg_no_to_name = commit_import(plan, self.student_encodings)
+        except Exception as e:
+            self.update_log(f"[Error] Failed to write the import: {e}")
+            return
+        self.reload_sections()
+        # The import wrote a new store generation; start a journal for it.
+        self.journal.close()
+        self.journal = open_gallery_journal()
+        if self.watcher is not None:
+            self.watcher.acknowledge_store()
+        try:
+            self.attendance.sync_students(self.reg_no_to_name)
+        except Exception as e:
+            self.update_log(f"[Error] Failed to update the attendance database: {e}")
+        self.update_log(f"[Log] Imported {len(plan.rows)} students; {len(self.reg_no_to_name)} students on the "
+                        f"roster, {len(self.student_encodings)} encodings.")
 
 
     def add_student(self):
 
         add_window = Toplevel(self.master)
         add_window.title("Add New Student")
-        add_window.geometry("400x300")
+        add_window.geometry("400x360")
         add_window.configure(bg="#121212")
 
         Label(add_window, text="Reg No:", font=("Comic Sans", 12),
@@ -299,6 +812,11 @@ class SmartAttendanceApp:
         name_entry = tk.Entry(add_window, font=("Comic Sans", 12))
         name_entry.pack(pady=5)
 
+        Label(add_window, text=f"Sections (separated by {SECTIONS['separator']}):", font=("Comic Sans", 12),
+              bg="#121212", fg="white").pack(pady=5)
+        sections_entry = tk.Entry(add_window, font=("Comic Sans", 12))
+        sections_entry.pack(pady=5)
+
         image_path_var = tk.StringVar()
 
         def browse_image():
@@ -331,12 +849,17 @@ class SmartAttendanceApp:
                fg="#00FF00", bg="black", command=browse_image).pack(pady=10)
 
         def submit_student():
+            from sections import merge_sections, split_sections
             reg_no = reg_no_entry.get().strip()
             name = name_entry.get().strip()
+            sections = split_sections(sections_entry.get())
             image_path = image_path_var.get().strip()
             if not reg_no or not name or not image_path:
                 messagebox.showerror("Error", "All fields are required!")
                 return
+            import face_recognition as fr
+            import pandas as pd
+            from face_recognition_module import preprocess_image
             try:
                 image = fr.load_image_file(image_path)
                 image = preprocess_image(image)
@@ -349,12 +872,17 @@ class SmartAttendanceApp:
                 messagebox.showerror("Error", f"Failed to process image: {e}")
                 return
             csv_file = "Student.csv"
+            # Only this write is acknowledged to the watcher; edits made
+            # elsewhere before it are still picked up by the next poll.
+            roster_current = self.watcher is not None and not self.watcher.poll()
             if os.path.exists(csv_file):
                 df = pd.read_csv(csv_file, dtype=str)
                 df["Reg No"] = df["Reg No"].str.strip()
                 df["File Paths"] = df["File Paths"].fillna("")
             else:
                 df = pd.DataFrame(columns=["Reg No", "Name", "File Paths"])
+            if sections and SECTIONS['column'] not in df.columns:
+                df[SECTIONS['column']] = ""
             existing_reg_nos = [x.strip() for x in df["Reg No"].tolist()]
             if reg_no in existing_reg_nos:
                 idx = existing_reg_nos.index(reg_no)
@@ -363,9 +891,13 @@ class SmartAttendanceApp:
                 if image_path not in paths:
                     paths.append(image_path)
                 df.at[idx, "File Paths"] = ",".join(paths)
+                if sections:
+                    df.at[idx, SECTIONS['column']] = merge_sections(df.at[idx, SECTIONS['column']], sections)
                 self.update_log(f"[Log] Updated existing student record for reg no {reg_no}.")
             else:
                 new_row = {"Reg No": reg_no, "Name": name, "File Paths": image_path}
+                if sections:
+                    new_row[SECTIONS['column']] = merge_sections("", sections)
                 df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
                 self.update_log(f"[Log] Added new student record for reg no {reg_no}.")
             try:
@@ -377,16 +909,20 @@ class SmartAttendanceApp:
             df_reload = pd.read_csv(csv_file, dtype=str)
             df_reload["Reg No"] = df_reload["Reg No"].str.strip()
             self.reg_no_to_name = dict(zip(df_reload["Reg No"], df_reload["Name"]))
-            if reg_no in self.student_encodings:
-                self.student_encodings[reg_no].append(encoding)
-            else:
-                self.student_encodings[reg_no] = [encoding]
+            self.reload_sections()
             try:
-                with open("student_encodings.pkl", "wb") as f:
-                    pickle.dump(self.student_encodings, f)
+                if reg_no in self.student_encodings:
+                    self.journal.add_encoding(reg_no, encoding)
+                else:
+                    self.journal.add_student(reg_no, [encoding])
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to update encodings file: {e}")
                 return
+            self.student_encodings.add(reg_no, encoding)
+            self.compress_encodings([reg_no])
+            self.commit_gallery_changes()
+            if roster_current:
+                self.watcher.acknowledge_roster()
             messagebox.showinfo("Success", "New student added/updated successfully!")
             add_window.destroy()
 
@@ -398,6 +934,8 @@ def main():
     root = tk.Tk()
     app = SmartAttendanceApp(root)
     root.mainloop()
+    if app.journal is not None:
+        app.journal.close()
 
 
 if __name__ == "__main__":
@@ -2,15 +2,116 @@ IMAGE_ENHANCEMENT = {
     'brightness': 1.2,
     'contrast': 1.2,
     'sharpness': 1.1,
+    'mode': 'frame',
 }
 
 FACE_RECOGNITION = {
     'model': 'cnn',
     'threshold': 0.5,
     'resize_scale': 0.25,
-    'confirmation_margin': 0.1
+    'min_detection_side': 1600,
+    'min_face_px': 80,
+    'min_detected_faces': 1,
+    'confirmation_margin': 0.1,
+    'index': 'auto',
+    'ann_min_rows': 20000,
+    'ann_nprobe': 8,
+    'ann_nlist': None,
+    'max_encodings_per_student': 10
+}
+
+ENCODING_STORE = {
+    'path': 'student_encodings.bin',
+    'legacy_pickle': 'student_encodings.pkl',
+    'image_cache': 'image_encodings_cache.pkl',
+    'journal': 'student_encodings.journal',
+    'journal_sync_records': 32,
+    'journal_sync_seconds': 5.0,
+    'journal_compact_records': 500,
+    'journal_compact_bytes': 4 * 1024 * 1024
 }
 
 DATABASE = {
-    'db_file': 'attendance.db'
+    'db_file': 'attendance.db',
+    'term_start': None
+}
+
+TILED_DETECTION = {
+    'min_megapixels': 16,
+    'tile_size': 1024,
+    'overlap': 160,
+    'upsample': 1,
+    'back_rows_fraction': 0.34,
+    'small_face_px': 100,
+    'nms_overlap': 0.5,
+    'workers': None
+}
+
+VIDEO = {
+    'resize_scale': 0.5,
+    'min_detection_side': 960,
+    'min_face_px': 60,
+    'detect_every': 15,
+    'track_every': 3,
+    'track_scale': 0.5,
+    'min_track_score': 0.6,
+    'min_iou': 0.3,
+    'max_missed_detections': 2,
+    'max_encodings_per_track': 3,
+    'extensions': ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.webm')
+}
+
+SESSION = {
+    'duplicate_distance': 0.45,
+    'workers': None
+}
+
+BULK_IMPORT = {
+    'duplicate_distance': 0.4,
+    'block_rows': 4096
+}
+
+ROSTER_WATCH = {
+    'enabled': True,
+    'interval_seconds': 5
+}
+
+SECTIONS = {
+    'column': 'Sections',
+    'separator': ';'
+}
+
+SERVICE = {
+    'url': None,
+    'host': '127.0.0.1',
+    'port': 8765,
+    'token': None,
+    'workers': 2,
+    'max_queue': 8,
+    'max_upload_bytes': 64 * 1024 * 1024,
+    'timeout': 300,
+    'retry_after': 2,
+    'client_retries': 30,
+    'log_requests': False
+}
+
+PROBE_CACHE = {
+    'enabled': True,
+    'directory': 'probe_cache',
+    'max_bytes': 64 * 1024 * 1024
+}
+
+REJECTIONS = {
+    'path': 'student_rejections.npz',
+    'similarity_threshold': 0.05,
+    'max_per_student': 20,
+    'max_total': 5000,
+    'max_age_days': 120
+}
+
+INSTRUMENTATION = {
+    'metrics_file': None,
+    'profile_dir': None,
+    'profile_slower_than': 10.0,
+    'max_profiles': 1
 }
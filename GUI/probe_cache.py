@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from my_config import IMAGE_ENHANCEMENT, FACE_RECOGNITION, PROBE_CACHE, TILED_DETECTION
+from encoding_store import store_parameters
+from encoding_cache import file_digest
+from gallery import ENCODING_DIM
+
+
+def pipeline_digest(expected_faces=None):
+    # Everything that changes which faces are found or how they are encoded.
+    # Matching settings (threshold, confirmation margin, index) are left out
+    # so a cached photo can be re-matched after they change.
+    params = dict(store_parameters(),
+                  enhancement_mode=IMAGE_ENHANCEMENT.get('mode', 'frame'),
+                  resize_scale=FACE_RECOGNITION.get('resize_scale', 1.0),
+                  min_detection_side=FACE_RECOGNITION.get('min_detection_side', 0),
+                  min_face_px=FACE_RECOGNITION.get('min_face_px', 0),
+                  min_detected_faces=FACE_RECOGNITION.get('min_detected_faces', 1),
+                  expected_faces=expected_faces,
+                  tiled_detection={key: value for key, value in TILED_DETECTION.items() if key != 'workers'})
+    encoded = json.dumps(params, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+class ProbeCache:
+
+    # Face locations and encodings of processed photos, one .npz file per
+    # photo in `directory`. Least recently used files are evicted once the
+    # directory holds more than max_bytes; a hit touches the file's mtime so
+    # the order survives restarts.
+    def __init__(self, directory, max_bytes):
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".npz"):
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+
+
+    def _path(self, key):
+
+        return os.path.join(self.directory, key + ".npz")
+
+
+    def key_for(self, image_path, expected_faces=None):
+
+        return f"{pipeline_digest(expected_faces)}-{file_digest(image_path)}"
+
+
+    def get(self, key):
+
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with np.load(self._path(key)) as data:
+                    locations = [tuple(int(v) for v in box) for box in data['locations']]
+                    encodings = list(data['encodings'].astype(np.float64))
+                os.utime(self._path(key))
+            except Exception as e:
+                print(f"[Warning] Dropping unreadable probe cache entry {key}: {e}")
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return locations, encodings
+
+
+    def put(self, key, face_locations, encodings):
+
+        locations = np.asarray(face_locations, dtype=np.int32).reshape(-1, 4)
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        with self._lock:
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, locations=locations, encodings=encodings)
+            os.replace(tmp_path, self._path(key))
+            self._entries[key] = os.path.getsize(self._path(key))
+            self._entries.move_to_end(key)
+            self._evict()
+
+
+    def _remove(self, key):
+
+        self._entries.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+    def _evict(self):
+
+        total = sum(self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            key, size = next(iter(self._entries.items()))
+            self._remove(key)
+            total -= size
+            self.evictions += 1
+
+
+    def clear(self):
+
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+
+    def stats(self):
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': sum(self._entries.values())}
+
+
+    def __str__(self):
+
+        stats = self.stats()
+        return (f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, "
+                f"{stats['entries']} photos ({stats['bytes'] / 1024:.0f} KiB)")
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def default_probe_cache():
+    global _default_cache
+    if not PROBE_CACHE.get('enabled', True):
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ProbeCache(PROBE_CACHE['directory'], PROBE_CACHE['max_bytes'])
+        return _default_cache
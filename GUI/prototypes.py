@@ -0,0 +1,91 @@
+import numpy as np
+from my_config import FACE_RECOGNITION
+from gallery import Gallery
+
+
+def max_prototypes_per_student():
+    return FACE_RECOGNITION.get('max_encodings_per_student') or 0
+
+
+def pairwise_distances(rows):
+    rows = np.asarray(rows, dtype=np.float32)
+    sq_norms = np.einsum('ij,ij->i', rows, rows)
+    d2 = sq_norms[:, None] - 2.0 * rows @ rows.T + sq_norms[None, :]
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2)
+
+
+def select_prototypes(rows, k, iterations=10):
+    # Sorted indices of at most k medoids of rows (k-medoids: a greedy PAM
+    # build, then alternating assignment and per-cluster medoid updates).
+    # Medoids are real encodings, so dropping the others is a plain row
+    # removal that the gallery journal already knows how to replay.
+    n = len(rows)
+    if n <= k:
+        return np.arange(n)
+    distances = pairwise_distances(rows)
+    chosen = [int(distances.sum(axis=1).argmin())]
+    nearest = distances[chosen[0]].copy()
+    for _ in range(1, k):
+        gain = np.maximum(nearest[None, :] - distances, 0.0).sum(axis=1)
+        gain[chosen] = -1.0
+        best = int(gain.argmax())
+        chosen.append(best)
+        np.minimum(nearest, distances[best], out=nearest)
+
+    for _ in range(iterations):
+        assignment = distances[:, chosen].argmin(axis=1)
+        updated = []
+        for cluster in range(k):
+            members = np.flatnonzero(assignment == cluster)
+            if not len(members):
+                # Only happens with duplicate rows; keep the medoid as is.
+                updated.append(chosen[cluster])
+                continue
+            within = distances[np.ix_(members, members)].sum(axis=1)
+            updated.append(int(members[within.argmin()]))
+        if updated == chosen:
+            break
+        chosen = updated
+    return np.sort(np.unique(chosen))
+
+
+def compress_student(gallery, reg_no, max_prototypes=None, journal=None):
+    # Called after encodings are added for reg_no: reduces it to at most
+    # max_prototypes medoids and journals the dropped rows as removals.
+    # Returns the number of rows dropped.
+    max_prototypes = max_prototypes if max_prototypes is not None else max_prototypes_per_student()
+    if not max_prototypes:
+        return 0
+    rows = gallery.encodings_for(reg_no)
+    if len(rows) <= max_prototypes:
+        return 0
+    keep = np.zeros(len(rows), dtype=bool)
+    keep[select_prototypes(rows, max_prototypes)] = True
+    dropped = rows[~keep]
+    gallery.retain(reg_no, keep)
+    if journal is not None:
+        journal.remove_encodings(reg_no, dropped)
+    return len(dropped)
+
+
+def compress_gallery(gallery, max_prototypes=None):
+    # Compresses every student above the cap in one pass and returns
+    # (gallery, rows dropped); the gallery is a new one when rows were
+    # dropped, so it is built with a single copy of the kept rows.
+    max_prototypes = max_prototypes if max_prototypes is not None else max_prototypes_per_student()
+    if not max_prototypes or not len(gallery):
+        return gallery, 0
+    matrix, sq_norms, row_student, reg_nos = gallery.arrays()
+    counts = np.bincount(row_student, minlength=len(reg_nos))
+    if counts.max() <= max_prototypes:
+        return gallery, 0
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    keep = np.ones(len(matrix), dtype=bool)
+    for student in np.flatnonzero(counts > max_prototypes):
+        start, stop = offsets[student], offsets[student + 1]
+        keep[start:stop] = False
+        keep[start + select_prototypes(matrix[start:stop], max_prototypes)] = True
+    compressed = Gallery.from_arrays(np.ascontiguousarray(matrix[keep]), sq_norms[keep], row_student[keep],
+                                     list(reg_nos))
+    return compressed, int(len(keep) - keep.sum())
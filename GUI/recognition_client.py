@@ -0,0 +1,154 @@
+import json
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy as np
+from PIL import Image
+from my_config import SERVICE
+from instrumentation import StageMetrics, record_metrics
+from recognition_worker import RecognitionCancelled
+
+# Deliberately free of face_recognition and the gallery stack: a thin client
+# only needs to upload photos and crop the faces the service points at.
+
+
+class ServiceError(Exception):
+
+    def __init__(self, message, status=None, retry_after=None):
+
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RecognitionClient:
+
+    # Talks to recognition_service. recognize() returns the same tuple as
+    # recognize_faces_in_image, so the GUI handles both the same way. Uploads
+    # turned away with 503 are retried after the service's Retry-After.
+    def __init__(self, url=None, timeout=None, retries=None):
+
+        self.url = (url or SERVICE['url']).rstrip("/")
+        self.timeout = timeout or SERVICE['timeout']
+        self.retries = retries if retries is not None else SERVICE['client_retries']
+        self.busy_replies = 0
+
+
+    def _request(self, path, data=None, content_type="application/octet-stream", timeout=None):
+
+        headers = {"Content-Type": content_type} if data is not None else {}
+        if SERVICE.get('token'):
+            headers["Authorization"] = f"Bearer {SERVICE['token']}"
+        request = urllib.request.Request(self.url + path, data=data, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error', e.reason)
+            except ValueError:
+                message = e.reason
+            raise ServiceError(f"{e.code} {message}", e.code, e.headers.get("Retry-After")) from e
+        except urllib.error.URLError as e:
+            raise ServiceError(f"service at {self.url} unreachable: {e.reason}") from e
+
+
+    def health(self):
+
+        return self._request("/health", timeout=5)
+
+
+    def roster(self):
+
+        body = self._request("/roster")
+        return body['students'], body['encodings'], body.get('sections', {})
+
+
+    def confirm(self, reg_no, encoding):
+
+        data = json.dumps({'reg_no': reg_no, 'encoding': [float(v) for v in encoding]}).encode("utf-8")
+        return self._request("/confirm", data, "application/json")
+
+
+    def recognize_upload(self, data, name=None, expected_faces=None, cancel_event=None, section=None):
+
+        # The service's JSON reply for one photo, after any 503 retries.
+        query = {'name': name} if name else {}
+        if expected_faces is not None:
+            query['expected_faces'] = expected_faces
+        if section:
+            query['section'] = section
+        path = "/recognize" + ("?" + urllib.parse.urlencode(query) if query else "")
+        for attempt in range(self.retries + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise RecognitionCancelled("uploading")
+            try:
+                return self._request(path, data)
+            except ServiceError as e:
+                if e.status == 503:
+                    self.busy_replies += 1
+                if e.status != 503 or attempt == self.retries:
+                    raise
+                delay = float(e.retry_after or SERVICE['retry_after'])
+            # Wait out Retry-After in small steps so a cancel is noticed.
+            deadline = time.monotonic() + delay
+            while time.monotonic() < deadline:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RecognitionCancelled("waiting for the service")
+                time.sleep(max(0.0, min(0.1, deadline - time.monotonic())))
+
+
+    def recognize(self, image_path, student_encodings=None, reg_no_to_name=None, expected_faces=None,
+                  progress=None, cancel_event=None, return_metrics=False, section=None):
+
+        # student_encodings and reg_no_to_name are accepted for the same call
+        # signature as recognize_faces_in_image; the service's gallery is used,
+        # limited to section's students when one is given.
+        metrics = StageMetrics('recognize', image_path)
+        progress = metrics.wrap(progress)
+        result = self._recognize(image_path, expected_faces, progress, cancel_event, metrics, section)
+        record_metrics(metrics.finish())
+        return result + (metrics,) if return_metrics else result
+
+
+    def _recognize(self, image_path, expected_faces, progress, cancel_event, metrics, section):
+
+        logs = []
+        if not os.path.exists(image_path):
+            logs.append(f"[Error] Image file not found: {image_path}")
+            return set(), logs, [], None
+        with open(image_path, "rb") as f:
+            data = f.read()
+
+        progress("uploading")
+        started = time.perf_counter()
+        try:
+            reply = self.recognize_upload(data, os.path.basename(image_path), expected_faces, cancel_event, section)
+        except ServiceError as e:
+            logs.append(f"[Error] Recognition service: {e}")
+            return set(), logs, [], None
+        if cancel_event is not None and cancel_event.is_set():
+            raise RecognitionCancelled("uploading")
+
+        # The service's own stages replace the round trip; what is left over
+        # is transfer, HTTP and retry time.
+        server = reply['timing']
+        metrics.enter("loading")
+        metrics.stages.update(server['stages_s'])
+        metrics.stages['uploading'] = max(0.0, time.perf_counter() - started - sum(server['stages_s'].values()))
+        metrics.counts.update(server['counts'])
+        metrics.counts['remote'] = True
+
+        logs.extend(reply['logs'])
+        recognized_reg_nos = {student['reg_no'] for student in reply['recognized']}
+        close_match_candidates = [(np.asarray(c['encoding'], dtype=np.float32), c['reg_no'], c['distance'],
+                                   tuple(c['location'])) for c in reply['close_matches']]
+        unknown_image = None
+        if close_match_candidates:
+            # Decoded the way face_recognition does, so the service's face
+            # locations line up with this copy.
+            with Image.open(image_path) as image:
+                unknown_image = np.array(image.convert("RGB"))
+        return recognized_reg_nos, logs, close_match_candidates, unknown_image
@@ -0,0 +1,399 @@
+import argparse
+import hmac
+import io
+import ipaddress
+import json
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+from my_config import ENCODING_STORE, ROSTER_WATCH, SERVICE
+from gallery import ENCODING_DIM
+from face_recognition_module import (detect_and_encode, load_student_encodings, match_faces,
+                                     open_gallery_journal)
+from prototypes import compress_student
+from roster_watcher import RosterWatcher
+from sections import read_sections, scope_roster
+from shared_gallery import SharedGallery, attach_shared_gallery, shared_gallery
+from instrumentation import StageMetrics, record_metrics
+
+
+def _init_worker(gallery_name):
+    # Pool initializer: attach the published gallery, then one detection and
+    # one encoding on a blank image load the dlib models before the first
+    # upload arrives.
+    import face_recognition as fr
+    from my_config import FACE_RECOGNITION
+    attach_shared_gallery(gallery_name)
+    shared_gallery()
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    fr.face_locations(blank)
+    fr.face_encodings(blank, known_face_locations=[(8, 56, 56, 8)], model=FACE_RECOGNITION['model'])
+
+
+_views = {}
+
+
+def _section_view(gallery, generation, section, members):
+    # A worker keeps one view per section until a new generation is
+    # published; roster reloads always publish one.
+    cached = _views.get(section)
+    if cached is None or cached[0] != generation or cached[1] != members:
+        cached = (generation, members, gallery.view(members))
+        _views[section] = cached
+    return cached[2]
+
+
+def _recognize_upload(data, expected_faces=None, section=None, members=None):
+    # Runs in a pool worker, matching against the newest published gallery,
+    # or only the members' rows of it when a section is given. Returns a
+    # dict with the face locations, recognized Reg Nos, close match
+    # candidates, logs, stage seconds, megapixels, gallery generation and
+    # error; only these small results travel back to the service.
+    metrics = StageMetrics('service')
+    reply = {'face_locations': [], 'recognized': set(), 'candidates': [], 'logs': [], 'megapixels': None,
+             'generation': None, 'gallery_rows': 0, 'error': None}
+    try:
+        face_locations, encodings, image = detect_and_encode(io.BytesIO(data), expected_faces, reply['logs'],
+                                                             metrics.wrap())
+        reply['face_locations'] = [tuple(int(v) for v in box) for box in face_locations]
+        reply['megapixels'] = round(image.shape[0] * image.shape[1] / 1e6, 2)
+        if len(encodings):
+            metrics.enter("matching")
+            gallery, reply['generation'] = shared_gallery()
+            if section is not None:
+                gallery = _section_view(gallery, reply['generation'], section, members)
+            reply['gallery_rows'] = len(gallery)
+            encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+            reply['recognized'], match_logs, reply['candidates'] = match_faces(encodings, reply['face_locations'],
+                                                                             gallery)
+            reply['logs'].extend(match_logs)
+    except Exception as e:
+        reply['error'] = str(e)
+    reply['stages'] = metrics.finish().stages
+    return reply
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class RecognitionService:
+
+    # One gallery and one pool of warm workers shared by every client. The
+    # gallery is published to shared memory and the workers detect, encode
+    # and match there; confirmations update the gallery here under
+    # gallery_lock and publish a new generation, which each worker picks up
+    # on its next upload. At most
+    # workers + max_queue uploads are admitted at once, the rest are turned
+    # away with 503 and a Retry-After so clients back off instead of piling up.
+    def __init__(self, workers=None, max_queue=None, student_csv='Student.csv'):
+
+        self.workers = workers or SERVICE['workers']
+        self.max_queue = max_queue if max_queue is not None else SERVICE['max_queue']
+        self.gallery, self.reg_no_to_name = load_student_encodings(student_csv)
+        self.sections = read_sections(student_csv)
+        self.journal = open_gallery_journal()
+        self.watcher = RosterWatcher(student_csv) if ROSTER_WATCH.get('enabled') else None
+        self._stopped = threading.Event()
+        self.gallery_lock = threading.Lock()
+        self.shared = SharedGallery()
+        self.shared.publish(self.gallery)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                            initargs=(self.shared.name,))
+        self._admitted = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._pending_lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+        self.served = 0
+        # Starting every worker now keeps model loading out of the first requests.
+        for future in [self.executor.submit(time.sleep, 0) for _ in range(self.workers)]:
+            future.result()
+
+
+    def health(self):
+
+        with self._pending_lock:
+            pending, rejected, served = self.pending, self.rejected, self.served
+        return {'status': 'ok', 'workers': self.workers, 'max_queue': self.max_queue, 'pending': pending,
+                'served': served, 'rejected': rejected, 'students': len(self.reg_no_to_name),
+                'sections': len(self.sections), 'encodings': len(self.gallery), 'generation': self.shared.generation}
+
+
+    def roster(self):
+
+        return {'students': self.reg_no_to_name, 'sections': self.sections, 'encodings': len(self.gallery)}
+
+
+    def recognize(self, data, expected_faces=None, name=None, section=None):
+
+        if not self._admitted.acquire(blocking=False):
+            with self._pending_lock:
+                self.rejected += 1
+            raise ServiceBusy()
+        with self._pending_lock:
+            self.pending += 1
+        started = time.perf_counter()
+        try:
+            # Only the section's Reg Nos go to the worker, which matches
+            # against a view of the shared gallery.
+            members = list(scope_roster(None, self.reg_no_to_name, self.sections, section)[1]) if section else None
+            future = self.executor.submit(_recognize_upload, data, expected_faces, section, members)
+        except BaseException:
+            self._finished()
+            raise
+        # The slot is held until the worker is done, not until this request
+        # gives up: an upload that timed out with 504 keeps its worker busy
+        # and still counts against workers + max_queue.
+        future.add_done_callback(lambda _: self._finished())
+        reply = future.result(timeout=SERVICE['timeout'])
+        return self._result(reply, name, started)
+
+
+    def _finished(self):
+
+        with self._pending_lock:
+            self.pending -= 1
+            self.served += 1
+        self._admitted.release()
+
+
+    def _result(self, reply, name, started):
+
+        metrics = StageMetrics('service', name)
+        # Time spent waiting for a free worker is whatever the worker did not account for.
+        waited = time.perf_counter() - started - sum(reply['stages'].values())
+        metrics.stages.update(reply['stages'])
+        metrics.stages['queued'] = max(0.0, waited)
+
+        face_locations = reply['face_locations']
+        logs = reply['logs']
+        result = {'recognized': [], 'close_matches': [], 'unknown_faces': 0, 'faces': len(face_locations),
+                  'logs': logs}
+        if reply['error']:
+            logs.append(f"[Error] Failed to process image: {reply['error']}")
+        elif not face_locations:
+            logs.append("[Error] No faces detected in the image.")
+        else:
+            recognized, candidates = reply['recognized'], reply['candidates']
+            result['recognized'] = [{'reg_no': reg_no, 'name': self.reg_no_to_name.get(reg_no, "Unknown")}
+                                    for reg_no in sorted(recognized)]
+            result['close_matches'] = [{'reg_no': reg_no, 'name': self.reg_no_to_name.get(reg_no, "Unknown"),
+                                        'distance': float(distance), 'location': location,
+                                        'encoding': [float(v) for v in encoding]}
+                                       for encoding, reg_no, distance, location in candidates]
+            result['unknown_faces'] = sum(1 for log in logs if log.startswith("Unknown face"))
+            metrics.counts.update(gallery_rows=reply['gallery_rows'], generation=reply['generation'],
+                                  recognized=len(recognized), close_matches=len(candidates))
+        metrics.counts.update(faces=len(face_locations), megapixels=reply['megapixels'])
+        record_metrics(metrics.finish())
+        result['timing'] = metrics.to_dict()
+        return result
+
+
+    def confirm(self, reg_no, encoding):
+
+        # An operator confirmed a close match on a client: the encoding joins
+        # the shared gallery, so every client benefits from it.
+        if reg_no not in self.reg_no_to_name:
+            raise KeyError(reg_no)
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        with self.gallery_lock:
+            self.gallery.add(reg_no, encoding)
+            self.journal.add_encoding(reg_no, encoding)
+            dropped = compress_student(self.gallery, reg_no, journal=self.journal)
+            self.journal.sync()
+            if self.journal.needs_compaction():
+                compacted = self.journal.compact(self.gallery, ENCODING_STORE['path'])
+                if compacted and self.watcher is not None:
+                    self.watcher.acknowledge_store()
+            rows = len(self.gallery.encodings_for(reg_no))
+            generation = self.shared.publish(self.gallery)
+        return {'reg_no': reg_no, 'encodings': rows, 'dropped': dropped, 'generation': generation}
+
+
+    def watch_roster(self):
+
+        # Runs on its own thread: roster edits are loaded without holding the
+        # lock, then merged, swapped and published as a new generation.
+        while not self._stopped.wait(self.watcher.interval):
+            if not self.watcher.poll():
+                continue
+            try:
+                update = self.watcher.load_changes()
+                with self.gallery_lock:
+                    gallery = self.watcher.apply(update, self.gallery, self.journal)
+                    if gallery is None:
+                        continue
+                    if update.gallery is not None:
+                        self.journal.close()
+                        self.journal = open_gallery_journal()
+                    self.gallery, self.reg_no_to_name = gallery, update.reg_no_to_name
+                    self.sections = update.sections
+                    generation = self.shared.publish(self.gallery)
+            except Exception as e:
+                print(f"[Error] Failed to reload the roster: {e}")
+                continue
+            if update:
+                print(f"[Log] Roster reloaded: {update}; published generation {generation}.")
+
+
+    def close(self):
+
+        self._stopped.set()
+        self.executor.shutdown(cancel_futures=True)
+        with self.gallery_lock:
+            self.journal.close()
+            self.shared.close()
+
+
+class RecognitionRequestHandler(BaseHTTPRequestHandler):
+
+    # GET /health, GET /roster, POST /recognize (the photo as the raw body,
+    # ?expected_faces=N&name=...&section=...) and POST /confirm ({"reg_no", "encoding"}).
+    # Every response is JSON. With SERVICE['token'] set, every request needs
+    # "Authorization: Bearer <token>".
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+
+        path = urlparse(self.path).path
+        if not self._authorized():
+            self._reply(401, {'error': "missing or wrong service token"}, {'WWW-Authenticate': "Bearer"})
+        elif path == "/health":
+            self._reply(200, self.server.service.health())
+        elif path == "/roster":
+            self._reply(200, self.server.service.roster())
+        else:
+            self._reply(404, {'error': f"unknown path {path}"})
+
+
+    def do_POST(self):
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if not self._authorized():
+            # The body is left unread, so the connection cannot be reused.
+            self.close_connection = True
+            self._reply(401, {'error': "missing or wrong service token"}, {'WWW-Authenticate': "Bearer"})
+            return
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self._reply(411, {'error': "Content-Length required"})
+            return
+        length = int(length)
+        if length > SERVICE['max_upload_bytes']:
+            # The body is left unread, so the connection cannot be reused.
+            self.close_connection = True
+            self._reply(413, {'error': f"upload larger than {SERVICE['max_upload_bytes']} bytes"})
+            return
+        data = self.rfile.read(length)
+        service = self.server.service
+        try:
+            if url.path == "/recognize":
+                expected_faces = int(query['expected_faces'][0]) if 'expected_faces' in query else None
+                name = query.get('name', [None])[0]
+                section = query.get('section', [None])[0]
+                self._reply(200, service.recognize(data, expected_faces, name, section))
+            elif url.path == "/confirm":
+                body = json.loads(data)
+                self._reply(200, service.confirm(body['reg_no'], body['encoding']))
+            else:
+                self._reply(404, {'error': f"unknown path {url.path}"})
+        except ServiceBusy:
+            self._reply(503, {'error': "too many uploads in progress"},
+                        {'Retry-After': str(SERVICE['retry_after'])})
+        except FutureTimeout:
+            self._reply(504, {'error': "recognition timed out"})
+        except KeyError as e:
+            self._reply(400, {'error': f"unknown or missing {e}"})
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+
+
+    def _authorized(self):
+
+        token = SERVICE.get('token')
+        if not token:
+            return True
+        return hmac.compare_digest(self.headers.get("Authorization", "").encode("utf-8"),
+                                   f"Bearer {token}".encode("utf-8"))
+
+
+    def _reply(self, status, body, headers=None):
+
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def log_message(self, format, *args):
+
+        if SERVICE.get('log_requests'):
+            super().log_message(format, *args)
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def make_server(service, host=None, port=None):
+    # Port 0 picks a free port; the bound one is server.server_address[1].
+    # /confirm writes to the gallery, so anything reachable from other
+    # machines needs the shared token.
+    host = host or SERVICE['host']
+    if not is_loopback(host) and not SERVICE.get('token'):
+        raise ValueError(f"Set SERVICE['token'] in my_config.py before serving on {host}; "
+                         "without it only loopback addresses are allowed.")
+    server = ThreadingHTTPServer((host, SERVICE['port'] if port is None else port), RecognitionRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve face recognition to Smart Attendance clients on this "
+                                                 "machine or the local network.")
+    parser.add_argument("--host", default=SERVICE['host'])
+    parser.add_argument("--port", type=int, default=SERVICE['port'])
+    parser.add_argument("--workers", type=int, default=SERVICE['workers'], help="Warm detection processes")
+    parser.add_argument("--max-queue", type=int, default=SERVICE['max_queue'],
+                        help="Uploads allowed to wait for a worker before clients are told to retry")
+    parser.add_argument("--roster", default="Student.csv")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if not is_loopback(args.host) and not SERVICE.get('token'):
+        raise SystemExit(f"[Error] Set SERVICE['token'] in my_config.py before serving on {args.host}.")
+    service = RecognitionService(args.workers, args.max_queue, args.roster)
+    server = make_server(service, args.host, args.port)
+    if service.watcher is not None:
+        threading.Thread(target=service.watch_roster, name="roster-watcher", daemon=True).start()
+    host, port = server.server_address[:2]
+    print(f"[Log] Serving {len(service.reg_no_to_name)} students ({len(service.gallery)} encodings) with "
+          f"{service.workers} warm workers on http://{host}:{port} after {time.perf_counter() - started:.1f} s.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
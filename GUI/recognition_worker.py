@@ -0,0 +1,99 @@
+import itertools
+import os
+import queue
+import threading
+
+
+class RecognitionCancelled(Exception):
+    pass
+
+
+def session_name(image_paths):
+    if isinstance(image_paths, str):
+        return os.path.basename(image_paths)
+    return f"session of {len(image_paths)} photos"
+
+
+class RecognitionJob:
+
+    _ids = itertools.count(1)
+
+    def __init__(self, image_path, scope=None):
+
+        self.job_id = next(self._ids)
+        # A tuple of paths is a multi-photo session; scope is the section it
+        # is matched against (None: everyone).
+        self.image_path = image_path
+        self.scope = scope
+        self.name = session_name(image_path)
+        self.cancel_event = threading.Event()
+
+
+    def cancel(self):
+
+        self.cancel_event.set()
+
+
+class RecognitionWorker:
+
+    # Runs recognitions one at a time on a background thread. The UI thread
+    # submits jobs and drains self.events, which carries
+    # ('progress', job, stage), ('done', job, result), ('cancelled', job, None)
+    # and ('error', job, message) tuples in order.
+    def __init__(self, recognize):
+
+        self.recognize = recognize
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        self.current = None
+        self._thread = threading.Thread(target=self._run, name="recognition-worker", daemon=True)
+        self._thread.start()
+
+
+    def submit(self, image_path, scope=None):
+
+        job = RecognitionJob(image_path, scope)
+        self.jobs.put(job)
+        return job
+
+
+    def cancel_current(self):
+
+        job = self.current
+        if job is not None:
+            job.cancel()
+        return job
+
+
+    def pending(self):
+
+        return self.jobs.qsize()
+
+
+    def _run(self):
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if job.cancel_event.is_set():
+                self.events.put(('cancelled', job, None))
+                continue
+            self.current = job
+            try:
+                result = self.recognize(job.image_path, scope=job.scope,
+                                        progress=lambda stage, job=job: self.events.put(('progress', job, stage)),
+                                        cancel_event=job.cancel_event)
+                self.events.put(('done', job, result))
+            except RecognitionCancelled:
+                self.events.put(('cancelled', job, None))
+            except Exception as e:
+                self.events.put(('error', job, str(e)))
+            finally:
+                self.current = None
+
+
+    def stop(self):
+
+        self.cancel_current()
+        self.jobs.put(None)
@@ -0,0 +1,128 @@
+import os
+import time
+import numpy as np
+from my_config import REJECTIONS
+from gallery import ENCODING_DIM
+
+
+class RejectionMemory:
+
+    # Encodings an operator said were not a given student, kept as one float32
+    # matrix per Reg No with the time each was rejected. Entries older than
+    # max_age_days are dropped, each student keeps only the newest
+    # max_per_student and the whole memory at most max_total.
+    def __init__(self, path=None, threshold=None, max_per_student=None, max_total=None, max_age_days=None):
+
+        self.path = path
+        self.threshold = threshold if threshold is not None else REJECTIONS['similarity_threshold']
+        self.max_per_student = max_per_student or REJECTIONS['max_per_student']
+        self.max_total = max_total or REJECTIONS['max_total']
+        self.max_age_days = max_age_days if max_age_days is not None else REJECTIONS['max_age_days']
+        self._matrices = {}
+        self._times = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                self._load()
+            except Exception as e:
+                print(f"[Warning] Ignoring unreadable rejection memory {path}: {e}")
+        self._expire()
+
+
+    def __len__(self):
+
+        return sum(len(m) for m in self._matrices.values())
+
+
+    def _load(self):
+
+        with np.load(self.path) as data:
+            reg_nos = [str(r) for r in data['reg_nos']]
+            offsets = data['offsets']
+            matrix = data['matrix'].astype(np.float32)
+            times = data['times'].astype(np.float64)
+        for i, reg_no in enumerate(reg_nos):
+            start, stop = offsets[i], offsets[i + 1]
+            self._matrices[reg_no] = matrix[start:stop]
+            self._times[reg_no] = times[start:stop]
+
+
+    def save(self):
+
+        if not self.path or not self.dirty:
+            return
+        reg_nos = list(self._matrices)
+        counts = [len(self._matrices[r]) for r in reg_nos]
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        matrix = (np.vstack([self._matrices[r] for r in reg_nos]) if reg_nos
+                  else np.empty((0, ENCODING_DIM), dtype=np.float32))
+        times = np.concatenate([self._times[r] for r in reg_nos]) if reg_nos else np.empty(0)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, reg_nos=np.array(reg_nos, dtype=str), offsets=offsets, matrix=matrix, times=times)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+    def add(self, reg_no, encoding, now=None):
+
+        now = time.time() if now is None else now
+        row = np.asarray(encoding, dtype=np.float32).reshape(1, ENCODING_DIM)
+        matrix = self._matrices.get(reg_no)
+        if matrix is None:
+            self._matrices[reg_no] = row
+            self._times[reg_no] = np.array([now])
+        else:
+            self._matrices[reg_no] = np.vstack((matrix, row))[-self.max_per_student:]
+            self._times[reg_no] = np.append(self._times[reg_no], now)[-self.max_per_student:]
+        self.dirty = True
+        self._expire(now)
+
+
+    def _expire(self, now=None):
+
+        now = time.time() if now is None else now
+        if self.max_age_days:
+            cutoff = now - self.max_age_days * 86400
+            for reg_no in list(self._matrices):
+                keep = self._times[reg_no] >= cutoff
+                if not keep.all():
+                    self._drop(reg_no, keep)
+        excess = len(self) - self.max_total
+        if excess > 0:
+            # Oldest first across all students.
+            all_times = np.concatenate(list(self._times.values()))
+            cutoff = np.partition(all_times, excess - 1)[excess - 1]
+            for reg_no in list(self._matrices):
+                keep = self._times[reg_no] > cutoff
+                self._drop(reg_no, keep)
+
+
+    def _drop(self, reg_no, keep):
+
+        if keep.any():
+            self._matrices[reg_no] = self._matrices[reg_no][keep]
+            self._times[reg_no] = self._times[reg_no][keep]
+        else:
+            del self._matrices[reg_no]
+            del self._times[reg_no]
+        self.dirty = True
+
+
+    def rejected(self, candidates):
+        # One boolean per close-match candidate (encoding, reg_no, ...): True
+        # when an operator already rejected a near-identical face for that
+        # Reg No. Candidates are grouped per Reg No and each group is checked
+        # with one matrix product.
+        flags = np.zeros(len(candidates), dtype=bool)
+        groups = {}
+        for i, candidate in enumerate(candidates):
+            if candidate[1] in self._matrices:
+                groups.setdefault(candidate[1], []).append(i)
+        for reg_no, positions in groups.items():
+            probes = np.asarray([candidates[i][0] for i in positions], dtype=np.float32).reshape(-1, ENCODING_DIM)
+            matrix = self._matrices[reg_no]
+            d2 = (np.einsum('ij,ij->i', probes, probes)[:, None] - 2.0 * probes @ matrix.T
+                  + np.einsum('ij,ij->i', matrix, matrix)[None, :])
+            flags[positions] = (d2.min(axis=1) < self.threshold ** 2)
+        return flags
@@ -0,0 +1,256 @@
+import os
+import numpy as np
+from my_config import ENCODING_STORE, ROSTER_WATCH
+from gallery import Gallery
+from encoding_cache import ImageEncodingCache
+from face_recognition_module import (_encodings_mtime, encode_images_parallel, load_gallery, read_student_csv,
+                                     store_needs_compression)
+from prototypes import compress_gallery, compress_student
+from sections import section_members
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def roster_images(df):
+    # Reg No -> ((image path, (size, mtime)), ...) for the File Paths column.
+    images = {}
+    for reg_no, paths in zip(df["Reg No"], df["File Paths"]):
+        paths = [p.strip() for p in paths.split(",") if p.strip()]
+        images[reg_no] = tuple((p, _stat(p)) for p in paths)
+    return images
+
+
+class RosterUpdate:
+
+    # What load_changes found. Either gallery is a complete replacement read
+    # from a store another process wrote, or encodings holds the new rows of
+    # added and changed students and removed the Reg Nos that left the
+    # roster; everyone else keeps their rows, confirmed encodings included.
+    # enrolled holds the rows a changed student's old photos gave, so the
+    # rest of their rows (confirmations) survive the change, or None when
+    # those photos are no longer in the image cache.
+    def __init__(self, version, signature):
+
+        self.version = version
+        self.signature = signature
+        self.reg_no_to_name = {}
+        self.sections = {}
+        self.sections_changed = False
+        self.images = {}
+        self.gallery = None
+        self.encodings = {}
+        self.enrolled = {}
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.renamed = 0
+        self.reused = 0
+        self.encoded = 0
+        self.missing = []
+        self.failures = []
+
+
+    def __bool__(self):
+
+        return bool(self.gallery is not None or self.encodings or self.removed or self.renamed
+                    or self.sections_changed)
+
+
+    def __str__(self):
+
+        if self.gallery is not None:
+            return f"reloaded {len(self.gallery)} encodings for {len(self.reg_no_to_name)} students from the store"
+        text = (f"{len(self.added)} students added, {len(self.removed)} removed, {len(self.changed)} with new "
+                f"photos, {self.renamed} renamed; {self.encoded} images encoded, {self.reused} reused")
+        if self.missing:
+            text += f", {len(self.missing)} missing"
+        if self.failures:
+            text += f", {len(self.failures)} failed"
+        if self.sections_changed:
+            text += f"; {len(self.sections)} sections"
+        return text
+
+
+class RosterWatcher:
+
+    # Polls Student.csv and the encoding store by (size, mtime). poll() is a
+    # pair of stat calls and safe to run every few seconds on the UI thread;
+    # load_changes() does the reading and encoding and belongs on a
+    # background thread; apply() builds the new gallery from the current one
+    # plus the update and is meant to run where the gallery is owned, so
+    # nothing added in the meantime is lost. Callers swap the returned
+    # gallery in by reference, so a recognition already running keeps the
+    # snapshot it started with.
+    def __init__(self, student_csv='Student.csv', interval=None):
+
+        self.student_csv = student_csv
+        self.store_path = ENCODING_STORE['path']
+        self.interval = interval or ROSTER_WATCH['interval_seconds']
+        self.version = 0
+        self._signature = self._current_signature()
+        df, self.reg_no_to_name = read_student_csv(student_csv)
+        self.images = roster_images(df)
+        self.sections = section_members(df)
+
+
+    def _current_signature(self):
+
+        return _stat(self.student_csv), _stat(self.store_path)
+
+
+    def poll(self):
+
+        return self._current_signature() != self._signature
+
+
+    def acknowledge_roster(self):
+
+        # Called after this process wrote Student.csv itself and already put
+        # the change into its gallery, so the watcher does not re-encode it.
+        df, self.reg_no_to_name = read_student_csv(self.student_csv)
+        self.images = roster_images(df)
+        self.sections = section_members(df)
+        self._signature = (_stat(self.student_csv), self._signature[1])
+        self.version += 1
+
+
+    def acknowledge_store(self):
+
+        # Called after this process wrote the store itself (a refresh,
+        # compaction or import), so its own write does not trigger a reload.
+        self._signature = (self._signature[0], _stat(self.store_path))
+        self.version += 1
+
+
+    def load_changes(self, progress=None, workers=None):
+
+        signature = self._current_signature()
+        update = RosterUpdate(self.version, signature)
+        df, update.reg_no_to_name = read_student_csv(self.student_csv)
+        update.images = roster_images(df)
+        update.sections = section_members(df)
+        update.sections_changed = update.sections != self.sections
+
+        # A store written after the roster already holds it; map that one
+        # instead of working out the difference.
+        if (signature[1] != self._signature[1] and os.path.exists(self.store_path)
+                and os.path.getmtime(self.student_csv) <= _encodings_mtime(self.store_path)):
+            update.gallery = load_gallery(self.store_path)
+            if store_needs_compression(self.store_path):
+                update.gallery, _ = compress_gallery(update.gallery)
+            return update
+
+        update.removed = [reg_no for reg_no in self.images if reg_no not in update.images]
+        update.added = [reg_no for reg_no in update.images if reg_no not in self.images]
+        update.changed = [reg_no for reg_no in update.images
+                          if reg_no in self.images and update.images[reg_no] != self.images[reg_no]]
+        update.renamed = sum(1 for reg_no, name in update.reg_no_to_name.items()
+                             if reg_no in self.reg_no_to_name and self.reg_no_to_name[reg_no] != name)
+
+        cache = ImageEncodingCache(ENCODING_STORE['image_cache'])
+        # Looked up before key_for below re-stamps the same paths.
+        for reg_no in update.changed:
+            update.enrolled[reg_no] = _cached_encodings(cache, self.images[reg_no])
+        keys = {}
+        pending = []
+        for reg_no in update.added + update.changed:
+            for image_path, stamp in update.images[reg_no]:
+                if stamp is None:
+                    update.missing.append(image_path)
+                    continue
+                try:
+                    keys[image_path] = cache.key_for(image_path)
+                except OSError as e:
+                    update.failures.append((image_path, str(e)))
+                    continue
+                if cache.get(keys[image_path]) is None:
+                    pending.append(image_path)
+                else:
+                    update.reused += 1
+        if pending:
+            for image_path, encodings, error in encode_images_parallel(list(dict.fromkeys(pending)), progress,
+                                                                       workers):
+                if error:
+                    update.failures.append((image_path, error))
+                    cache.discard(keys[image_path])
+                else:
+                    cache.put(keys[image_path], encodings)
+                    update.encoded += 1
+        if keys:
+            cache.save()
+        for reg_no in update.added + update.changed:
+            update.encodings[reg_no] = [e for image_path, _ in update.images[reg_no]
+                                        for e in cache.get(keys.get(image_path), ())]
+        return update
+
+
+    def apply(self, update, gallery, journal=None):
+
+        # Returns the gallery to swap in, or None when the update is stale
+        # because the watcher moved on while it was loading. A merged gallery
+        # is compacted into a new store generation through journal, so the
+        # next start loads it instead of re-encoding everyone.
+        if update.version != self.version:
+            return None
+        signature = update.signature
+        if update.gallery is not None:
+            gallery = update.gallery
+        elif update:
+            gallery = merge_roster_update(gallery, update)
+            if journal is not None and (update.encodings or update.removed):
+                if journal.compact(gallery, self.store_path):
+                    signature = (signature[0], _stat(self.store_path))
+        self._signature = signature
+        self.images = update.images
+        self.sections = update.sections
+        self.reg_no_to_name = dict(update.reg_no_to_name)
+        self.version += 1
+        return gallery
+
+
+def _cached_encodings(cache, images):
+    # The encodings the cache holds for images exactly as they were stamped,
+    # or None when any of them is unknown.
+    rows = []
+    for image_path, stamp in images:
+        cached = cache.paths.get(image_path)
+        if stamp is None or cached is None or cached[0] != stamp or cache.get(cached[1]) is None:
+            return None
+        rows.extend(cache.get(cached[1]))
+    return rows
+
+
+def confirmed_rows(gallery, reg_no, enrolled):
+    # A student's rows that none of their enrollment photos gave, i.e. the
+    # encodings operators confirmed or that were journalled since.
+    if enrolled is None:
+        return []
+    enrolled = {np.asarray(row, dtype=np.float32).tobytes() for row in enrolled}
+    return [row for row in gallery.encodings_for(reg_no) if row.tobytes() not in enrolled]
+
+
+def merge_roster_update(gallery, update):
+    # A new gallery: the current rows minus those of removed and changed
+    # students, then the changed and added students' new rows plus the
+    # changed students' confirmed rows. The current gallery is left
+    # untouched for recognitions still using it.
+    matrix, sq_norms, row_student, reg_nos = gallery.arrays()
+    removed = set(update.removed)
+    replaced = removed | set(update.encodings)
+    kept_students = np.asarray([reg_no not in removed for reg_no in reg_nos], dtype=bool)
+    keep_rows = np.asarray([reg_no not in replaced for reg_no in reg_nos], dtype=bool)[row_student]
+    remap = np.cumsum(kept_students, dtype=np.int64) - 1
+    merged = Gallery.from_arrays(np.array(matrix[keep_rows], dtype=np.float32),
+                                 np.array(sq_norms[keep_rows], dtype=np.float32),
+                                 remap[row_student[keep_rows]].astype(np.int32),
+                                 [reg_no for reg_no, kept in zip(reg_nos, kept_students) if kept])
+    for reg_no, encodings in update.encodings.items():
+        merged.extend(reg_no, list(encodings) + confirmed_rows(gallery, reg_no, update.enrolled.get(reg_no)))
+        compress_student(merged, reg_no)
+    return merged
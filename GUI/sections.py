@@ -0,0 +1,50 @@
+import pandas as pd
+from my_config import SECTIONS
+
+# Course/section membership comes from an optional column of Student.csv
+# ("CS101;CS101-LAB"); a student may be in any number of sections and a
+# roster without the column simply has none.
+
+
+def split_sections(value):
+    if not isinstance(value, str):
+        return []
+    return [section.strip() for section in value.split(SECTIONS['separator']) if section.strip()]
+
+
+def merge_sections(value, sections):
+    # The Sections cell with sections added, keeping the ones already there.
+    merged = split_sections(value)
+    return SECTIONS['separator'].join(merged + [s for s in dict.fromkeys(sections) if s not in merged])
+
+
+def section_members(df):
+    # Section -> Reg Nos in roster order.
+    column = SECTIONS['column']
+    sections = {}
+    if column not in df.columns:
+        return sections
+    for reg_no, value in zip(df["Reg No"], df[column]):
+        for section in split_sections(value):
+            sections.setdefault(section, []).append(reg_no)
+    return sections
+
+
+def read_sections(student_csv='Student.csv'):
+    df = pd.read_csv(student_csv, dtype=str)
+    df["Reg No"] = df["Reg No"].str.strip()
+    return section_members(df)
+
+
+def scope_roster(gallery, reg_no_to_name, sections, section):
+    # The gallery view and Reg No -> Name map of one section, so that faces
+    # are only matched against, and absentees only taken from, the students
+    # who could be in the room. No section means the whole roster. gallery
+    # may be None (a thin client matches on the service).
+    if not section:
+        return gallery, reg_no_to_name
+    if section not in sections:
+        raise ValueError(f"unknown section {section!r}")
+    members = [reg_no for reg_no in sections[section] if reg_no in reg_no_to_name]
+    view = gallery.view(members) if gallery is not None else None
+    return view, {reg_no: reg_no_to_name[reg_no] for reg_no in members}
@@ -0,0 +1,156 @@
+import numpy as np
+import face_recognition as fr
+from PIL import Image
+from my_config import FACE_RECOGNITION, SESSION
+from gallery import Gallery, GalleryView, ENCODING_DIM
+from face_recognition_module import _enter_stage, candidate_strip, detect_images_parallel
+from probe_cache import default_probe_cache
+from prototypes import pairwise_distances
+from instrumentation import StageMetrics, record_metrics
+from recognition_worker import session_name
+
+
+def extract_faces(image_paths, expected_faces=None, progress=None, cancel_event=None, workers=None, use_cache=True):
+    # Yields (image_path, face_locations, encodings, error) per photo. Probe
+    # cache hits are served first; the misses are decoded, detected and
+    # encoded concurrently in the process pool.
+    cache = default_probe_cache() if use_cache else None
+    total = len(image_paths)
+    done = 0
+    misses = []
+    keys = {}
+    for image_path in image_paths:
+        cached = None
+        if cache is not None:
+            try:
+                keys[image_path] = cache.key_for(image_path, expected_faces)
+                cached = cache.get(keys[image_path])
+            except OSError:
+                pass
+        if cached is None:
+            misses.append(image_path)
+            continue
+        done += 1
+        _enter_stage(f"photos {done}/{total}", progress, cancel_event)
+        yield (image_path,) + tuple(cached) + (None,)
+
+    results = detect_images_parallel(misses, workers=workers or SESSION.get('workers'),
+                                     expected_faces=expected_faces)
+    try:
+        for image_path, face_locations, encodings, error in results:
+            done += 1
+            _enter_stage(f"photos {done}/{total}", progress, cancel_event)
+            if not error and image_path in keys:
+                cache.put(keys[image_path], face_locations, encodings)
+            yield image_path, face_locations, encodings, error
+    finally:
+        results.close()
+
+
+def merge_duplicate_faces(faces, max_distance):
+    # faces are (photo, location, encoding). Overlapping shots show the same
+    # student more than once; faces from different photos closer than
+    # max_distance are merged into one group, largest face first, and a group
+    # takes at most one face per photo. Returns the groups as index lists
+    # with the representative (largest) face first. Two similar-looking
+    # students can end up in one group, so groups only decide confirmations,
+    # never who is present.
+    if not faces:
+        return []
+    encodings = np.asarray([encoding for _, _, encoding in faces], dtype=np.float32).reshape(-1, ENCODING_DIM)
+    distances = pairwise_distances(encodings)
+    order = sorted(range(len(faces)), key=lambda i: -_area(faces[i][1]))
+    groups = []
+    group_photos = []
+    for i in order:
+        photo = faces[i][0]
+        best = None
+        for g, group in enumerate(groups):
+            if photo in group_photos[g]:
+                continue
+            distance = distances[i, group[0]]
+            if distance < max_distance and (best is None or distance < distances[i, groups[best][0]]):
+                best = g
+        if best is None:
+            groups.append([i])
+            group_photos.append({photo})
+        else:
+            groups[best].append(i)
+            group_photos[best].add(photo)
+    return groups
+
+
+def _area(location):
+    top, right, bottom, left = location
+    return max(0, bottom - top) * max(0, right - left)
+
+
+def recognize_session(image_paths, student_encodings, reg_no_to_name, expected_faces=None, progress=None,
+                      cancel_event=None, return_metrics=False, workers=None, use_cache=True):
+    # Several overlapping photos of one class taken as a single attendance
+    # session. Returns the same tuple as recognize_faces_in_video: close
+    # matches (at most one per student) are cut into a strip image.
+    if not isinstance(student_encodings, (Gallery, GalleryView)):
+        student_encodings = Gallery.from_encodings(student_encodings)
+    metrics = StageMetrics('session', session_name(image_paths))
+    progress = metrics.wrap(progress)
+    logs = []
+
+    faces = []
+    for image_path, face_locations, encodings, error in extract_faces(image_paths, expected_faces, progress,
+                                                                        cancel_event, workers, use_cache):
+        if error:
+            logs.append(f"[Error] Failed to process {image_path}: {error}")
+        elif not len(encodings):
+            logs.append(f"[Error] No faces detected in {image_path}.")
+        faces.extend((image_path, tuple(location), encoding)
+                     for location, encoding in zip(face_locations, encodings))
+
+    _enter_stage("merging", progress, cancel_event)
+    groups = merge_duplicate_faces(faces, SESSION.get('duplicate_distance', 0.45))
+    logs.append(f"[Log] {len(faces)} faces in {len(image_paths)} photos, {len(groups)} after merging "
+                f"faces seen in more than one photo.")
+
+    # Every face is matched in one vectorised call and merged by the Reg No
+    # it is recognised as, so two similar students in different shots are
+    # both found.
+    _enter_stage("matching", progress, cancel_event)
+    threshold = FACE_RECOGNITION['threshold']
+    confirmation_threshold = threshold + FACE_RECOGNITION.get('confirmation_margin', 0.1)
+    encodings = np.asarray([encoding for _, _, encoding in faces], dtype=np.float32).reshape(-1, ENCODING_DIM)
+    matches = student_encodings.best_matches(encodings) if len(faces) else []
+    recognized_reg_nos = {reg_no for reg_no, distance in matches if distance < threshold}
+
+    # One confirmation per person and per student: a group with a face
+    # recognised in some photo needs none, otherwise its closest match is
+    # offered, and each student is offered once, for the closest face.
+    best_candidates = {}
+    for group in groups:
+        if any(matches[i][1] < threshold for i in group):
+            continue
+        i = min(group, key=lambda i: matches[i][1])
+        reg_no, distance = matches[i]
+        if distance >= confirmation_threshold:
+            logs.append(f"Unknown face with distance: {distance:.3f}")
+        elif reg_no not in recognized_reg_nos:
+            current = best_candidates.get(reg_no)
+            if current is None or distance < matches[current][1]:
+                best_candidates[reg_no] = i
+
+    entries = []
+    images = {}
+    for reg_no, i in best_candidates.items():
+        image_path, location, encoding = faces[i]
+        distance = matches[i][1]
+        if image_path not in images:
+            _enter_stage("loading", progress, cancel_event)
+            images[image_path] = Image.fromarray(fr.load_image_file(image_path))
+        top, right, bottom, left = location
+        entries.append((encoding, reg_no, distance, images[image_path].crop((left, top, right, bottom))))
+    close_match_candidates, strip = candidate_strip(entries)
+
+    metrics.counts.update(photos=len(image_paths), faces=len(faces), unique_faces=len(groups),
+                          recognized=len(recognized_reg_nos), close_matches=len(close_match_candidates))
+    record_metrics(metrics.finish())
+    result = recognized_reg_nos, logs, close_match_candidates, strip
+    return result + (metrics,) if return_metrics else result
@@ -0,0 +1,177 @@
+import os
+import secrets
+from multiprocessing import shared_memory
+import numpy as np
+from gallery import Gallery
+
+# A published gallery is one immutable shared memory segment per generation
+# (header, float32 matrix, squared norms, row -> student, Reg Nos as UTF-8)
+# plus a small control block holding the current generation. Workers map
+# the segment read-only and wrap it with Gallery.from_arrays, so nothing is
+# pickled or copied per worker.
+HEADER_FIELDS = 4
+ALIGN = 64
+
+
+def segment_name(name, generation):
+    return f"{name}_g{generation}"
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _layout(rows, dim, students, width):
+    # Offsets of the matrix, squared norms, row -> student and Reg Nos, and
+    # the segment size.
+    offsets = []
+    offset = _aligned(HEADER_FIELDS * 8)
+    for nbytes in (rows * dim * 4, rows * 4, rows * 4, students * width):
+        offsets.append(offset)
+        offset = _aligned(offset + nbytes)
+    return offsets, offset
+
+
+class SharedGallery:
+
+    # Publishing side, owned by the process that updates the gallery. Each
+    # publish() writes a complete new segment and only then bumps the
+    # generation in the control block, so a reader sees either the old
+    # gallery or the new one, never a mix. The previous segment is kept
+    # until the next publish so readers attaching it meanwhile still find it.
+    def __init__(self, name=None, keep=2):
+
+        self.name = name or f"sa_gallery_{os.getpid()}_{secrets.token_hex(4)}"
+        self.keep = keep
+        self._control = shared_memory.SharedMemory(name=self.name, create=True, size=8)
+        self._generation = np.ndarray((1,), dtype=np.int64, buffer=self._control.buf)
+        self._generation[0] = 0
+        self._segments = {}
+
+
+    @property
+    def generation(self):
+
+        return int(self._generation[0])
+
+
+    def publish(self, gallery):
+
+        matrix, sq_norms, row_student, reg_nos = gallery.arrays()
+        encoded = np.array([reg_no.encode('utf-8') for reg_no in reg_nos] or [b""], dtype='S')[:len(reg_nos)]
+        width = encoded.dtype.itemsize
+        offsets, size = _layout(len(matrix), gallery.dim, len(encoded), width)
+        generation = self.generation + 1
+        segment = shared_memory.SharedMemory(name=segment_name(self.name, generation), create=True, size=size)
+        try:
+            self._write(segment.buf, offsets, (len(matrix), gallery.dim, len(encoded), width),
+                        (np.asarray(matrix, dtype=np.float32), np.asarray(sq_norms, dtype=np.float32),
+                         np.asarray(row_student, dtype=np.int32), encoded))
+        except BaseException:
+            segment.close()
+            segment.unlink()
+            raise
+        self._segments[generation] = segment
+        self._generation[0] = generation
+        for old in [g for g in self._segments if g <= generation - self.keep]:
+            retired = self._segments.pop(old)
+            retired.close()
+            retired.unlink()
+        return generation
+
+
+    @staticmethod
+    def _write(buf, offsets, header, arrays):
+
+        np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=buf)[:] = header
+        for array, offset in zip(arrays, offsets):
+            np.ndarray(array.shape, dtype=array.dtype, buffer=buf, offset=offset)[...] = array
+
+
+    def close(self):
+
+        for segment in self._segments.values():
+            segment.close()
+            segment.unlink()
+        self._segments = {}
+        del self._generation
+        self._control.close()
+        self._control.unlink()
+
+
+class SharedGalleryReader:
+
+    # Attaching side, one per worker process. current() returns the newest
+    # published gallery; it only re-attaches when the generation changed,
+    # so the check costs one integer read per call. The arrays are
+    # read-only views of the segment.
+    def __init__(self, name):
+
+        self.name = name
+        self._control = shared_memory.SharedMemory(name=name)
+        self._generation = np.ndarray((1,), dtype=np.int64, buffer=self._control.buf)
+        self.generation = None
+        self.gallery = None
+        self._segment = None
+        self._retired = []
+
+
+    def current(self):
+
+        while True:
+            generation = int(self._generation[0])
+            if generation == self.generation:
+                return self.gallery, generation
+            try:
+                segment = shared_memory.SharedMemory(name=segment_name(self.name, generation))
+            except FileNotFoundError:
+                # Superseded twice while we looked; read the generation again.
+                continue
+            if self._segment is not None:
+                self._retired.append(self._segment)
+            self.gallery = self._attach(segment)
+            self._segment = segment
+            self.generation = generation
+            self._release_retired()
+
+
+    @staticmethod
+    def _attach(segment):
+
+        rows, dim, students, width = (int(v) for v in np.ndarray((HEADER_FIELDS,), dtype=np.int64,
+                                                                 buffer=segment.buf))
+        offsets, _ = _layout(rows, dim, students, width)
+        arrays = [np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=offset)
+                  for shape, dtype, offset in zip(((rows, dim), (rows,), (rows,), (students,)),
+                                                  (np.float32, np.float32, np.int32, f'S{max(width, 1)}'),
+                                                  offsets)]
+        for array in arrays:
+            array.flags.writeable = False
+        matrix, sq_norms, row_student, reg_nos = arrays
+        return Gallery.from_arrays(matrix, sq_norms, row_student, reg_nos)
+
+
+    def _release_retired(self):
+
+        # An old segment can only be unmapped once no gallery built on it is
+        # referenced any more.
+        for segment in list(self._retired):
+            try:
+                segment.close()
+            except BufferError:
+                continue
+            self._retired.remove(segment)
+
+
+_reader = None
+
+
+def attach_shared_gallery(name):
+    # Pool initializer for workers that match against a published gallery.
+    global _reader
+    _reader = SharedGalleryReader(name)
+
+
+def shared_gallery():
+    # (gallery, generation) in a worker set up by attach_shared_gallery.
+    return _reader.current()
@@ -1,9 +1,10 @@
-import pickle
+import numpy as np
+from encoding_store import student_offsets
+from my_config import ENCODING_STORE
 
-# Load the student encodings
-with open("student_encodings.pkl", "rb") as f:
-    student_encodings = pickle.load(f)
+# Load the student index from the encoding store
+reg_nos, offsets = student_offsets(ENCODING_STORE['path'])
 
 # Print the keys (Reg Nos) and the number of encodings for each student
-for reg_no, encodings in student_encodings.items():
-    print(f"Reg No: {reg_no}, Encodings Count: {len(encodings)}")
+for reg_no, count in zip(reg_nos, np.diff(offsets)):
+    print(f"Reg No: {reg_no.decode('utf-8')}, Encodings Count: {count}")
@@ -0,0 +1,264 @@
+import face_recognition as fr
+from PIL import Image
+from my_config import FACE_RECOGNITION, VIDEO
+from gallery import Gallery, GalleryView
+from face_recognition_module import _enter_stage, candidate_strip, detect_faces
+from enhancement import enhance_regions
+from instrumentation import StageMetrics, record_metrics
+
+VIDEO_EXTENSIONS = tuple(VIDEO['extensions'])
+
+
+def _require_cv2():
+    try:
+        import cv2
+    except ImportError:
+        raise ImportError("Video attendance needs OpenCV: pip install opencv-python")
+    return cv2
+
+
+def is_video(path):
+    return path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def iter_video_frames(video_path, every=1):
+    # Yields (index, rgb_frame, frame_count) for every `every`-th frame. The
+    # frames in between are only grabbed, never converted.
+    cv2 = _require_cv2()
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise IOError(f"Cannot open video: {video_path}")
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+    index = 0
+    try:
+        while capture.grab():
+            if index % every == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                yield index, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), frame_count
+            index += 1
+    finally:
+        capture.release()
+
+
+class FaceTrack:
+
+    def __init__(self, track_id, box):
+
+        self.track_id = track_id
+        self.box = box
+        self.template = None
+        self.score = 1.0
+        self.missed = 0
+        self.needs_encoding = True
+        self.encodings = []
+        self.best_match = None
+        self.best_distance = 1.0
+        self.best_encoding = None
+        self.best_crop = None
+
+
+def _iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    if right <= left or bottom <= top:
+        return 0.0
+    inter = (right - left) * (bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class FaceTracker:
+
+    # Template-matching tracker on a downscaled grey frame. Detection runs
+    # every few frames; in between, each track is followed by searching a
+    # window around its last position. A low match score marks the track for
+    # re-encoding at the next detection pass.
+    def __init__(self, scale, min_score, min_iou, max_missed):
+
+        self.cv2 = _require_cv2()
+        self.scale = scale
+        self.min_score = min_score
+        self.min_iou = min_iou
+        self.max_missed = max_missed
+        self.tracks = []
+        self.finished = []
+        self._next_id = 1
+
+
+    def _grey(self, frame):
+
+        cv2 = self.cv2
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+
+    def _small_box(self, box, grey):
+
+        height, width = grey.shape
+        top, right, bottom, left = (int(v * self.scale) for v in box)
+        return max(0, top), min(width, right), min(height, bottom), max(0, left)
+
+
+    def _set_template(self, track, grey):
+
+        top, right, bottom, left = self._small_box(track.box, grey)
+        track.template = grey[top:bottom, left:right].copy() if bottom > top + 4 and right > left + 4 else None
+
+
+    def follow(self, frame):
+
+        cv2 = self.cv2
+        grey = self._grey(frame)
+        for track in self.tracks:
+            if track.template is None:
+                continue
+            top, right, bottom, left = self._small_box(track.box, grey)
+            box_h, box_w = track.template.shape
+            pad_y, pad_x = box_h // 2, box_w // 2
+            y0, x0 = max(0, top - pad_y), max(0, left - pad_x)
+            window = grey[y0:min(grey.shape[0], bottom + pad_y), x0:min(grey.shape[1], right + pad_x)]
+            if window.shape[0] < box_h or window.shape[1] < box_w:
+                track.score = 0.0
+                track.needs_encoding = True
+                continue
+            result = cv2.matchTemplate(window, track.template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(result)
+            track.score = score
+            if score < self.min_score:
+                track.needs_encoding = True
+                continue
+            top, left = (y0 + dy) / self.scale, (x0 + dx) / self.scale
+            track.box = (int(top), int(left + box_w / self.scale), int(top + box_h / self.scale), int(left))
+            track.template = window[dy:dy + box_h, dx:dx + box_w].copy()
+
+
+    def update(self, frame, boxes):
+
+        # Greedy IoU association of fresh detections with existing tracks.
+        pairs = sorted(((_iou(track.box, box), t, d) for t, track in enumerate(self.tracks)
+                        for d, box in enumerate(boxes)), reverse=True)
+        matched_tracks, matched_boxes = set(), set()
+        for iou, t, d in pairs:
+            if iou < self.min_iou or t in matched_tracks or d in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(d)
+            track = self.tracks[t]
+            track.box = boxes[d]
+            track.missed = 0
+
+        grey = self._grey(frame)
+        active = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    self.finished.append(track)
+                    continue
+            else:
+                self._set_template(track, grey)
+            active.append(track)
+        for d, box in enumerate(boxes):
+            if d not in matched_boxes:
+                track = FaceTrack(self._next_id, box)
+                self._next_id += 1
+                self._set_template(track, grey)
+                active.append(track)
+        self.tracks = active
+        return [track for track in active if track.missed == 0]
+
+
+    def all_tracks(self):
+
+        return self.finished + self.tracks
+
+
+def recognize_faces_in_video(video_path, student_encodings, reg_no_to_name, progress=None, cancel_event=None,
+                             return_metrics=False):
+    if not isinstance(student_encodings, (Gallery, GalleryView)):
+        student_encodings = Gallery.from_encodings(student_encodings)
+    metrics = StageMetrics('video', video_path)
+    progress = metrics.wrap(progress)
+
+    logs = []
+    threshold = FACE_RECOGNITION['threshold']
+    confirmation_threshold = threshold + FACE_RECOGNITION.get('confirmation_margin', 0.1)
+    track_every = VIDEO['track_every']
+    # Only every track_every-th frame is decoded, so detection runs on every
+    # n-th of those: every detect_every frames when it is a multiple of
+    # track_every, otherwise at the nearest shorter interval.
+    detect_stride = max(1, VIDEO['detect_every'] // track_every)
+    max_encodings = VIDEO['max_encodings_per_track']
+
+    tracker = FaceTracker(VIDEO['track_scale'], VIDEO['min_track_score'], VIDEO['min_iou'],
+                          VIDEO['max_missed_detections'])
+    encoded_faces = 0
+    detections = 0
+    last_reported = -1
+
+    _enter_stage("loading", progress, cancel_event)
+    for index, frame, frame_count in iter_video_frames(video_path, track_every):
+        if (index // track_every) % detect_stride:
+            tracker.follow(frame)
+            continue
+
+        # Report progress about every tenth of the clip; check for
+        # cancellation on every detection pass.
+        decile = index * 10 // frame_count if frame_count else index // (detect_stride * track_every * 100)
+        report = progress if decile > last_reported else None
+        last_reported = max(last_reported, decile)
+        _enter_stage(f"frames {index}" + (f"/{frame_count}" if frame_count else ""), report, cancel_event)
+        detections += 1
+
+        # No full-resolution fallback: an empty frame is normal in a video,
+        # so the frame is only shrunk as far as VIDEO's own minimum face
+        # size and resolution allow.
+        tracks = tracker.update(frame, detect_faces(frame, expected_faces=0, settings=VIDEO))
+        to_encode = [t for t in tracks
+                     if (t.needs_encoding or t.best_distance >= threshold) and len(t.encodings) < max_encodings]
+        if not to_encode:
+            continue
+        # Encoded from enhanced crops, like the photos and the gallery, so
+        # distances compare against the same thresholds.
+        encodings = []
+        for crop, box in enhance_regions(frame, [t.box for t in to_encode]):
+            encodings.extend(fr.face_encodings(crop, known_face_locations=[box], model=FACE_RECOGNITION['model']))
+        encoded_faces += len(encodings)
+        for track, encoding, (reg_no, distance) in zip(to_encode, encodings,
+                                                       student_encodings.best_matches(encodings)):
+            track.encodings.append(encoding)
+            track.needs_encoding = False
+            if distance < track.best_distance:
+                top, right, bottom, left = track.box
+                track.best_match, track.best_distance, track.best_encoding = reg_no, distance, encoding
+                track.best_crop = Image.fromarray(frame[max(0, top):bottom, max(0, left):right])
+
+    _enter_stage("matching", progress, cancel_event)
+    tracks = [t for t in tracker.all_tracks() if t.encodings]
+    logs.append(f"[Log] {len(tracks)} face tracks, {encoded_faces} encodings computed.")
+
+    recognized_reg_nos = set()
+    best_candidates = {}
+    for track in tracks:
+        if track.best_distance < threshold:
+            recognized_reg_nos.add(track.best_match)
+        elif track.best_distance < confirmation_threshold:
+            current = best_candidates.get(track.best_match)
+            if current is None or track.best_distance < current.best_distance:
+                best_candidates[track.best_match] = track
+        else:
+            logs.append(f"Unknown face with distance: {track.best_distance:.3f}")
+
+    candidates = [t for reg_no, t in best_candidates.items() if reg_no not in recognized_reg_nos]
+    close_match_candidates, strip = candidate_strip([(t.best_encoding, t.best_match, t.best_distance, t.best_crop)
+                                                     for t in candidates])
+
+    metrics.counts.update(detection_frames=detections, tracks=len(tracks), encodings=encoded_faces,
+                          recognized=len(recognized_reg_nos), close_matches=len(close_match_candidates))
+    record_metrics(metrics.finish())
+    result = recognized_reg_nos, logs, close_match_candidates, strip
+    return result + (metrics,) if return_metrics else result
+
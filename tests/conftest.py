@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+# The application modules live flat in GUI/ and import each other by name.
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, "GUI"))
+
+
+@pytest.fixture
+def roster(tmp_path, monkeypatch):
+    # A three-student Student.csv in a scratch working directory, so the
+    # encoding store, journal and caches the app writes stay out of the repo.
+    monkeypatch.chdir(tmp_path)
+    rows = [("4", "Daniel Radcliffe", "Daniel.jpg"), ("5", "Emma Watson", "Emma.jpg"),
+            ("6", "Rupert Grint", "Rupert.jpg")]
+    with open("Student.csv", "w") as f:
+        f.write("Reg No,Name,File Paths\n")
+        for reg_no, name, image in rows:
+            f.write(f"{reg_no},{name},{os.path.join(REPO, 'Images', image)}\n")
+    return tmp_path / "Student.csv"
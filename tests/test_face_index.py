@@ -0,0 +1,29 @@
+from my_config import FACE_RECOGNITION
+from gallery import Gallery
+from face_index import AutoIndex, ExactIndex, IVFIndex, make_index, measure_recall
+from benchmark import synthetic_encodings, synthetic_probes
+
+
+def test_ivf_agrees_with_exact_search_above_ann_min_rows():
+    per_student = 3
+    students = FACE_RECOGNITION['ann_min_rows'] // per_student + 1000
+    encodings_dict, centres = synthetic_encodings(students, per_student)
+    gallery = Gallery.from_encodings(encodings_dict, index=ExactIndex())
+    assert len(gallery) >= FACE_RECOGNITION['ann_min_rows']
+
+    probes = synthetic_probes(centres, 500)
+    recall = measure_recall(gallery, probes, IVFIndex(nprobe=FACE_RECOGNITION['ann_nprobe']))
+    assert recall >= 0.95
+
+
+def test_auto_index_switches_to_ivf_at_ann_min_rows():
+    index = make_index({'index': 'auto', 'ann_min_rows': 100, 'ann_nprobe': 4})
+    assert isinstance(index, AutoIndex)
+    assert index.approximate.nprobe == 4
+
+    encodings_dict, centres = synthetic_encodings(20, per_student=3)
+    small = Gallery.from_encodings(encodings_dict, index=ExactIndex())
+    assert index.candidate_rows(centres[:2], small.matrix, 0) is None
+    encodings_dict, centres = synthetic_encodings(50, per_student=3)
+    large = Gallery.from_encodings(encodings_dict, index=ExactIndex())
+    assert len(index.candidate_rows(centres[:2], large.matrix, 0)) == 2
@@ -0,0 +1,78 @@
+import multiprocessing
+import numpy as np
+from gallery import Gallery, ENCODING_DIM
+from encoding_store import load_store, store_generation, write_store
+from gallery_journal import GalleryJournal, replay_journal
+
+
+def _row(value):
+    return np.full(ENCODING_DIM, value, dtype=np.float32)
+
+
+def _stored(store_path, journal_path):
+    gallery = load_store(store_path)
+    replay_journal(gallery, journal_path, store_generation(store_path))
+    return gallery
+
+
+def test_compaction_keeps_the_other_writers_records(tmp_path):
+    store_path, journal_path = str(tmp_path / "store.bin"), str(tmp_path / "store.journal")
+    write_store(Gallery.from_encodings({"A": [_row(0.0)], "B": [_row(0.5)]}), store_path)
+    app, service = (GalleryJournal(journal_path, store_generation(store_path)) for _ in range(2))
+    app_gallery = load_store(store_path)
+
+    app_gallery.add("A", _row(0.1))
+    app.add_encoding("A", _row(0.1))
+    service.add_encoding("B", _row(0.6))
+    assert app.compact(app_gallery, store_path)
+    assert len(app_gallery.encodings_for("B")) == 2
+
+    # The service appends after a compaction it did not see: the record
+    # lands in the new journal.
+    service.add_encoding("B", _row(0.7))
+    stored = _stored(store_path, journal_path)
+    assert len(stored.encodings_for("A")) == 2
+    assert len(stored.encodings_for("B")) == 3
+    app.close()
+    service.close()
+
+
+def test_second_compaction_is_skipped(tmp_path):
+    store_path, journal_path = str(tmp_path / "store.bin"), str(tmp_path / "store.journal")
+    write_store(Gallery.from_encodings({"A": [_row(0.0)]}), store_path)
+    first, second = (GalleryJournal(journal_path, store_generation(store_path)) for _ in range(2))
+    second.add_encoding("A", _row(0.2))
+    assert first.compact(load_store(store_path), store_path)
+    assert not second.compact(load_store(store_path), store_path)
+    assert len(_stored(store_path, journal_path).encodings_for("A")) == 2
+    first.close()
+    second.close()
+
+
+def _writer(store_path, journal_path, reg_no, count, compact_every, opened):
+    journal = GalleryJournal(journal_path, store_generation(store_path))
+    gallery = load_store(store_path)
+    opened.wait()
+    for i in range(count):
+        row = _row(hash((reg_no, i)) % 1000 / 1000)
+        gallery.add(reg_no, row)
+        journal.add_encoding(reg_no, row)
+        if compact_every and (i + 1) % compact_every == 0:
+            journal.compact(gallery, store_path)
+    journal.close()
+
+
+def test_concurrent_writers_lose_nothing(tmp_path):
+    store_path, journal_path = str(tmp_path / "store.bin"), str(tmp_path / "store.journal")
+    write_store(Gallery.from_encodings({"A": [], "B": []}), store_path)
+    opened = multiprocessing.Barrier(2)
+    writers = [multiprocessing.Process(target=_writer, args=(store_path, journal_path, "A", 150, 40, opened)),
+               multiprocessing.Process(target=_writer, args=(store_path, journal_path, "B", 150, 0, opened))]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+    stored = _stored(store_path, journal_path)
+    assert len(stored.encodings_for("A")) == 150
+    assert len(stored.encodings_for("B")) == 150
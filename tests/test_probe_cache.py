@@ -0,0 +1,24 @@
+import os
+import numpy as np
+import pytest
+from conftest import REPO
+
+pytest.importorskip("face_recognition")
+
+import face_recognition_module
+from gallery import Gallery
+
+
+def test_cache_hit_returns_the_same_image_as_a_miss(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Every face becomes a close match, so both calls return the photo.
+    monkeypatch.setattr(face_recognition_module, "match_faces",
+                        lambda encodings, locations, gallery: (set(), [], [(encodings[0], "1", 0.5, locations[0])]))
+    gallery = Gallery.from_encodings({"1": [np.zeros(128, dtype=np.float32)]})
+    photo = os.path.join(REPO, "Images", "Daniel.jpg")
+
+    miss = face_recognition_module.recognize_faces_in_image(photo, gallery, {"1": "Test"})
+    hit = face_recognition_module.recognize_faces_in_image(photo, gallery, {"1": "Test"})
+
+    assert any(log.startswith("[Log] Reused cached faces") for log in hit[1])
+    assert np.array_equal(miss[3], hit[3])
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from my_config import FACE_RECOGNITION
+from gallery import Gallery
+from face_index import ExactIndex
+from encoding_store import read_header, write_store
+from prototypes import compress_gallery, max_prototypes_per_student
+from benchmark import synthetic_encodings
+
+
+def _synthetic(students=300, per_student=40, probes=1000):
+    encodings_dict, centres = synthetic_encodings(students, per_student)
+    rng = np.random.default_rng(1)
+    truth = rng.choice(students, probes)
+    probes = centres[truth] + rng.normal(0.0, 0.025, (probes, centres.shape[1])).astype(np.float32)
+    return Gallery.from_encodings(encodings_dict, index=ExactIndex()), probes
+
+
+def test_prototypes_agree_with_the_full_gallery():
+    full, probes = _synthetic()
+    cap = max_prototypes_per_student()
+    compressed, dropped = compress_gallery(full)
+    compressed.index = ExactIndex()
+    assert dropped == len(full) - cap * full.num_students
+
+    threshold = FACE_RECOGNITION['threshold']
+    answers = [[reg_no if distance < threshold else None for reg_no, distance in gallery.best_matches(probes)]
+               for gallery in (full, compressed)]
+    agreement = np.mean([a == b for a, b in zip(*answers)])
+    assert agreement >= 0.95
+
+
+def test_store_records_its_largest_student(tmp_path):
+    full, _ = _synthetic(students=20, per_student=15, probes=1)
+    compressed, _ = compress_gallery(full)
+    write_store(full, str(tmp_path / "full.bin"))
+    write_store(compressed, str(tmp_path / "compressed.bin"))
+    assert read_header(str(tmp_path / "full.bin"))['max_rows_per_student'] == 15
+    assert read_header(str(tmp_path / "compressed.bin"))['max_rows_per_student'] == max_prototypes_per_student()
+
+
+def test_only_stores_over_the_cap_are_compressed_on_load(tmp_path):
+    pytest.importorskip("face_recognition")
+    from face_recognition_module import store_needs_compression
+    full, _ = _synthetic(students=20, per_student=15, probes=1)
+    write_store(full, str(tmp_path / "full.bin"))
+    write_store(compress_gallery(full)[0], str(tmp_path / "compressed.bin"))
+    assert store_needs_compression(str(tmp_path / "full.bin"))
+    assert not store_needs_compression(str(tmp_path / "compressed.bin"))
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+import pytest
+from conftest import REPO
+
+pytest.importorskip("face_recognition")
+
+from my_config import SERVICE
+from face_recognition_module import recognize_faces_in_image
+from recognition_client import RecognitionClient, ServiceError
+from recognition_service import RecognitionService, make_server
+
+PHOTO = os.path.join(REPO, "Reference_Images", "Daniel_Emma_Rupert.jpg")
+
+
+@pytest.fixture
+def service(roster):
+    # One warm worker and no queue, so a second upload in flight is turned away.
+    service = RecognitionService(workers=1, max_queue=0, student_csv=str(roster))
+    server = make_server(service, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    service.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield service
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def _summary(result):
+    recognized, _, candidates, _ = result
+    return recognized, [(reg_no, round(distance, 4), location) for _, reg_no, distance, location in candidates]
+
+
+def test_recognize_matches_local_recognition(service):
+    remote = RecognitionClient(service.url).recognize(PHOTO)
+    local = recognize_faces_in_image(PHOTO, service.gallery, service.reg_no_to_name)
+    assert _summary(remote) == _summary(local)
+    assert [log for log in remote[1] if log.startswith("[Error]")] == []
+
+
+def test_second_upload_is_turned_away_with_retry_after(service):
+    # The only worker is kept busy, so the first upload holds the only slot
+    # while it waits for it.
+    blocker = service.executor.submit(time.sleep, 2)
+    with open(PHOTO, "rb") as f:
+        data = f.read()
+    first = []
+    thread = threading.Thread(target=lambda: first.append(RecognitionClient(service.url).recognize_upload(data)))
+    thread.start()
+    deadline = time.monotonic() + 5
+    while service.health()['pending'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    with pytest.raises(ServiceError) as busy:
+        RecognitionClient(service.url, retries=0).recognize_upload(data)
+    assert busy.value.status == 503
+    assert busy.value.retry_after == str(SERVICE['retry_after'])
+
+    blocker.result()
+    thread.join()
+    assert first and first[0]['faces'] > 0
+    assert service.health()['rejected'] == 1
+
+
+def test_confirm_adds_the_encoding_to_the_gallery(service):
+    client = RecognitionClient(service.url)
+    encoding = service.gallery.encodings_for("4")[0] + 0.01
+    before = len(service.gallery.encodings_for("4"))
+    generation = client.health()['generation']
+
+    reply = client.confirm("4", encoding)
+
+    assert reply['encodings'] == len(service.gallery.encodings_for("4")) == before + 1
+    assert reply['generation'] > generation
+    with pytest.raises(ServiceError) as unknown:
+        client.confirm("999", encoding)
+    assert unknown.value.status == 400
+
+
+def test_token_is_required_off_loopback_and_checked(service, monkeypatch):
+    with pytest.raises(ValueError):
+        make_server(service, "0.0.0.0", 0)
+
+    monkeypatch.setitem(SERVICE, 'token', "secret")
+    assert RecognitionClient(service.url).health()['status'] == "ok"
+    with pytest.raises(urllib.error.HTTPError) as denied:
+        urllib.request.urlopen(service.url + "/health", timeout=5)
+    assert denied.value.code == 401
@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import pytest
+from conftest import REPO
+
+pytest.importorskip("face_recognition")
+
+from face_recognition_module import load_student_encodings, open_gallery_journal
+from roster_watcher import RosterWatcher
+
+
+def _rewrite_photo(roster, reg_no, image):
+    lines = roster.read_text().splitlines()
+    lines = [f"{reg_no},{line.split(',')[1]},{os.path.join(REPO, 'Images', image)}"
+             if line.split(",")[0] == reg_no else line for line in lines]
+    # A different file name length also changes the size, so the edit is
+    # seen even where timestamps are coarse.
+    roster.write_text("\n".join(lines) + "\n")
+
+
+def _has_row(rows, row):
+    return any(np.array_equal(r, row) for r in rows)
+
+
+def test_changed_photo_keeps_confirmed_rows_and_is_persisted(roster):
+    gallery, _ = load_student_encodings(str(roster))
+    watcher = RosterWatcher(str(roster))
+    journal = open_gallery_journal()
+    old_rows = gallery.encodings_for("4").copy()
+    confirmed = (old_rows[0] + 0.02).astype(np.float32)
+    gallery.add("4", confirmed)
+    journal.add_encoding("4", confirmed)
+
+    _rewrite_photo(roster, "4", "Kit.jpg")
+    assert watcher.poll()
+    update = watcher.load_changes()
+    assert update.changed == ["4"]
+    merged = watcher.apply(update, gallery, journal)
+
+    rows = merged.encodings_for("4")
+    assert _has_row(rows, confirmed)
+    assert not any(_has_row(rows, row) for row in old_rows)
+    assert len(merged.encodings_for("5")) == len(gallery.encodings_for("5"))
+    # The merge was written as a new store generation, which is what the
+    # next start loads, and the watcher does not reload its own write.
+    assert not watcher.poll()
+    reloaded, _ = load_student_encodings(str(roster))
+    assert np.array_equal(reloaded.encodings_for("4"), rows)
+    journal.close()
+
+
+def test_acknowledged_roster_write_is_not_reloaded(roster):
+    load_student_encodings(str(roster))
+    watcher = RosterWatcher(str(roster))
+    _rewrite_photo(roster, "5", "Kit.jpg")
+    watcher.acknowledge_roster()
+    assert not watcher.poll()
+    assert watcher.images["5"][0][0].endswith("Kit.jpg")
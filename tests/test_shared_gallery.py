@@ -0,0 +1,26 @@
+from concurrent.futures import ProcessPoolExecutor
+from gallery import Gallery
+from shared_gallery import SharedGallery, attach_shared_gallery
+from benchmark import _match_shared, synthetic_encodings, synthetic_probes
+
+
+def test_workers_match_like_this_process_and_follow_new_generations():
+    encodings_dict, centres = synthetic_encodings(500)
+    gallery = Gallery.from_encodings(encodings_dict)
+    probes = synthetic_probes(centres, 40)
+    expected = [match[0] for match in gallery.best_matches(probes)]
+
+    shared = SharedGallery()
+    try:
+        first = shared.publish(gallery)
+        with ProcessPoolExecutor(max_workers=2, initializer=attach_shared_gallery,
+                                 initargs=(shared.name,)) as executor:
+            results = list(executor.map(_match_shared, [probes] * 4))
+            assert all(result[1] == expected and result[2] == first for result in results)
+
+            gallery.add("S_new", probes[0])
+            generation = shared.publish(gallery)
+            results = list(executor.map(_match_shared, [probes[:1]] * 4))
+        assert all(result[1] == ["S_new"] and result[2] == generation for result in results)
+    finally:
+        shared.close()